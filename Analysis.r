@@ -1,5 +1,5 @@
 library('haven')
-library('readxl')
+library('arrow')
 library('dplyr')
 library('randomForest') 
 library('caTools')
@@ -13,10 +13,10 @@ set.seed(41) # set random seed # for reproducibility
 ###
 Loader <- function(sheetName, PV_num) {
   dev <- getwd()
-  data_path <- file.path(dev, 'result', sprintf('preprocessing%s.xlsx', PV_num))
+  data_path <- file.path(dev, 'result', sprintf('preprocessing%s_%s.parquet', PV_num, sheetName))
     
   print(paste('>> PV', PV_num, 'READ variable is loaded'))
-  df <- read_excel(data_path, sheet=sheetName)
+  df <- as.data.frame(read_parquet(data_path))
   df$resilient <- as.factor(df$resilient)
   df <- subset(df, select=-c(ESCS))
   summary(df)
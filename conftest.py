@@ -0,0 +1 @@
+# project directory is added to sys.path by pytest, so tests import src like main.py
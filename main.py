@@ -1,8 +1,5 @@
 import os
 import argparse
-from src.load import Load
-from src.eda import main
-from huniutils.manage_os import check_prerequisite_dir
 
 App_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -12,6 +9,11 @@ if __name__ == '__main__':
                         help="init project, create required folder")
     parser.add_argument('--load', action="store_true",
                         help="load data and filter nation")
+    parser.add_argument('--nations', action='store', nargs='+', default=None,
+                        help="CNTRYID labels of nations to load, like Korea 'United States' Japan, or all for every nation")
+    
+    parser.add_argument('--strict', action='store_true',
+                        help="stop loading when some column has too many NA only in some nations, otherwise it is warned")
     
     parser.add_argument('--eda', action="store_true",
                         help="exploratory data analysis")
@@ -21,28 +23,99 @@ if __name__ == '__main__':
                         help="run eda on all PVs")
     parser.add_argument('--visualize', action='store_true',
                         help="decide visualize or not")
+    parser.add_argument('--format', action='store', default='parquet', choices=['parquet', 'feather'],
+                        help="output format of eda result")
+    parser.add_argument('--excel', action='store_true',
+                        help="also write excel files, in background")
+    parser.add_argument('--weighted', action='store_true',
+                        help="weight ESCS threshold by W_FSTUWT and write weighted estimates with replicate standard errors")
+    parser.add_argument('--out_of_core', action='store_true',
+                        help="run load and eda of every PV batch by batch over nation partitions, memory is bounded by --batch_size")
+    parser.add_argument('--batch_size', action='store', type=int, default=50000,
+                        help="number of student rows of one batch of --out_of_core")
+    parser.add_argument('--cow', action='store_true',
+                        help="copy-on-write mode, release each stage after it is consumed")
+    parser.add_argument('--rf', action='store_true',
+                        help="run random forest on eda result in memory, instead of Analysis.r")
+    parser.add_argument('--ntree', action='store', type=int, default=5000,
+                        help="number of trees of random forest, upper bound with --tol")
+    parser.add_argument('--tol', action='store', type=float, default=None,
+                        help="stop growing trees once change of oob error is within tol and ranking of top 10 variables is stable")
+    parser.add_argument('--importance_samples', action='store', type=int, default=None,
+                        help="permutation importance of each tree uses at most this many out-of-bag rows")
+    parser.add_argument('--replicates', action='store', type=int, default=1,
+                        help="number of random forest fits per PV and nation, like rf_loop of Analysis.r")
+    parser.add_argument('--jobs', action='store', type=int, default=1,
+                        help="number of workers of random forest(--rf), trees(--PV) or PV x nation x replicate fits(--loop) "
+                             "run in parallel. eda is one vectorized pass over nations and PVs and doesn't use it")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time load, eda and random forest on synthetic data, result is appended to result/benchmark.csv")
+    parser.add_argument('--students', action='store', type=int, default=6000,
+                        help="number of students per nation of synthetic data for --benchmark")
+    parser.add_argument('--repeats', action='store', type=int, default=2,
+                        help="number of pipeline runs of --benchmark, runs after first one use cache")
+    parser.add_argument('--profile', action='store', default=None,
+                        help="profile this stage, like drop_student or Load._load_zipfile")
+    parser.add_argument('--profiler', action='store', default='cprofile', choices=['cprofile', 'sample'],
+                        help="cProfile(every call) or sampling profiler(low overhead) for --profile")
 
     args = parser.parse_args()
     
+    # modules are imported by command, so light command doesn't load pandas, pyarrow or sklearn
+    measured = args.load or args.eda or args.out_of_core
+    if measured:
+        from src import instrument # benchmark starts its own run
+        run = instrument.start_run('_'.join(cmd for cmd in ['load', 'eda', 'rf', 'out_of_core'] if getattr(args, cmd)),
+                                   profile=args.profile, profiler=args.profiler)
+
     if args.init:
+        from huniutils.manage_os import check_prerequisite_dir
         check_prerequisite_dir(App_dir,
                                ['data', 'logs', 'result'])
     
     if args.load:
-        Loader = Load(codeBook='codebook.xlsx')
-        Loader.defaultCleaner()
+        from src.load import Load
+        nations = 'all' if args.nations == ['all'] else args.nations
+        Loader = Load(codeBook='codebook.xlsx', nations=nations)
+        Loader.defaultCleaner(excel=args.excel, strict=args.strict)
 
     if args.eda:
+        from src.eda import main, main_all_PV
+        if args.rf:
+            from src import model, sweep
         if args.PV is not None:
             assert (int(args.PV) < 11) and (int(args.PV) > 0), f"invalid argument PV, only 1 to 10 is allowed"
-            if args.visualize:
-                main(int(args.PV), True)
-            else:
-                main(int(args.PV), False)
+            eda = main(int(args.PV), args.visualize, copy_on_write=args.cow, fmt=args.format, excel=args.excel,
+                       impute=args.rf, weighted=args.weighted)
+            if args.rf and (args.replicates > 1):
+                sliced = eda.data_final['sliced']
+                sweep.main(sliced.drop('resilient', axis=1), sliced[['resilient']].to_numpy(), [int(args.PV)],
+                           replicates=args.replicates, ntree=args.ntree, jobs=args.jobs, tol=args.tol,
+                           importance_samples=args.importance_samples, imputers=eda.imputer['sliced'])
+            elif args.rf:
+                model.main(eda.data_final, int(args.PV), ntree=args.ntree, n_jobs=args.jobs, tol=args.tol,
+                           importance_samples=args.importance_samples, codebook=eda.cb, imputers=eda.imputer['sliced'])
         
         if args.loop:
-            for idx in range(1, 11):
-                if args.visualize:
-                    main(idx, True)
-                else:
-                    main(idx, False)
\ No newline at end of file
+            eda = main_all_PV(args.visualize, copy_on_write=args.cow, fmt=args.format, excel=args.excel,
+                              impute=args.rf, weighted=args.weighted)
+            if args.rf:
+                merged, label = eda.data_merged_PV['sliced']
+                sweep.main(merged, label, eda.PV_list,
+                           replicates=args.replicates, ntree=args.ntree, jobs=args.jobs, tol=args.tol,
+                           importance_samples=args.importance_samples, imputers=eda.imputer['sliced'])
+
+    if args.out_of_core:
+        from src import outofcore
+        nations = 'all' if args.nations == ['all'] else args.nations
+        outofcore.main(nations=nations, fmt=args.format, batch_size=args.batch_size, weighted=args.weighted,
+                       strict=args.strict)
+
+    if measured:
+        run.save() # run.json and summary.txt of every stage in logs/runs
+
+    if args.benchmark:
+        from src import benchmark
+        benchmark.main(students=args.students, repeats=args.repeats, ntree=args.ntree, jobs=args.jobs,
+                       profile=args.profile, profiler=args.profiler)
+        print(benchmark.compare(os.path.join(App_dir, 'result', 'benchmark.csv')))
@@ -0,0 +1,178 @@
+import os
+import gc
+import sys
+import shutil
+import logging
+from logging.config import dictConfig
+from contextlib import contextmanager
+import subprocess
+import tempfile
+import pandas as pd
+
+# logging
+from src.utils import generate_logger
+from src import instrument
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# directory
+App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+Result_dir = os.path.join(App_dir, 'result')
+
+
+class Benchmark:
+    r"""
+    wall time, cpu time and peak RSS of each stage, appended to result/benchmark.csv so that runs can be compared
+    - stages are measured by instrument.Run, stages inside them are in run.json of logs/runs
+    - peak RSS is of main process, memory of process pool workers(reading spss, --jobs) is not included
+    - every record has run id, commit and parameters of the run
+    """
+    def __init__(self, params: dict = None, profile: str = None, profiler: str = 'cprofile'):
+        self.run = instrument.start_run('benchmark', profile=profile, profiler=profiler)
+        self.run_id = self.run.run_id
+        self.params = dict() if params is None else params
+        self.commit = Benchmark._commit()
+        self.records = []
+
+    @contextmanager
+    def stage(self, name: str, repeat: int = 0):
+        gc.collect()
+        with self.run.measure(name) as measured:
+            yield
+        self.records.append({'run_id': self.run_id, 'commit': self.commit, 'repeat': repeat, 'stage': name,
+                             **{metric: measured[metric] for metric in ['wall_time', 'cpu_time', 'peak_rss']},
+                             **self.params})
+
+    def table(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records)
+
+    def save(self, path: str) -> pd.DataFrame:
+        r"""append records to csv file, header is written only when file is new"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rs = Benchmark.table(self)
+        rs.to_csv(path, mode='a', index=False, header=not os.path.isfile(path))
+        return rs
+
+    @staticmethod
+    def _commit() -> str:
+        r"""short hash of checked out commit, None outside git repository"""
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=App_dir, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+
+def run_pipeline(bench: Benchmark,
+                 data_dir: str,
+                 result_dir: str,
+                 repeat: int = 0,
+                 PV: int = 1,
+                 ntree: int = 500,
+                 jobs: int = 1,
+                 seed: int = 41):
+    r"""Load, every EDA stage of single PV run and random forest of each nation, each as one stage
+    - stages are the ones of main.py --load and main.py --eda --PV 1 --rf --weighted
+    - from second repeat, load and eda stages hit base store and stage cache like rerun of user
+    """
+    # imported here, so that import time of each module is not counted in first stage
+    from src.load import Load
+    from src.eda import EDA
+    from src import model
+
+    with bench.stage('load', repeat):
+        loader = Load(codeBook='codebook.xlsx', data_dir=data_dir)
+    with bench.stage('clean', repeat):
+        loader.defaultCleaner()
+    del loader
+
+    with bench.stage('eda.read', repeat):
+        eda = EDA(codebook_name='codebook.xlsx', PV_var=PV, weighted=True, data_dir=data_dir, result_dir=result_dir)
+    with bench.stage('eda.join', repeat):
+        eda.join_splited_data()
+    with bench.stage('eda.drop', repeat):
+        eda.drop_student(na_threshold=30)
+    with bench.stage('eda.slice', repeat):
+        eda.slice_by_ESCS(acad_threshold=480)
+    with bench.stage('eda.estimate', repeat):
+        eda.estimate_weighted(acad_threshold=480)
+    with bench.stage('eda.adjust', repeat):
+        eda.minor_adjustment()
+    with bench.stage('eda.impute', repeat):
+        eda.impute()
+    with bench.stage('eda.save', repeat):
+        eda.save_result()
+
+    with bench.stage('model', repeat):
+        for label, national in model.split_nation(eda.data_final['sliced']).items():
+            model.do_random_forest(national, ntree=ntree, n_jobs=jobs, seed=seed,
+                                   imputer=eda.imputer['sliced'].get(label))
+
+
+def compare(path: str, baseline: str = None, current: str = None, repeat: int = 0) -> pd.DataFrame:
+    r"""wall time and peak RSS of two runs side by side, last two runs of file by default
+
+    Returns
+    -------
+    pd.DataFrame
+        index is stage, ratio is current / baseline
+    """
+    records = pd.read_csv(path, dtype={'run_id': str, 'commit': str})
+    records = records[records['repeat'] == repeat]
+    runs = list(pd.unique(records['run_id']))
+    current = runs[-1] if current is None else current
+    baseline = ([run for run in runs if run != current] or [current])[-1] if baseline is None else baseline
+
+    rs = dict()
+    for name, run_id in [('baseline', baseline), ('current', current)]:
+        rs[name] = records[records['run_id'] == run_id].set_index('stage')[['wall_time', 'peak_rss']]
+    rs = pd.concat(rs, axis=1)
+    for metric in ['wall_time', 'peak_rss']:
+        rs[('ratio', metric)] = (rs[('current', metric)] / rs[('baseline', metric)]).round(3)
+    return rs
+
+
+def main(students: int = 6000,
+         repeats: int = 2,
+         ntree: int = 500,
+         jobs: int = 1,
+         seed: int = 0,
+         data_dir: str = None,
+         output: str = None,
+         profile: str = None,
+         profiler: str = 'cprofile') -> pd.DataFrame:
+    r"""generate synthetic data and benchmark whole pipeline on it
+
+    Parameters
+    ----------
+    students: int
+        students per nation of synthetic data
+    repeats: int
+        number of pipeline runs on same data, repeat 0 is cold run and later ones are rerun with cache
+    data_dir: str
+        folder of synthetic data, temporary folder which is removed afterwards when None
+    output: str
+        csv file records are appended to, result/benchmark.csv when None
+    profile: str
+        stage to profile in every repeat, see instrument.Run
+    """
+    from src import synthetic
+
+    output = os.path.join(Result_dir, 'benchmark.csv') if output is None else output
+    work_dir = tempfile.mkdtemp(prefix='pisa_benchmark_')
+    data_dir = os.path.join(work_dir, 'data') if data_dir is None else data_dir
+    bench = Benchmark(params={'students': students, 'ntree': ntree, 'jobs': jobs,
+                              'python': sys.version.split()[0], 'pandas': pd.__version__},
+                      profile=profile, profiler=profiler)
+    try:
+        with bench.stage('generate'):
+            synthetic.generate(data_dir, students=students, seed=seed)
+        for repeat in range(repeats):
+            run_pipeline(bench, data_dir, os.path.join(work_dir, 'result'), repeat=repeat, ntree=ntree, jobs=jobs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    rs = bench.save(output)
+    bench.run.save()
+    logger.debug(f'benchmark {bench.run_id} is written in {output}\n{rs[["repeat", "stage", "wall_time", "peak_rss"]]}')
+    return rs
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import zipfile
+import logging
+from logging.config import dictConfig
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+Src_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+def hash_parts(*parts) -> str:
+    r"""sha256 of json serialized parts, dict keys are sorted so order of keys doesn't matter"""
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def archive_fingerprint(zipfile_dir: str) -> str:
+    r"""fingerprint of zip archive from its central directory(name, crc, size of every member)
+    - content based, but doesn't read multi GB member data
+    """
+    with zipfile.ZipFile(zipfile_dir, 'r') as zip_folder:
+        members = [(info.filename, info.CRC, info.file_size) for info in zip_folder.infolist()]
+    return hash_parts(members)
+
+
+def frame_fingerprint(data: pd.DataFrame) -> str:
+    r"""fingerprint of dataframe content, like codebook"""
+    values = pd.util.hash_pandas_object(data.astype(str), index=False).to_numpy()
+    return hash_parts(list(data.columns), hashlib.sha256(values.tobytes()).hexdigest())
+
+
+def code_version(*module_names) -> str:
+    r"""fingerprint of source code of src modules, change of code invalidates stages which use it"""
+    digest = hashlib.sha256()
+    for name in module_names:
+        with open(os.path.join(Src_dir, f'{name}.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class StageCache:
+    r"""
+    content addressed cache of pipeline stages.
+    key of each stage is hash of its inputs(parent stage key, parameters, code version),
+    so change of codebook or parameter reruns only stages which depend on it.
+    each entry is directory of arrow files with meta.json, least recently used entry is evicted
+    when cache becomes larger than max_bytes.
+
+    layout: {root}/cache/{stage}-{key}/{name}.arrow
+    """
+    def __init__(self, root: str, max_bytes: int = 20 * 1024**3):
+        self.root = os.path.join(root, 'cache')
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    def key(self, stage: str, *parts) -> str:
+        return f'{stage}-{hash_parts(stage, *parts)[:20]}'
+
+    def get(self, key: str):
+        r"""return (frames, meta) of entry, None when entry doesn't exist"""
+        entry = os.path.join(self.root, key)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.isfile(meta_path):
+            logger.debug(f'cache miss: {key}')
+            return None
+        with open(meta_path, 'r') as f:
+            manifest = json.load(f)
+        frames = {name: feather.read_table(os.path.join(entry, f'{IDX}.arrow'), memory_map=True).to_pandas()
+                  for IDX, name in enumerate(manifest['frames'])}
+        os.utime(meta_path) # mark as recently used
+        logger.debug(f'cache hit: {key}')
+        return frames, manifest['meta']
+
+    def put(self, key: str, frames: dict, meta: dict = None):
+        r"""write entry, frames is {name: pd.DataFrame}, meta should be json serializable"""
+        entry = os.path.join(self.root, key)
+        tmp_entry = f'{entry}.tmp{os.getpid()}'
+        os.makedirs(tmp_entry, exist_ok=True)
+        for IDX, data in enumerate(frames.values()):
+            table = pa.Table.from_pandas(data)
+            feather.write_feather(table, os.path.join(tmp_entry, f'{IDX}.arrow'), compression='uncompressed')
+        with open(os.path.join(tmp_entry, 'meta.json'), 'w') as f:
+            json.dump({'frames': list(frames.keys()), 'meta': meta, 'created': time.time()}, f, default=str)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry) # entry appears at once, half written entry is never read
+        StageCache.evict(self, keep=key)
+
+    def evict(self, keep: str = None):
+        r"""remove least recently used entries until cache fits max_bytes"""
+        entries = []
+        for key in os.listdir(self.root):
+            entry = os.path.join(self.root, key)
+            meta_path = os.path.join(entry, 'meta.json')
+            if not os.path.isfile(meta_path):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            entries.append((os.path.getmtime(meta_path), size, key))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
+            logger.debug(f'cache evicted: {key}')
+
+
+def flatten(data: dict, sep: str = '.') -> dict:
+    r"""flatten nested dict(or list) of dataframe, {'SK': [stu, sch]} -> {'SK.0': stu, 'SK.1': sch}"""
+    rs = dict()
+    for name, value in data.items():
+        if isinstance(value, pd.DataFrame):
+            rs[str(name)] = value
+        else:
+            items = value.items() if isinstance(value, dict) else enumerate(value)
+            for sub_name, sub_value in flatten(dict(items), sep=sep).items():
+                rs[f'{name}{sep}{sub_name}'] = sub_value
+    return rs
+
+
+def unflatten(frames: dict, sep: str = '.') -> dict:
+    r"""inverse of flatten, digit keys become list"""
+    rs = dict()
+    for name, value in frames.items():
+        node = rs
+        parts = name.split(sep)
+        for part in parts[:-1]:
+            node = node.setdefault(part, dict())
+        node[parts[-1]] = value
+
+    def to_list(node):
+        if isinstance(node, pd.DataFrame):
+            return node
+        node = {name: to_list(value) for name, value in node.items()}
+        if all(name.isdigit() for name in node.keys()):
+            return [node[name] for name in sorted(node.keys(), key=int)]
+        return node
+    return to_list(rs)
@@ -1,23 +1,19 @@
 import os
 import logging
 from logging.config import dictConfig
-import copy
+import numpy as np
 import pandas as pd
 
-# visualize
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style("darkgrid")
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams["figure.autolayout"] = True
-
-# font
-import matplotlib.font_manager as fm
-font_list = [font.name for font in fm.fontManager.ttflist]
-plt.rcParams['font.family'] = 'Malgun Gothic'
-
 # logging
-from src.utils import generate_logger, timeit, load_data
+from src.utils import generate_logger, row_wise_na, describe_by
+from src.instrument import stage
+from src.store import Store
+from src.nation import NATION_KEY, REAL_NAME, resolve_nations, group_rows, split_by_nation, stack_nations, group_quantile, broadcast
+from src.join import aggregate_teacher, join_school_level
+from src.writer import write_frames, write_excel, wait_excel
+from src.cache import StageCache, code_version, flatten, unflatten
+from src.impute import RoughFix, NON_PREDICTORS
+from src.weights import FINAL_WEIGHT, WEIGHT_COLUMNS, resilient_estimates
 dictConfig(generate_logger(__name__))
 logger = logging.getLogger(__name__)
 
@@ -30,57 +26,91 @@ Result_dir = os.path.join(App_dir, 'result')
 class EDA:
     def __init__(self,
                  codebook_name: str,
-                 PV_var: int):
+                 PV_var: int = None,
+                 columns: list = None,
+                 teacher_aggregation: dict = None,
+                 copy_on_write: bool = False,
+                 weighted: bool = False,
+                 data_dir: str = Data_dir,
+                 result_dir: str = Result_dir):
+        r"""
+        - PV_var: PV of single PV run, None when every PV is processed by *_all_PV methods
+        - columns: load only these columns from cleaned store, every column is loaded when None
+        - teacher_aggregation: {column: list of 'mean', 'share', 'count'}, see join.aggregate_teacher
+        - copy_on_write: turn on pandas copy-on-write and release each stage once next stage consumed it
+        - weighted: ESCS threshold of labeling is quantile weighted by W_FSTUWT, see EDA.estimate_weighted
+        - data_dir, result_dir: folder of cleaned store and codebook, folder of result, data/ and result/ by default
+        """
         assert type(codebook_name) == str
-        assert type(PV_var) == int
+        assert (PV_var is None) or (type(PV_var) == int)
 
-        self.data = load_data(os.path.join(App_dir, 'data', 'cleaned.pkl'))
-        self.cb = pd.read_excel(os.path.join(Data_dir, codebook_name))
+        self.data_dir = data_dir
+        self.result_dir = result_dir
+        store = Store(data_dir)
+        self.data = store.read_national('cleaned', columns=columns)
+        self.cb = pd.read_excel(os.path.join(data_dir, codebook_name))
         self.PV_var = PV_var
-
-        self.nation_real_name = {'SK': '대한민국', 'US': '미국'}
-        self.data_final = {'full': {'SK': pd.DataFrame(), 'US': pd.DataFrame()},
-                        'sliced': {'SK': pd.DataFrame(), 'US': pd.DataFrame()}}
+        self.columns = columns
+        self.cache = StageCache(data_dir)
+        self.stage_key = {'clean': store.read_key('cleaned')} # None when cleaned data has no key, then nothing is cached
+        self.teacher_aggregation = teacher_aggregation
+        self.copy_on_write = copy_on_write
+        self.weight = FINAL_WEIGHT if weighted else None
+        if copy_on_write:
+            pd.set_option('mode.copy_on_write', True)
+
+        # {nation: CNTRYID label} of cleaned store, nations of load.Load
+        nation_code = resolve_nations((store.read_meta('cleaned') or {}).get('nation_code'))
+        self.nations = {nation: nation_code.get(nation, nation) for nation in self.data.keys()}
+        self.nation_real_name = {nation: REAL_NAME.get(nation, label) for nation, label in self.nations.items()}
+        self.data_final = {'full': pd.DataFrame(), 'sliced': pd.DataFrame()}
     
+    @stage(source='data')
     def join_splited_data(self):
         r"""
         join student, school and teacher dataframe at once
+        - nations are stacked first and joined once, CNTSCHID is unique over nations
+        - school data is joined on CNTSCHID
+        - teacher data is aggregated to school level first, see EDA.teacher_aggregation
         """
         logger.debug(f'step1. join dataframe')
-        data_1_join = dict()
-
-        for nationalName, inputNational in self.data.items():
-            df_student = inputNational[0].copy()
-            df_school = inputNational[1].copy()
-            df_teacher = inputNational[2].copy()
-            logger.debug(f'student data: {df_student.shape}')
-            logger.debug(f'school data: {df_school.shape}')
-            logger.debug(f'teacher data: {df_teacher.shape}')
-            
-            df_student.reset_index(drop=True, inplace=True)
-            rs = copy.deepcopy(df_student)
-            before = df_student.shape
-
-            # if school data exists, merge it
-            if df_school.shape[1] <= EDA._demographic_column_count(self):
-                logger.critical('school data is empty')
-            else:
-                EDA._match_info(data_ref=df_student, data=df_school)
-            
-            # if teacher data exists, merge it
-            if df_teacher.shape[1] <= EDA._demographic_column_count(self):
-                logger.critical('teacher data is empty')
-            else:
-                EDA._match_info(data_ref=df_student, data=df_teacher)
-
-            after = rs.shape
-            logger.debug(f'Bef: {before}, Aft: {after}')
-            data_1_join[nationalName] = rs
+        key = EDA._stage_key(self, 'join', 'clean', self.columns, self.teacher_aggregation, code_version('join', 'eda'))
+        cached = EDA._cache_get(self, key)
+        if cached is not None:
+            self.data_1_join = cached['data']
+            EDA._release(self, 'data')
+            return self.data_1_join
+
+        df_student, df_school, df_teacher = [stack_nations({nationalName: inputNational[IDX]
+                                                            for nationalName, inputNational in self.data.items()})
+                                             for IDX in range(3)]
+        logger.debug(f'student data: {df_student.shape}')
+        logger.debug(f'school data: {df_school.shape}')
+        logger.debug(f'teacher data: {df_teacher.shape}')
+        before = df_student.shape
+        school_level = []
+
+        # if school data exists, merge it
+        if df_school.shape[1] <= EDA._demographic_column_count(self):
+            logger.critical('school data is empty')
+        else:
+            school_level.append(('sch', df_school))
+        
+        # if teacher data exists, aggregate to school level and merge it
+        if df_teacher.shape[1] <= EDA._demographic_column_count(self):
+            logger.critical('teacher data is empty')
+        else:
+            school_level.append(('tch', aggregate_teacher(df_teacher, aggregation=self.teacher_aggregation)))
+
+        data_1_join = join_school_level(df_student, school_level)
+        logger.debug(f'Bef: {before}, Aft: {data_1_join.shape}')
         
         self.data_1_join = data_1_join
+        EDA._cache_put(self, key, {'data': data_1_join})
+        EDA._release(self, 'data')
         return data_1_join
         
-    @timeit
+    @stage(source='data_1_join')
     def drop_student(self,
                      na_threshold: int,
                      is_visualize=False):
@@ -93,83 +123,40 @@ class EDA:
             remove rows that contain more than a threshold numbver of NA values.
         """
         logger.debug(f'step2. Verify na and Drop student')
-        def column_wise_NA(inputData) -> dict:
-            r"""generate column-wise NA ratio"""
-            if type(inputData) == dict:
-                merged = pd.concat([inputData['SK'], inputData['US']])
-                assert merged.shape[0] == inputData['SK'].shape[0] + inputData['US'].shape[0]
-            
-            elif type(inputData) == pd.DataFrame:
-                merged = copy.deepcopy(inputData)
-            
-            else:
-                raise TypeError('dictionary or pd.DataFrame is allowed')
-            
-            describeDF = merged.describe().T
-            describeDF['NA_ratio'] = round(100 - describeDF['count']/merged.shape[0]*100, 2)
-
-            newColumnOrder = [describeDF.columns[0], 'NA_ratio'] + list(describeDF.columns[1:-1])
-            describeDF= describeDF[newColumnOrder]
-            return describeDF
-
-        # student-wise data validation
-        def row_wise_NA(inputData: dict, is_visualize: bool, na_threshold: int) -> dict:
-            r"""calculate NA ratio per student"""
-            merged = pd.concat([inputData['SK'], inputData['US']])
-            assert merged.shape[0] == inputData['SK'].shape[0] + inputData['US'].shape[0]
-
-            for_histogram = {}
-            rs = {}
-            for label, data in zip(['full', 'SK', 'US'], [merged, inputData['SK'], inputData['US']]):
-                for_histogram[label] = []
-                to_drop = []
-
-                for i in range(len(data.index)) :
-                    na_cnt = data.iloc[i].isnull().sum()
-                    na_ratio = round((na_cnt/data.shape[1]) * 100, 0)
-                    for_histogram[label].append(na_ratio)
-                    if na_cnt > na_threshold:
-                        to_drop.append(i)
-                logger.debug(f'NA drop of {label}: {len(to_drop)}')
-                rs[label] = data.drop(to_drop, axis=1)
-
-            if is_visualize == True:
-                plt.figure(figsize=(17,6))
-
-                plt.subplot(1, 3, 1)
-                plt.hist(for_histogram['full'])
-                plt.title('\nFull Data\n')
-                plt.xlabel('\nNA ratio(%)\n')
-                plt.ylabel('frequency')
-                
-                plt.subplot(1, 3, 2)
-                plt.hist(for_histogram['SK'])
-                plt.title('\nSouth Korea\n')
-                plt.xlabel('\nNA ratio(%)\n')
-                plt.ylabel('frequency')
-                
-                plt.subplot(1, 3, 3)
-                plt.hist(for_histogram['US'])
-                plt.title('\nUnited States\n')
-                plt.xlabel('\nNA ratio(%)\n')
-                plt.ylabel('frequency')
-
-                plt.savefig(os.path.join(Data_dir, f'NA_ratio.png'))
-
-            return rs
-        
-        self.rs_deescriptive_Full = column_wise_NA(self.data_1_join)
-        self.rs_deescriptive_SK = column_wise_NA(self.data_1_join['SK'])
-        self.rs_deescriptive_US = column_wise_NA(self.data_1_join['US'])
-
-        clean_data_using_rowwise_NA = row_wise_NA(self.data_1_join, na_threshold=na_threshold, is_visualize=is_visualize)
-        self.data_2_dropNA = {
-            "SK": clean_data_using_rowwise_NA['SK'],
-            "US": clean_data_using_rowwise_NA['US']
-        }
+        key = EDA._stage_key(self, 'drop', 'join', na_threshold, code_version('utils', 'eda'))
+        cached = None if is_visualize else EDA._cache_get(self, key) # histogram needs row-wise NA ratio
+        if cached is not None:
+            self.rs_deescriptive = cached['describe']
+            self.data_2_dropNA = cached['data']
+            EDA._release(self, 'data_1_join')
+            return self.data_2_dropNA
+
+        # column-wise NA ratio and statistics of full data and each nation
+        describe = describe_by(self.data_1_join, key=NATION_KEY)
+        self.rs_deescriptive = {'Full': describe['Full'],
+                                **{nation: describe.get(label) for nation, label in self.nations.items()}}
+
+        # student-wise data validation, NA is counted once over every nation
+        groups = group_rows(self.data_1_join)
+        na_info = row_wise_na(self.data_1_join, na_threshold=na_threshold, groups=groups)
+        for nation, label in self.nations.items():
+            logger.debug(f"NA drop of {nation}: {na_info[label]['drop'].sum() if label in na_info else 0}")
+        logger.debug(f"NA drop of full: {na_info['full']['drop'].sum()}")
+
+        if is_visualize == True:
+            from src import visualize # matplotlib is imported only when figure is drawn
+            for_histogram = {'full': na_info['full']['ratio'],
+                             **{nation: na_info[label]['ratio'] for nation, label in self.nations.items() if label in na_info}}
+            visualize.na_ratio_histogram(for_histogram, os.path.join(self.data_dir, f'NA_ratio.png'),
+                                         titles={nation: f'\n{label}\n' for nation, label in self.nations.items()})
+
+        self.data_2_dropNA = self.data_1_join.loc[~na_info['full']['drop']]
+        EDA._cache_put(self, key, {'data': self.data_2_dropNA, 'describe': self.rs_deescriptive})
+        EDA._release(self, 'data_1_join')
         return self.data_2_dropNA
     
 
+    @stage(source='data_2_dropNA')
     def slice_by_ESCS(self,
                       acad_threshold: int,
                       is_visualize=False) -> dict:
@@ -183,87 +170,122 @@ class EDA:
         """
         logger.debug('step3. slice data by ESCS')
 
-        def visualize(data: dict, option: str, threshold_info: dict,
-                    figName: str):
-            r"""visualize threshold and ratio of sample distribution
-
-            Parameters
-            ----------
-            option: str
-                full or sliced
-            figName: str
-                title of figure
-            """
-            plt.figure(figsize=(17,9))
-            for IDX, (nationalName, inputNational) in enumerate(data.items()):
-
-                plt.subplot(2, 2, 2*IDX+1)
-                plt.hist(inputNational['AcademicScore'])
-                plt.title(f'\nAcademic Achievement{self.nation_real_name[nationalName]}\n')
-                plt.xlabel('\nScore\n')
-                plt.axvline(threshold_info[nationalName]['academic_score'], color='r', linewidth=1, linestyle='--')
-                
-                plt.subplot(2, 2, 2*IDX+2)
-                plt.hist(inputNational['ESCS'])
-                plt.title(f'\nESCS{self.nation_real_name[nationalName]}\n')
-                plt.xlabel('\nScore\n')
-                if option=='full':
-                    plt.axvline(threshold_info[nationalName]['escs_score'], color='r', linewidth=1, linestyle='--')
-                
-            plt.savefig(os.path.join(Result_dir, f'{figName}_{option}.png'))
-        
         ## 1. calculate threshold value
         threshold_info, data_appended = EDA.thresholdCalculator(self.data_2_dropNA,
                                                             PV_var = self.PV_var,
-                                                            acad_threshold = acad_threshold) ##!#!## 학업성취 코딩 방법을 바꿀 때 여기 arg를 조정
+                                                            acad_threshold = acad_threshold,
+                                                            nations = self.nations,
+                                                            weight = self.weight) ##!#!## 학업성취 코딩 방법을 바꿀 때 여기 arg를 조정
         
         
-        ## 2. slice
-        data_3_ESCS = {
-            "full": copy.copy(data_appended), # no drop case, so just copied
-            "sliced": EDA.slice_data_by_escs(data_appended, escsThreshold = threshold_info)
-        }
-        assert type(data_3_ESCS['full']) == dict
-
-
-        ## 3. labeling resilient student
-        data_3_ESCS['full'] = EDA.labeling_resilient(data = data_3_ESCS['full'], 
-                                                option = 'full',
-                                                threshold_info = threshold_info)
-        data_3_ESCS['sliced'] = EDA.labeling_resilient(data = data_3_ESCS['sliced'], 
-                                                option = 'sliced',
-                                                threshold_info = threshold_info)
+        ## 2. labeling resilient student, slice by escs score in same pass
+        data_3_ESCS = EDA.split_resilient(data_appended, threshold_info = threshold_info, nations = self.nations)
         self.data_3_ESCS = data_3_ESCS
+        EDA._release(self, 'data_2_dropNA')
         
-        ## 4. visualize resilient student
+        ## 3. visualize resilient student
         if is_visualize == True:
-            resilientCount_Ratio_full = EDA.table_resilient_ratio(data=self.data_3_ESCS['full'])
-            resilientCount_Ratio = EDA.table_resilient_ratio(data=self.data_3_ESCS['sliced'])
+            resilientCount_Ratio_full = EDA.table_resilient_ratio(data=self.data_3_ESCS['full'], nations=self.nations, weight=self.weight)
+            resilientCount_Ratio = EDA.table_resilient_ratio(data=self.data_3_ESCS['sliced'], nations=self.nations, weight=self.weight)
         
-            visualize(self.data_3_ESCS['full'], option='full', figName=f'Read{self.PV_var}', threshold_info= threshold_info)
-            visualize(self.data_3_ESCS['sliced'], option = 'sliced', figName =f'Read{self.PV_var}(target paper)', threshold_info= threshold_info)
+            for option, figName in [('full', f'Read{self.PV_var}'), ('sliced', f'Read{self.PV_var}(target paper)')]:
+                view = split_by_nation(self.data_3_ESCS[option][[NATION_KEY, 'AcademicScore', 'ESCS']], self.nations)
+                EDA._visualize_threshold(self, view, option=option, figName=figName, threshold_info=threshold_info)
         
             logger.debug(f"# of academic resilient student(full): {resilientCount_Ratio_full}")
             logger.debug(f'# of academic resilient student(sliced): {resilientCount_Ratio}')
             return resilientCount_Ratio
         return data_3_ESCS
     
+    @stage(source='data_2_dropNA', target='data_3_ESCS')
+    def slice_by_ESCS_all_PV(self,
+                             acad_threshold: int,
+                             PV_list: list = list(range(1, 11)),
+                             is_visualize=False) -> dict:
+        r"""
+        slice_by_ESCS for several PVs at once
+
+        - escs threshold and sliced students don't depend on PV, so they are computed once
+        - academic score and resilient label are computed as (student x PV) matrix over every nation
+
+        Parameters
+        ----------
+        acad_threshold: int
+            academic score thrshold
+        PV_list: list
+            PV numbers, from 1 to 10
+        """
+        logger.debug('step3. slice data by ESCS, all PVs')
+        assert type(acad_threshold) == int, 'insert valid threshold type'
+        assert all((PV > 0) and (PV < 11) for PV in PV_list), print('>> Error__PV_list: ', PV_list)
+        self.PV_list = list(PV_list)
+
+        data = self.data_2_dropNA
+        escs_score, is_low_escs, label = EDA._label_all_PV(data, acad_threshold, self.PV_list, self.nations, weight=self.weight)
+        threshold_info = {nation: {'academic_score': acad_threshold, 'escs_score': escs_score[nation]}
+                          for nation in self.nations.keys()}
+        logger.debug(f">> before: {data.shape[0]} >> after: {is_low_escs.sum()}")
+
+        data_3_ESCS = {'full': data, 'sliced': data.loc[is_low_escs]}
+        resilient_label = {'full': label, 'sliced': label[is_low_escs]}
+        self.data_3_ESCS = data_3_ESCS
+        self.resilient_label = resilient_label
+        EDA._release(self, 'data_2_dropNA')
+
+        if is_visualize == True:
+            for IDX, PV in enumerate(self.PV_list):
+                for option, figName in [('full', f'Read{PV}'), ('sliced', f'Read{PV}(target paper)')]:
+                    view = pd.DataFrame({NATION_KEY: data_3_ESCS[option][NATION_KEY].to_numpy(),
+                                         'AcademicScore': data_3_ESCS[option][f'PV{PV}READ'].to_numpy(),
+                                         'ESCS': data_3_ESCS[option]['ESCS'].to_numpy()})
+                    EDA._visualize_threshold(self, split_by_nation(view, self.nations), option=option,
+                                             figName=figName, threshold_info=threshold_info)
+                    view['resilient'] = resilient_label[option][:, IDX]
+                    if self.weight is not None:
+                        view[self.weight] = data_3_ESCS[option][self.weight].to_numpy()
+                    logger.debug(f'# of academic resilient student({option}, PV{PV}): '
+                                 f'{EDA.table_resilient_ratio(view, self.nations, weight=self.weight)}')
+        return resilient_label
+
+    @stage(source='data_3_ESCS')
+    def estimate_weighted(self,
+                          acad_threshold: int,
+                          PV_list: list = None) -> pd.DataFrame:
+        r"""weighted ESCS threshold and resilient ratio of each nation with standard errors,
+        written as result/weighted_estimates.csv
+        - students kept by drop_student are used, run before minor_adjustment drops PVs and weights
+        - every estimate is computed again under 80 replicate weights(Fay's BRR), PVs are combined with Rubin's rules
+        - W_FSTUWT and W_FSTURWT1~80 should be in codebook
+
+        Parameters
+        ----------
+        PV_list: list
+            PV numbers, every PV in data when None since Rubin's rules need several PVs
+        """
+        logger.debug('step3-1. weighted estimates with replicate weights')
+        data = self.data_3_ESCS['full']
+        PV_list = [PV for PV in range(1, 11) if f'PV{PV}READ' in data.columns] if PV_list is None else PV_list
+        rs = resilient_estimates(data, acad_threshold, PV_list, key=NATION_KEY)
+        rs = rs.rename(index={label: nation for nation, label in self.nations.items()}, level=0)
+        rs.index = rs.index.set_names('nation', level=0)
+
+        self.rs_weighted = rs
+        os.makedirs(self.result_dir, exist_ok=True)
+        rs.to_csv(os.path.join(self.result_dir, 'weighted_estimates.csv'))
+        logger.debug(f'weighted estimates of PV{PV_list}\n{rs}')
+        return rs
+
+    @stage(source='data_3_ESCS')
     def minor_adjustment(self):
         r"""adjust minor things
-        - merge two country dataframe
         - drop PV value (not predictor)
         - reorder column
         """
         logger.debug('step4. adjust miscellanous thing, like column order, drop unnecessary column')
-        def merge_country(inputData: dict) -> pd.DataFrame:
-            output = pd.concat([inputData['SK'], inputData['US']], axis=0)
-            assert inputData['SK'].shape[0] + inputData['US'].shape[0] == output.shape[0]
-            return output
-        
         def drop_useless_column(inputData: pd.DataFrame) -> pd.DataFrame:
             dropAcademic = ['CNTRYID', 'AcademicScore']
             for column in inputData.columns:
-                if 'PV' in column:
+                if ('PV' in column) or (column in WEIGHT_COLUMNS):
                     dropAcademic.append(column)
             return inputData.drop(dropAcademic, axis=1)
 
@@ -275,63 +297,127 @@ class EDA:
             inputData.reset_index(inplace=True)
             return inputData
 
-        tmp_full = merge_country(self.data_3_ESCS['full'])
-        tmp_sliced = merge_country(self.data_3_ESCS['sliced'])
-        
-        tmp2_full = drop_useless_column(tmp_full)
-        tmp2_sliced = drop_useless_column(tmp_sliced)
-
-        self.data_final['full'] = columnOrder(tmp2_full)
-        self.data_final['sliced'] = columnOrder(tmp2_sliced)
+        # nations are already stacked, no merge is needed
+        self.data_final['full'] = columnOrder(drop_useless_column(self.data_3_ESCS['full']))
+        self.data_final['sliced'] = columnOrder(drop_useless_column(self.data_3_ESCS['sliced']))
+        EDA._release(self, 'data_3_ESCS')
         return self.data_final
 
+    @stage(source='data_3_ESCS')
+    def minor_adjustment_all_PV(self) -> dict:
+        r"""minor_adjustment for every PV of slice_by_ESCS_all_PV
+        - reordered data is built once per option, only resilient column differs by PV
+        """
+        logger.debug('step4. adjust miscellanous thing, all PVs')
+        self.data_merged_PV = dict()
+        self.data_final_PV = {PV: dict() for PV in self.PV_list}
+        for option in ['full', 'sliced']:
+            merged = EDA._adjust_columns(self.data_3_ESCS[option].reset_index(drop=True))
+            label = self.resilient_label[option]
+            assert merged.shape[0] == label.shape[0]
+            self.data_merged_PV[option] = (merged, label)
+
+            for IDX, PV in enumerate(self.PV_list):
+                self.data_final_PV[PV][option] = EDA._attach_label(merged, label[:, IDX])
+        EDA._release(self, 'data_3_ESCS', 'resilient_label')
+        return self.data_final_PV
+
+    @stage(source=('data_final_PV', 'data_final'), target=('data_final_PV', 'data_final'))
+    def impute(self) -> dict:
+        r"""fill NA of predictors in place with median and mode of each nation, like na.roughfix
+        - statistics are fitted once per nation and option, and kept in EDA.imputer for random forest
+        - for all PV run, merged data is imputed and resilient label of each PV is attached again
+        """
+        logger.debug('step5. impute NA with median and mode of each nation')
+        self.imputer = dict()
+        if hasattr(self, 'data_merged_PV'):
+            for option, (merged, label) in self.data_merged_PV.items():
+                self.imputer[option] = EDA._roughfix_by_nation(merged)
+                for IDX, PV in enumerate(self.PV_list):
+                    self.data_final_PV[PV][option] = EDA._attach_label(merged, label[:, IDX])
+        else:
+            for option, data in self.data_final.items():
+                self.imputer[option] = EDA._roughfix_by_nation(data)
+        return self.imputer
+
+    @staticmethod
+    def _roughfix_by_nation(data: pd.DataFrame) -> dict:
+        r"""fit and apply RoughFix on rows of each nation in place, {CNT: RoughFix}"""
+        predictors = [col for col in data.columns if col not in NON_PREDICTORS]
+        rs = dict()
+        for nation, rows in data.groupby('CNT', observed=True, sort=False).indices.items():
+            is_nation = np.zeros(data.shape[0], dtype=bool)
+            is_nation[rows] = True
+            rs[str(nation)] = RoughFix().fit(data, columns=predictors, rows=is_nation)
+            rs[str(nation)].transform(data, inplace=True, rows=is_nation)
+        return rs
+
     @staticmethod
-    def thresholdCalculator(data: dict,
+    def _label_all_PV(data: pd.DataFrame,
+                      acad_threshold: int,
+                      PV_list: list,
+                      nations: dict,
+                      weight: str = None) -> tuple:
+        r"""escs threshold of each nation, sliced mask and (student x PV) resilient label of every student"""
+        escs_score = group_quantile(data, 'ESCS', 0.25, nations, weight=weight)
+        is_low_escs = data['ESCS'].astype('float64').to_numpy() < broadcast(escs_score, data, nations)
+        acad = data[[f'PV{PV}READ' for PV in PV_list]].astype('float64').to_numpy()
+        label = ((acad > acad_threshold) & is_low_escs[:, None]).astype('int64')
+        return escs_score, is_low_escs, label
+
+    @staticmethod
+    def _adjust_columns(data: pd.DataFrame) -> pd.DataFrame:
+        r"""drop CNTRYID, PVs and weights(not predictor), identifiers come first"""
+        dropAcademic = ['CNTRYID'] + [column for column in data.columns if ('PV' in column) or (column in WEIGHT_COLUMNS)]
+        merged = data.drop(dropAcademic, axis=1)
+        column_ID = ['CNT', 'CNTSCHID', 'CNTSTUID']
+        return merged[column_ID + [column for column in merged.columns if column not in column_ID]]
+
+    @staticmethod
+    def _attach_label(merged: pd.DataFrame, label: np.ndarray) -> pd.DataFrame:
+        r"""insert resilient column next to identifiers, merged data is shared not copied"""
+        rs = merged.copy(deep=False)
+        rs.insert(3, 'resilient', label)
+        return rs
+
+    @staticmethod
+    def thresholdCalculator(data: pd.DataFrame,
                             PV_var: int,
-                            acad_threshold: int):
-        r"""calculate 2 kinds of threshold, and append mean column in data"""
+                            acad_threshold: int,
+                            nations: dict,
+                            weight: str = None):
+        r"""calculate 2 kinds of threshold of each nation, and append mean column in data
+        - escs threshold is quantile weighted by weight column when it is given
+        """
         assert type(PV_var) == int, 'insert valid PV_var type'
         assert type(acad_threshold) == int, 'insert valid threshold type'
         assert (PV_var > 0) and (PV_var < 11), print('>> Error__PV_var: ', PV_var)
 
-        threshold_dict = {'SK': {'academic_score': acad_threshold}, 'US': {'academic_score': acad_threshold}}
         targetColumn = ['PV'+ str(PV_var) + 'READ']
-        rs = data.copy()
-
-        for nationalName, inputNational in data.items():
-            rs[nationalName]['AcademicScore'] = inputNational.loc[:, targetColumn].mean(axis=1)
-            inputNational = inputNational.astype({'ESCS': "float64"})
-            threshold_dict[nationalName]['escs_score'] = inputNational['ESCS'].quantile(0.25)
-
-        return threshold_dict, rs
+        data['AcademicScore'] = data.loc[:, targetColumn].mean(axis=1) # column is appended in place
+        escs_score = group_quantile(data, 'ESCS', 0.25, nations, weight=weight)
+        threshold_dict = {nation: {'academic_score': acad_threshold, 'escs_score': escs_score[nation]}
+                          for nation in nations.keys()}
+        return threshold_dict, data
     
     @staticmethod
-    def slice_data_by_escs(data: dict,
-                           escsThreshold: dict) -> dict:
-        r"""slice data by escs score"""
-        assert type(data) == dict, 'insert valid data'
+    def slice_data_by_escs(data: pd.DataFrame,
+                           escsThreshold: dict,
+                           nations: dict) -> pd.DataFrame:
+        r"""slice data by escs score of each nation"""
+        assert type(data) == pd.DataFrame, 'insert valid data'
         assert type(escsThreshold) == dict, 'insert valid threshold'
 
-        rs = {'SK': pd.DataFrame(), 'US': pd.DataFrame()}
-        for nationalName, inputNational in data.items():
-            before = inputNational.shape[0]
-            toDrop = []
-            for idx, val in zip(inputNational['ESCS'].index, inputNational['ESCS'].values):
-                if val < escsThreshold[nationalName]['escs_score']:
-                    continue
-                else:
-                    toDrop.append(idx)
-            
-            rs[nationalName] = inputNational.drop(toDrop, axis=0)
-            after = rs[nationalName].shape[0]
-            logger.debug(f'>> before: {before} >> after: {after}' )
-        
+        escs_score = {nation: escsThreshold[nation]['escs_score'] for nation in nations.keys()}
+        rs = data.loc[data['ESCS'].astype('float64').to_numpy() < broadcast(escs_score, data, nations)]
+        logger.debug(f'>> before: {data.shape[0]} >> after: {rs.shape[0]}' )
         return rs
     
     @staticmethod
-    def labeling_resilient(data: dict,
+    def labeling_resilient(data: pd.DataFrame,
                            option: str,
-                           threshold_info: dict):
+                           threshold_info: dict,
+                           nations: dict):
         r"""
         decide whether student have resilience or not
 
@@ -350,55 +436,142 @@ class EDA:
         else: raise ValueError('input valid option args')
             
         assert type(threshold_info) == dict
-        rs = {'SK': pd.DataFrame(), 'US': pd.DataFrame()}
-        
-        for nationalName, inputNational in data.items():
-            threshold_acad = threshold_info[nationalName]['academic_score']
-            threshold_escs = threshold_info[nationalName]['escs_score']
-            
-            iamResilient = []
-            for idx in inputNational.index:
-                val_acad = inputNational.loc[idx, 'AcademicScore']
-                val_escs = inputNational.loc[idx, 'ESCS']
-                if option == 'full':
-                    if (val_acad > threshold_acad) and (val_escs < threshold_escs):
-                        iamResilient.append(1)
-                    else: iamResilient.append(0)
-                elif option == 'sliced':
-                    if val_acad > threshold_acad:
-                        iamResilient.append(1)
-                    else: iamResilient.append(0)
-
-            inputNational['resilient'] = iamResilient
-            rs[nationalName] = inputNational.copy()
+        score = {metric: {nation: threshold_info[nation][metric] for nation in nations.keys()}
+                 for metric in ['academic_score', 'escs_score']}
+        iamResilient = data['AcademicScore'].to_numpy() > broadcast(score['academic_score'], data, nations)
+        if option == 'full':
+            iamResilient &= data['ESCS'].astype('float64').to_numpy() < broadcast(score['escs_score'], data, nations)
+
+        data['resilient'] = iamResilient.astype('int64')
+        return data
 
+    @staticmethod
+    def split_resilient(data: pd.DataFrame,
+                        threshold_info: dict,
+                        nations: dict) -> dict:
+        r"""
+        label resilient student and slice by escs score in one pass over every nation
+
+        inside sliced data every student is below escs threshold,
+        so label of full data(condition1 & condition2) equals label of sliced data(condition1).
+        sliced data is row filter of labeled full data, no copy of full data is made.
+        """
+        assert type(threshold_info) == dict
+        score = {metric: {nation: threshold_info[nation][metric] for nation in nations.keys()}
+                 for metric in ['academic_score', 'escs_score']}
+        is_acad = data['AcademicScore'].to_numpy() > broadcast(score['academic_score'], data, nations)
+        is_low_escs = data['ESCS'].astype('float64').to_numpy() < broadcast(score['escs_score'], data, nations)
+
+        data['resilient'] = (is_acad & is_low_escs).astype('int64')
+        rs = {'full': data, 'sliced': data.loc[is_low_escs]}
+        logger.debug(f">> before: {data.shape[0]} >> after: {rs['sliced'].shape[0]}")
         return rs
     
     @staticmethod
-    def table_resilient_ratio(data: dict) -> dict:
-        r"""calculate ratio of resilient student compared with full
+    def table_resilient_ratio(data: pd.DataFrame, nations: dict, weight: str = None) -> dict:
+        r"""calculate ratio of resilient student compared with full, {nation: [count, ratio]}
+        - ratio is weighted by weight column when it is given, count is number of students
         """
-        count_ratio = {'SK': [], 'US': []}
-        for nationalName in count_ratio.keys():
-            total = data[nationalName].shape[0]
-            is_resilient = data[nationalName]['resilient'].values
-
-            resilientCount = [x for x in is_resilient if x == 1]
-            resilientRatio = round(len(resilientCount)/total * 100, 2)
-            count_ratio[nationalName].append(len(resilientCount))
-            count_ratio[nationalName].append(resilientRatio)
-            logger.debug(f'회복탄력성 보유 학생수({nationalName}): , {len(resilientCount)}, ({resilientRatio})%')
+        weights = np.ones(data.shape[0]) if weight is None else data[weight].to_numpy(dtype='float64', na_value=0.0)
+        resilient = data['resilient'].to_numpy(dtype='float64')
+        grouped = pd.DataFrame({'count': resilient, 'resilient': resilient * weights, 'weight': weights}) \
+            .groupby(data[NATION_KEY].astype(str).to_numpy(), sort=False).sum()
+        count_ratio = dict()
+        for nationalName, label in nations.items():
+            count, ratio = (grouped.at[label, 'count'], grouped.at[label, 'resilient'] / grouped.at[label, 'weight']) \
+                if label in grouped.index else (0, 0.0)
+            count_ratio[nationalName] = [int(count), round(float(ratio) * 100, 2)]
+            logger.debug(f'회복탄력성 보유 학생수({nationalName}): , {count_ratio[nationalName][0]}, ({count_ratio[nationalName][1]})%')
         return count_ratio
  
-    def save_result(self):
-        r"""save attributes"""
-        save_dir = os.path.join(App_dir, 'result')
-        if not os.path.isdir(save_dir): os.mkdir(save_dir)
-            
-        with pd.ExcelWriter(os.path.join(save_dir, f"preprocessing{self.PV_var}.xlsx")) as writer:
-            self.data_final['full'].to_excel(writer, sheet_name = "full", index=False)
-            self.data_final['sliced'].to_excel(writer, sheet_name = "sliced", index=False)
-    
+    @stage(source='data_final')
+    def save_result(self,
+                    fmt: str = 'parquet',
+                    excel: bool = False):
+        r"""save attributes
+
+        Parameters
+        ----------
+        fmt: str
+            parquet or feather, one file per view(full, sliced)
+        excel: bool
+            also write excel file with full and sliced sheet, in background thread
+        """
+        EDA._write_result(self.data_final, self.PV_var, fmt=fmt, excel=excel, save_dir=self.result_dir)
+
+    @stage(source='data_final_PV')
+    def save_result_all_PV(self,
+                           fmt: str = 'parquet',
+                           excel: bool = False):
+        r"""save attributes of every PV
+        - labels of every PV are computed in one pass before, so only writing is left per PV
+
+        Parameters
+        ----------
+        fmt: str
+            parquet or feather, one file per PV and view
+        excel: bool
+            also write excel file per PV
+        """
+        for PV, data_final in self.data_final_PV.items():
+            EDA._write_result(data_final, PV, fmt=fmt, excel=excel, save_dir=self.result_dir)
+
+    @staticmethod
+    def _write_result(data_final: dict, PV: int,
+                      fmt: str = 'parquet',
+                      excel: bool = False,
+                      save_dir: str = Result_dir):
+        r"""write result/preprocessing{PV}_{full, sliced}.{fmt}, and preprocessing{PV}.xlsx on request"""
+        if not os.path.isdir(save_dir): os.makedirs(save_dir, exist_ok=True)
+
+        frames = {'full': data_final['full'], 'sliced': data_final['sliced']}
+        write_frames(frames, os.path.join(save_dir, f"preprocessing{PV}"), fmt=fmt)
+        if excel:
+            write_excel(frames, os.path.join(save_dir, f"preprocessing{PV}.xlsx"))
+
+    def _visualize_threshold(self, data: dict, option: str, threshold_info: dict,
+                             figName: str):
+        r"""visualize threshold and ratio of sample distribution
+
+        Parameters
+        ----------
+        data: dict
+            {nation: pd.DataFrame}, dataframe should have AcademicScore and ESCS column
+        option: str
+            full or sliced
+        figName: str
+            title of figure
+        """
+        from src import visualize # matplotlib is imported only when figure is drawn
+        visualize.threshold_histogram(data, option=option, threshold_info=threshold_info,
+                                      nation_real_name=self.nation_real_name,
+                                      path=os.path.join(self.result_dir, f'{figName}_{option}.png'))
+
+    def _stage_key(self, stage: str, parent: str, *parts) -> str:
+        r"""chain cache key of stage from key of parent stage, None when parent has no key"""
+        if self.stage_key.get(parent) is None:
+            self.stage_key[stage] = None
+        else:
+            self.stage_key[stage] = self.cache.key(stage, self.stage_key[parent], *parts)
+        return self.stage_key[stage]
+
+    def _cache_get(self, key: str) -> dict:
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        return None if cached is None else unflatten(cached[0])
+
+    def _cache_put(self, key: str, data: dict):
+        if key is not None:
+            self.cache.put(key, flatten(data))
+
+    def _release(self, *names):
+        r"""drop consumed stage attributes in copy-on-write mode"""
+        if self.copy_on_write:
+            for name in names:
+                if hasattr(self, name):
+                    delattr(self, name)
+
     def _demographic_column_count(self) -> int:
         r"""count demographic columns
         
@@ -411,12 +584,45 @@ class EDA:
         
 
 def main(PV: int,
-         is_visualize: bool):
+         is_visualize: bool,
+         copy_on_write: bool = False,
+         fmt: str = 'parquet',
+         excel: bool = False,
+         impute: bool = False,
+         weighted: bool = False):
     assert (PV < 11) and (PV > 0), f"invalid argument PV, only int from 1 to 10 is allowed"
 
-    eda = EDA(codebook_name='codebook.xlsx', PV_var=PV)
+    eda = EDA(codebook_name='codebook.xlsx', PV_var=PV, copy_on_write=copy_on_write, weighted=weighted)
     eda.join_splited_data()
     eda.drop_student(na_threshold=30, is_visualize = is_visualize)
     eda.slice_by_ESCS(acad_threshold=480, is_visualize = is_visualize)
+    if weighted:
+        eda.estimate_weighted(acad_threshold=480)
     eda.minor_adjustment()
-    eda.save_result()
\ No newline at end of file
+    if impute:
+        eda.impute()
+    eda.save_result(fmt=fmt, excel=excel)
+    wait_excel()
+    return eda
+
+
+def main_all_PV(is_visualize: bool,
+                PV_list: list = list(range(1, 11)),
+                copy_on_write: bool = False,
+                fmt: str = 'parquet',
+                excel: bool = False,
+                impute: bool = False,
+                weighted: bool = False):
+    r"""run eda for every PV, PV independent steps are run only once"""
+    eda = EDA(codebook_name='codebook.xlsx', copy_on_write=copy_on_write, weighted=weighted)
+    eda.join_splited_data()
+    eda.drop_student(na_threshold=30, is_visualize = is_visualize)
+    eda.slice_by_ESCS_all_PV(acad_threshold=480, PV_list=PV_list, is_visualize = is_visualize)
+    if weighted:
+        eda.estimate_weighted(acad_threshold=480, PV_list=PV_list)
+    eda.minor_adjustment_all_PV()
+    if impute:
+        eda.impute()
+    eda.save_result_all_PV(fmt=fmt, excel=excel)
+    wait_excel()
+    return eda
\ No newline at end of file
@@ -0,0 +1,94 @@
+import logging
+from logging.config import dictConfig
+import warnings
+import numpy as np
+import pandas as pd
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# columns of eda result which are not predictor, same as Loader of Analysis.r
+NON_PREDICTORS = ['CNT', 'CNTSCHID', 'CNTSTUID', 'ESCS', 'resilient']
+
+
+class RoughFix:
+    r"""
+    na.roughfix of randomForest with fitted statistics
+    - median of numeric columns and most frequent level of categorical columns are computed in fit,
+      one vectorized pass over numeric columns and one over categorical columns
+    - transform fills NA with stored statistics, so they are applied to new data or repeated fits without recomputing
+    - numeric column which is filled becomes float64, like numeric of R
+    """
+    def __init__(self):
+        self.median_ = pd.Series(dtype='float64')
+        self.mode_ = pd.Series(dtype='object')
+
+    def fit(self, data: pd.DataFrame, columns: list = None, rows: np.ndarray = None):
+        r"""
+        Parameters
+        ----------
+        columns: list
+            columns to fit, every column when None
+        rows: np.ndarray
+            boolean mask of rows to fit on, like rows of one nation, every row when None
+        """
+        columns = list(data.columns) if columns is None else columns
+        categorical = [col for col in columns if isinstance(data[col].dtype, pd.CategoricalDtype)
+                       or (data[col].dtype == object) or pd.api.types.is_string_dtype(data[col].dtype)]
+        numeric = [col for col in columns if (col not in categorical) and pd.api.types.is_numeric_dtype(data[col].dtype)]
+
+        if len(numeric) > 0:
+            values = data[numeric].to_numpy(dtype='float64', na_value=np.nan)
+            values = values if rows is None else values[rows]
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning) # column of only NA has NA median, like R
+                self.median_ = pd.Series(np.nanmedian(values, axis=0), index=numeric)
+
+        if len(categorical) > 0:
+            # object column becomes factor of sorted levels, like as.factor of R
+            levels = [data[col].cat.categories if isinstance(data[col].dtype, pd.CategoricalDtype)
+                      else pd.Index(sorted(data[col].dropna().unique())) for col in categorical]
+            codes = np.column_stack([data[col].cat.codes.to_numpy() if isinstance(data[col].dtype, pd.CategoricalDtype)
+                                     else level.get_indexer(data[col]) for col, level in zip(categorical, levels)])
+            codes = codes if rows is None else codes[rows]
+            # count level of every column with one bincount, first level wins on tie like which.max
+            width = max(max(len(level) for level in levels), 1)
+            offset = codes + np.arange(len(categorical)) * width
+            counts = np.bincount(offset[codes >= 0], minlength=len(categorical) * width).reshape(len(categorical), width)
+            self.mode_ = pd.Series({col: level[counts[IDX].argmax()] if len(level) > 0 else np.nan
+                                    for IDX, (col, level) in enumerate(zip(categorical, levels))}, dtype='object')
+        logger.debug(f'roughfix fitted: {len(self.median_)} numeric, {len(self.mode_)} categorical columns')
+        return self
+
+    def transform(self, data: pd.DataFrame, inplace: bool = False, rows: np.ndarray = None) -> pd.DataFrame:
+        r"""fill NA with fitted statistics
+
+        Parameters
+        ----------
+        inplace: bool
+            modify given dataframe instead of copy
+        rows: np.ndarray
+            boolean mask of rows to fill, every row when None
+        """
+        rs = data if inplace else data.copy()
+        statistics = pd.concat([self.median_.astype('object'), self.mode_])
+        for col, value in statistics.items():
+            if (col not in rs.columns) or pd.isna(value):
+                continue
+            is_na = rs[col].isna().to_numpy()
+            if rows is not None:
+                is_na = is_na & rows
+            if not is_na.any():
+                continue
+            if col in self.median_.index:
+                filled = rs[col].to_numpy(dtype='float64', na_value=np.nan, copy=True)
+                filled[is_na] = value
+                rs[col] = filled
+            else:
+                rs[col] = rs[col].mask(is_na, value)
+        return rs
+
+    def fit_transform(self, data: pd.DataFrame, columns: list = None) -> pd.DataFrame:
+        return RoughFix.fit(self, data, columns=columns).transform(data)
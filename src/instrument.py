@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import threading
+import logging
+from logging.config import dictConfig
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import pstats
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+# logging
+from src.utils import generate_logger, peak_rss, reset_peak_rss, Log_dir
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+PROFILERS = ['cprofile', 'sample']
+
+
+def shape_of(obj) -> tuple:
+    r"""(rows, columns) of dataframe, array, or dict / list / tuple of them
+    - rows are summed over every frame, columns is max of frames
+    - None when obj has no frame
+    """
+    if hasattr(obj, 'shape') and (len(getattr(obj, 'shape')) > 0):
+        shape = obj.shape
+        return int(shape[0]), int(shape[1]) if len(shape) > 1 else 1
+    values = obj.values() if isinstance(obj, dict) else obj if isinstance(obj, (list, tuple)) else []
+    shapes = [shape for shape in (shape_of(value) for value in values) if shape is not None]
+    if len(shapes) == 0:
+        return None
+    return sum(shape[0] for shape in shapes), max(shape[1] for shape in shapes)
+
+
+def _children_cpu() -> float:
+    r"""cpu seconds of terminated child processes, like process pool workers"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class SamplingProfiler:
+    r"""
+    sample call stack of one thread periodically, overhead doesn't depend on number of function calls
+    - result is collapsed stack(file:function;file:function count), input of flamegraph.pl and speedscope
+    """
+    def __init__(self, thread_id: int = None, interval: float = 0.005):
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=SamplingProfiler._sample, args=(self,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def top(self, n: int = 20) -> list:
+        r"""[(function, share of samples)] of innermost function, descending"""
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(';', 1)[-1]] += count
+        total = max(sum(leaf.values()), 1)
+        return [(function, count / total) for function, count in leaf.most_common(n)]
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class Run:
+    r"""
+    records of every instrumented stage of one command run
+    - wall time, cpu time(threads included, terminated child processes separately), peak RSS,
+      rows and columns in and out
+    - stage run inside another stage is recorded with its parent, peak RSS of parent includes peak of its children
+    - stages are nested per thread, so stages of worker threads(like sweep) are recorded without parent.
+      peak RSS is of whole process, concurrent stages see peak of each other
+    - when profile is given, stage of that name(qualified name like EDA.drop_student, or only method name)
+      is run under cProfile or sampling profiler
+    """
+    def __init__(self,
+                 name: str = 'run',
+                 profile: str = None,
+                 profiler: str = 'cprofile',
+                 output_dir: str = None):
+        assert profiler in PROFILERS, f'invalid profiler {profiler}, only {PROFILERS} allowed'
+        self.name = name
+        self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        self.profile = profile
+        self.profiler = profiler
+        self.output_dir = os.path.join(Log_dir, 'runs', f'{name}_{self.run_id}') if output_dir is None else output_dir
+        self.started = time.time()
+        self.records = []
+        self._local = threading.local() # stack of open stages of each thread
+        self._profiled = Counter() # number of profiles of each stage, repeated stage is written as {name}.{count}
+
+    @contextmanager
+    def measure(self, name: str, shape_in: tuple = None):
+        r"""measure block as stage, yielded record can be filled with shape_out"""
+        active = Run._active(self)
+        record = {'stage': name, 'parent': active[-1]['stage'] if len(active) > 0 else None,
+                  'depth': len(active), 'start': round(time.time() - self.started, 4),
+                  'rows_in': None, 'columns_in': None, 'rows_out': None, 'columns_out': None}
+        if shape_in is not None:
+            record['rows_in'], record['columns_in'] = shape_in
+        if len(active) > 0:
+            active[-1]['_peak'] = max(active[-1]['_peak'], peak_rss()) # peak of parent so far
+        reset_peak_rss()
+        record['_peak'] = 0.0
+        active.append(record)
+
+        profiler = Run._start_profiler(self, name)
+        start_wall, start_cpu, start_children = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = time.perf_counter() - start_wall
+            record['cpu_time'] = time.process_time() - start_cpu
+            record['cpu_children'] = _children_cpu() - start_children
+            Run._stop_profiler(self, name, profiler)
+            active.pop()
+            record['peak_rss'] = max(record.pop('_peak'), peak_rss())
+            if len(active) > 0:
+                active[-1]['_peak'] = max(active[-1]['_peak'], record['peak_rss'])
+            shape_out = record.pop('shape_out', None)
+            if shape_out is not None:
+                record['rows_out'], record['columns_out'] = shape_out
+            self.records.append(record)
+            logger.debug(f"{name}: {record['wall_time']:.3f}s wall, {record['cpu_time']:.3f}s cpu, "
+                         f"{record['peak_rss']:.1f} MB, ({record['rows_in']}, {record['columns_in']}) -> "
+                         f"({record['rows_out']}, {record['columns_out']})")
+
+    def _active(self) -> list:
+        if not hasattr(self._local, 'active'):
+            self._local.active = []
+        return self._local.active
+
+    def _is_profiled(self, name: str) -> bool:
+        return (self.profile is not None) and (self.profile in (name, name.rsplit('.', 1)[-1]))
+
+    def _start_profiler(self, name: str):
+        if not Run._is_profiled(self, name):
+            return None
+        if self.profiler == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = SamplingProfiler()
+            profiler.start()
+        return profiler
+
+    def _stop_profiler(self, name: str, profiler):
+        if profiler is None:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._profiled[name] += 1
+        path = os.path.join(self.output_dir, name if self._profiled[name] == 1 else f'{name}.{self._profiled[name]}')
+        if self.profiler == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(f'{path}.prof')
+            with open(f'{path}.txt', 'w') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+        else:
+            profiler.stop()
+            profiler.write(f'{path}.collapsed')
+            top = '\n'.join(f'{share * 100:6.2f}% {function}' for function, share in profiler.top())
+            with open(f'{path}.txt', 'w') as f:
+                f.write(top)
+        logger.debug(f'profile of {name} is written in {path}.*')
+
+    def summary(self) -> str:
+        r"""table of stages in order of start, indented by depth"""
+        columns = ['wall_time', 'cpu_time', 'cpu_children', 'peak_rss', 'rows_in', 'columns_in', 'rows_out', 'columns_out']
+        records = sorted(self.records, key=lambda record: record['start'])
+        width = max([len(record['stage']) + 2 * record['depth'] for record in records] + [5])
+        lines = [f"{'stage':<{width}} " + ' '.join(f'{col:>12}' for col in columns)]
+        for record in records:
+            cells = [f'{record[col]:>12.3f}' if isinstance(record[col], float)
+                     else f"{'-' if record[col] is None else record[col]:>12}" for col in columns]
+            lines.append(f"{'  ' * record['depth'] + record['stage']:<{width}} " + ' '.join(cells))
+        return '\n'.join(lines)
+
+    def save(self) -> str:
+        r"""write run.json and summary.txt in output_dir, return output_dir"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        report = {'name': self.name, 'run_id': self.run_id, 'argv': sys.argv, 'started': self.started,
+                  'wall_time': time.time() - self.started, 'profile': self.profile, 'profiler': self.profiler,
+                  'stages': sorted(self.records, key=lambda record: record['start'])}
+        with open(os.path.join(self.output_dir, 'run.json'), 'w') as f:
+            json.dump(report, f, indent=2)
+        summary = Run.summary(self)
+        with open(os.path.join(self.output_dir, 'summary.txt'), 'w') as f:
+            f.write(summary + '\n')
+        logger.debug(f'run {self.run_id} is written in {self.output_dir}\n{summary}')
+        return self.output_dir
+
+
+_run = None
+
+
+def start_run(name: str = 'run', profile: str = None, profiler: str = 'cprofile', output_dir: str = None) -> Run:
+    r"""start new run, stages measured afterwards are recorded in it"""
+    global _run
+    _run = Run(name=name, profile=profile, profiler=profiler, output_dir=output_dir)
+    return _run
+
+
+def current_run() -> Run:
+    r"""run of current process, started implicitly when start_run is not called"""
+    return start_run() if _run is None else _run
+
+
+def _attribute(obj, names):
+    r"""first existing attribute of names, which is name or tuple of names"""
+    names = (names,) if isinstance(names, str) else names
+    return next((getattr(obj, name) for name in names if hasattr(obj, name)), None)
+
+
+def stage(func=None, source: str = None, target: str = None):
+    r"""decorator measuring function or method as stage of current run
+
+    Parameters
+    ----------
+    source: str
+        attribute of instance whose shape is rows and columns in, or tuple of attributes and first existing one is used.
+        when None first dataframe(or dict, list of them) argument is used
+    target: str
+        attribute(s) of instance whose shape is rows and columns out, when None return value is used
+
+    Examples
+    --------
+    @stage(source='data_1_join')
+    def drop_student(self, na_threshold): ...
+    """
+    if func is None:
+        return lambda func: stage(func, source=source, target=target)
+
+    @wraps(func)
+    def stage_wrapper(*args, **kwargs):
+        if source is not None:
+            shape_in = shape_of(_attribute(args[0], source))
+        else:
+            shape_in = next((shape for shape in (shape_of(arg) for arg in list(args) + list(kwargs.values()))
+                             if shape is not None), None)
+        with current_run().measure(func.__qualname__, shape_in=shape_in) as record:
+            result = func(*args, **kwargs)
+            record['shape_out'] = shape_of(result if target is None else _attribute(args[0], target))
+        return result
+    return stage_wrapper
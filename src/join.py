@@ -0,0 +1,103 @@
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+
+# logging
+from src.utils import generate_logger
+from src.reader import IDENTIFIER_COLUMNS
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+AGGREGATIONS = ['mean', 'share', 'count']
+
+
+class SchoolIndex:
+    r"""
+    precomputed index from student row to school.
+    school level data is aligned to schools of students once, then taken by position,
+    so every join is array take instead of merge on student frame.
+    CNTSCHID is unique over every nation in PISA 2018, so it works on international file.
+    """
+    def __init__(self, df_student: pd.DataFrame, key: str = 'CNTSCHID'):
+        self.key = key
+        self.schools = pd.Index(pd.unique(df_student[key]))
+        self.position = self.schools.get_indexer(df_student[key])
+
+    def take(self, school_level: pd.DataFrame) -> pd.DataFrame:
+        r"""align school level data to student rows, school which has no data is filled with NA"""
+        if school_level[self.key].duplicated().any():
+            raise ValueError(f'{self.key} of school level data should be unique')
+        aligned = school_level.set_index(self.key).reindex(self.schools)
+        return aligned.take(self.position).reset_index(drop=True)
+
+
+def aggregate_teacher(df_teacher: pd.DataFrame,
+                      aggregation: dict = None,
+                      key: str = 'CNTSCHID') -> pd.DataFrame:
+    r"""aggregate teacher data to school level
+
+    Parameters
+    ----------
+    aggregation: dict
+        {column: list of 'mean', 'share', 'count'}
+        - mean: school mean, column name is kept
+        - share: share of teachers per answer, column name is {column}_{answer}
+        - count: number of teachers who answered, column name is {column}_count
+        when None, numeric column is averaged and categorical column is converted to share
+    """
+    value_columns = [col for col in df_teacher.columns if col not in IDENTIFIER_COLUMNS]
+    if aggregation is None:
+        aggregation = {col: ['mean'] if pd.api.types.is_numeric_dtype(df_teacher[col]) else ['share']
+                       for col in value_columns}
+    invalid = {agg for aggs in aggregation.values() for agg in aggs} - set(AGGREGATIONS)
+    if len(invalid) > 0:
+        raise ValueError(f'invalid aggregation {invalid}, only {AGGREGATIONS} allowed')
+
+    grouped = df_teacher.groupby(key, sort=False)
+    rs = [pd.DataFrame(index=pd.Index(grouped.size().index, name=key))]
+
+    mean_columns = [col for col, aggs in aggregation.items() if 'mean' in aggs]
+    if len(mean_columns) > 0:
+        rs.append(grouped[mean_columns].mean())
+
+    count_columns = [col for col, aggs in aggregation.items() if 'count' in aggs]
+    if len(count_columns) > 0:
+        rs.append(grouped[count_columns].count().add_suffix('_count'))
+
+    for col in [col for col, aggs in aggregation.items() if 'share' in aggs]:
+        dummy = pd.get_dummies(df_teacher[col], prefix=col, dtype='float64')
+        if isinstance(df_teacher[col].dtype, pd.CategoricalDtype): # empty column gets no dummy, like nation without teacher
+            dummy = dummy.reindex(columns=[f'{col}_{category}' for category in df_teacher[col].cat.categories], fill_value=0.0)
+        dummy.loc[df_teacher[col].isna().to_numpy()] = np.nan # no answer is excluded from share
+        dummy[key] = df_teacher[key].to_numpy()
+        rs.append(dummy.groupby(key, sort=False).mean())
+
+    rs = pd.concat(rs, axis=1).reset_index()
+    logger.debug(f'teacher data aggregated: {df_teacher.shape} -> {rs.shape}')
+    return rs
+
+
+def join_school_level(df_student: pd.DataFrame,
+                      school_level: list,
+                      key: str = 'CNTSCHID') -> pd.DataFrame:
+    r"""join school level dataframes to student dataframe on school id
+
+    Parameters
+    ----------
+    school_level: list
+        list of (suffix, dataframe), dataframe should have one row per school.
+        identifiers are dropped, column already in joined data gets suffix
+    """
+    index = SchoolIndex(df_student, key=key)
+    student = df_student if df_student.index.equals(pd.RangeIndex(df_student.shape[0])) \
+        else df_student.set_axis(pd.RangeIndex(df_student.shape[0]), axis=0)
+    joined = [student]
+    columns = set(df_student.columns)
+    for suffix, data in school_level:
+        value_columns = [col for col in data.columns if col not in IDENTIFIER_COLUMNS]
+        aligned = index.take(data[[key] + value_columns])
+        aligned.columns = [f'{col}_{suffix}' if col in columns else col for col in aligned.columns]
+        columns.update(aligned.columns)
+        joined.append(aligned)
+    return pd.concat(joined, axis=1)
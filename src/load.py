@@ -1,142 +1,333 @@
 import os
 import logging
 from logging.config import dictConfig
-import pickle
-import shutil
-import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 
 # logging
-from src.utils import generate_logger, timeit
+from src.utils import generate_logger
+from src.instrument import stage
+from src.reader import IDENTIFIER_COLUMNS, read_zip_member, label_order
+from src.store import Store, LEVELS
+from src.nation import NATION_KEY, resolve_nations, split_by_nation
+from src.writer import write_excel
+from src.validate import na_ratio_matrix, na_diff_report, check_na_report
+from src.cache import StageCache, archive_fingerprint, frame_fingerprint, code_version, flatten, unflatten
 dictConfig(generate_logger(__name__))
 logger = logging.getLogger(__name__)
 
 App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
 
 
+def codebook_dtype(codebook: pd.DataFrame) -> dict:
+    r"""{variable: dtype} of optional dtype column of codebook"""
+    if 'dtype' not in codebook.columns:
+        return dict()
+    return codebook.dropna(subset=['dtype']).set_index('variable_code')['dtype'].to_dict()
+
+
+def value_profile(column: pd.Series) -> tuple:
+    r"""(every value is integer, min, max) of non-NA values of float column, used by compact_dtype"""
+    values = column.dropna().to_numpy()
+    if values.size == 0:
+        return False, None, None
+    return bool(np.all(np.mod(values, 1) == 0)), values.min(), values.max()
+
+
+def merge_profile(left: tuple, right: tuple) -> tuple:
+    r"""value_profile of column from value_profile of its two parts"""
+    if left[1] is None:
+        return right
+    if right[1] is None:
+        return left
+    return left[0] and right[0], min(left[1], right[1]), max(left[2], right[2])
+
+
+def compact_dtype(column: pd.Series, overrides: dict = None, profile: tuple = None):
+    r"""compact dtype of column, see Load._optimize_dtype
+    - overrides is codebook_dtype of codebook
+    - profile is value_profile of whole column when column is only part of it, like nation or batch, see decide_dtype
+    """
+    overrides = dict() if overrides is None else overrides
+    if column.name in overrides:
+        return overrides[column.name]
+    if (column.dtype == object) or pd.api.types.is_string_dtype(column.dtype):
+        return 'category'
+    if not pd.api.types.is_float_dtype(column.dtype):
+        return column.dtype
+    if (column.name == 'ESCS') or column.name.startswith('PV') or column.name.startswith('W_'):
+        return column.dtype
+    integral, low, high = value_profile(column) if profile is None else profile
+    if integral:
+        for candidate in ['Int8', 'Int16', 'Int32']:
+            info = np.iinfo(candidate.lower())
+            if (low >= info.min) and (high <= info.max):
+                return candidate
+        return column.dtype
+    return 'float32'
+
+
+def decide_dtype(parts, overrides: dict = None, labels: dict = None) -> dict:
+    r"""{column: compact dtype} of column split into parts, like nations or batches, so every part gets one schema
+    - value range of numeric column and categories of labelled column are merged over every part,
+      then compact_dtype is decided once on whole column
+    - labelled column becomes category of every value in any part, in order of spss code
+
+    Parameters
+    ----------
+    parts: iterable
+        dataframes of same columns, consumed once so generator of batches can be given
+    labels: dict
+        {column: value labels in order of spss code}, see reader.value_labels
+    """
+    overrides = dict() if overrides is None else overrides
+    labels = dict() if labels is None else labels
+    categories, profiles, empty = dict(), dict(), dict()
+    for part in parts:
+        for col in part.columns:
+            column = part[col]
+            empty.setdefault(col, column.iloc[:0])
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                categories.setdefault(col, set()).update(column.cat.categories)
+            elif (column.dtype == object) or pd.api.types.is_string_dtype(column.dtype) \
+                    or (overrides.get(col) == 'category'):
+                categories.setdefault(col, set()).update(column.dropna().unique())
+            elif pd.api.types.is_float_dtype(column.dtype):
+                profiles[col] = merge_profile(profiles.get(col, (False, None, None)), value_profile(column))
+
+    rs = dict()
+    for col in empty.keys():
+        if (col in categories) and (overrides.get(col, 'category') == 'category'):
+            rs[col] = pd.CategoricalDtype(label_order(categories[col], labels.get(col, [])))
+        else:
+            rs[col] = compact_dtype(empty[col], overrides, profile=profiles.get(col, (False, None, None)))
+    return rs
+
+
 class Load:
     r"""
     load required data, PISA2018 dataset and codebook.
-    since PISA2018 dataset is quite large, save minimal touched data as pickle in first time.
-    after saving data as pickle, the process don't load spss file directly
+    since PISA2018 dataset is quite large, save country-filtered data in base store(data/store/base) in first time.
+    nations are configurable, Korea and United States by default, 'all' keeps every nation of spss file
+    after saving data in base store, the process don't load spss file directly,
+    only variables newly added to codebook are read from spss file
     """
-    def __init__(self, codeBook):
+    spss_member = {'stu': ('SPSS_STU_QQQ.zip', 'STU/CY07_MSU_STU_QQQ.sav'),
+                   'sch': ('SPSS_SCH_QQQ.zip', 'SCH/CY07_MSU_SCH_QQQ.sav'),
+                   'tch': ('SPSS_TCH_QQQ.zip', 'TCH/CY07_MSU_TCH_QQQ.sav')}
+
+    def __init__(self, codeBook, chunksize=50000, cache_size=20 * 1024**3, incremental=True, data_dir=None,
+                 nations=None):
         r"""
         - codebook xlsx file should contain at least 4 columns: category / Database / variable_code / description
+        - chunksize: number of rows parsed at once when reading spss file
+        - cache_size: max bytes of stage cache, least recently used stage is evicted
+        - incremental: reuse base store and read only added variables, when False every spss file is read again
+        - data_dir: folder of archives, codebook and store, data/ of project when None
+        - nations: {nation: CNTRYID label} or list of labels, see nation.resolve_nations.
+          'all' keeps every nation, then nations are decided from CNTRYID of student file
         """
-        self.Data_dir = os.path.join(App_dir, 'data')
+        self.Data_dir = os.path.join(App_dir, 'data') if data_dir is None else data_dir
+        self.cb = pd.read_excel(os.path.join(self.Data_dir, codeBook))
+        self.chunksize = chunksize
+        self.incremental = incremental
+        self.store = Store(self.Data_dir)
+        self.cache = StageCache(self.Data_dir, max_bytes=cache_size)
+        self.nation_spec = 'all' if nations == 'all' else resolve_nations(nations)
+        self.nation_code = None if nations == 'all' else self.nation_spec # resolved when base store is built
 
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
         logger.debug('load raw data')
-        cond1 = os.path.isfile(os.path.join(self.Data_dir, "data_stu.pkl"))
-        cond2 = os.path.isfile(os.path.join(self.Data_dir, "data_sch.pkl"))
-        cond3 = os.path.isfile(os.path.join(self.Data_dir, "data_tch.pkl"))
-        if cond1 and cond2 and cond3: # when pickle file already exist, load it
-            with open(os.path.join(self.Data_dir, "data_stu.pkl"), 'rb') as f:
-                self.rawStu = pd.read_pickle(f)
-            with open(os.path.join(self.Data_dir, "data_sch.pkl"), 'rb') as f:
-                self.rawSCH = pd.read_pickle(f)
-            with open(os.path.join(self.Data_dir, "data_tch.pkl"), 'rb') as f:
-                self.rawTCH = pd.read_pickle(f)
-        else:
-            try:
-                tmp_stu = Load._load_zipfile(self, zipfile_dir=os.path.join(self.Data_dir, 'SPSS_STU_QQQ.zip'),
-                                                    spss_filename="STU/CY07_MSU_STU_QQQ.sav") # loading student takes pretty long time
-                logger.debug(f'Student data set: {tmp_stu.shape}')
-                self.rawStu = Load._clean_nation(self, tmp_stu, category="stu")
-
-                tmp_sch = Load._load_zipfile(self, zipfile_dir=os.path.join(self.Data_dir, 'SPSS_SCH_QQQ.zip'),
-                                                    spss_filename="SCH/CY07_MSU_SCH_QQQ.sav")
-                logger.debug(f'School data set: {tmp_stu.shape}')
-                self.rawSCH = Load._clean_nation(self, tmp_sch, category="sch")
-
-                tmp_tch = Load._load_zipfile(self, zipfile_dir=os.path.join(self.Data_dir, 'SPSS_TCH_QQQ.zip'),
-                                                    spss_filename="TCH/CY07_MSU_TCH_QQQ.sav")
-                logger.debug(f'Teacher data set: {tmp_stu.shape}')
-                self.rawTCH = Load._clean_nation(self, tmp_tch, category="tch")
-
-            except:
-                raise ValueError('put PISA 2018 data SPSS file in data folder')
+        self.archives = Load._archive_fingerprint(self)
+        self.stage_key = {'load': Load._load_key(self)}
+        self.rawStu, self.rawSCH, self.rawTCH = Load._load_base(self)
+        logger.debug(f'Student data set: {self.rawStu.shape}')
+        logger.debug(f'School data set: {self.rawSCH.shape}')
+        logger.debug(f'Teacher data set: {self.rawTCH.shape}')
         
         self.dataLS = [self.rawStu, self.rawSCH, self.rawTCH]
-        self.cb = pd.read_excel(os.path.join(self.Data_dir, codeBook))
 
 
-    @timeit
-    def defaultCleaner(self):
+    @stage(source='dataLS', target='default_cleaningData')
+    def defaultCleaner(self, excel: bool = False, strict: bool = False):
         """cleaning required nations and variable, save result for further analysis
+
+        Parameters
+        ----------
+        excel: bool
+            also write cleanedData({nation}).xlsx for cross check, in background thread
+        strict: bool
+            raise ValueError when column is invalid only in some nations, otherwise it is warned and reported
         """
-        cleaned_nation = Load._devide_nation(self) # before cleaning variable, devide nation is required
-        cleaned_variable = Load._clean_variable(self, data = cleaned_nation)
-        self.default_cleaningData = Load._validate_column(self, data = cleaned_variable)
+        self.stage_key['clean'] = self.cache.key('clean', self.stage_key['load'], frame_fingerprint(self.cb),
+                                                 code_version('load', 'validate', 'nation', 'reader'))
+        if self.store.nations('cleaned') != sorted(self.nation_code.keys()):
+            self.store.remove('cleaned') # partition of nation which is not configured anymore, before report is written
+        cached = self.cache.get(self.stage_key['clean'])
+        if cached is not None:
+            self.default_cleaningData = unflatten(cached[0])
+            report = self.store.read_report('cleaned', 'na_report')
+            if strict and (report is not None): # cached clean may be validated without strict
+                check_na_report(report, strict=strict)
+        else:
+            affected = Load._affected_column(self)
+            cleaned_nation = Load._devide_nation(self) # before cleaning variable, devide nation is required
+            cleaned_variable = Load._clean_variable(self, data = cleaned_nation)
+            cleaned_dtype = Load._optimize_dtype(self, data = cleaned_variable)
+            self.default_cleaningData = Load._validate_column(self, data = cleaned_dtype, columns = affected, strict = strict)
+            self.cache.put(self.stage_key['clean'], flatten(self.default_cleaningData))
 
-        # save result
-        with open(os.path.join(self.Data_dir, 'cleaned.pkl'), 'wb') as f:
-            pickle.dump(self.default_cleaningData, f, pickle.HIGHEST_PROTOCOL)
+        # save result, key is recorded so that eda stages can be cached on top of it
+        self.store.write_national(self.default_cleaningData, stage='cleaned')
+        self.store.write_key('cleaned', self.stage_key['clean'])
+        self.store.write_meta('cleaned', {'nation_code': self.nation_code})
 
         # for cross check
-        with pd.ExcelWriter(os.path.join(self.Data_dir, 'cleanedData(SK).xlsx')) as writer:
-            self.default_cleaningData['SK'][0].to_excel(writer, sheet_name='stu', index=False)
-            self.default_cleaningData['SK'][1].to_excel(writer, sheet_name='sch', index=False)
-            self.default_cleaningData['SK'][2].to_excel(writer, sheet_name='tch', index=False)  
-
-        with pd.ExcelWriter(os.path.join(self.Data_dir, 'cleanedData(US).xlsx')) as writer:
-            self.default_cleaningData['US'][0].to_excel(writer, sheet_name='stu', index=False)
-            self.default_cleaningData['US'][1].to_excel(writer, sheet_name='sch', index=False)
-            self.default_cleaningData['US'][2].to_excel(writer, sheet_name='tch', index=False)
-
-    @timeit
-    def _load_zipfile(self, zipfile_dir: str, spss_filename: str) -> pd.DataFrame:
-        r"""unzip spss file"""
-        assert zipfile_dir[-4:] == '.zip'
-        assert spss_filename[-4:] == '.sav'
-        zip_folder = zipfile.ZipFile(zipfile_dir, 'r')
-        before = os.listdir(self.Data_dir)
-
-        zip_folder.extract(spss_filename, path=self.Data_dir)
-        after = os.listdir(self.Data_dir)
-        difference_dir = list(set(after) - set(before))[0]
-
-        rs = pd.read_spss(os.path.join(self.Data_dir, spss_filename))
-        
-        shutil.rmtree(os.path.join(self.Data_dir, difference_dir))
+        if excel:
+            for nation, data_ls in self.default_cleaningData.items():
+                write_excel(dict(zip(LEVELS, data_ls)), os.path.join(self.Data_dir, f'cleanedData({nation}).xlsx'))
+
+    def _archive_fingerprint(self) -> dict:
+        r"""fingerprint of each archive, None when archive doesn't exist"""
+        archives = dict()
+        for zip_name, _ in Load.spss_member.values():
+            zipfile_dir = os.path.join(self.Data_dir, zip_name)
+            archives[zip_name] = archive_fingerprint(zipfile_dir) if os.path.isfile(zipfile_dir) else None
+        return archives
 
+    def _load_key(self) -> str:
+        r"""cache key of load stage: archives, required columns, nations and reader code"""
+        required = sorted(set(IDENTIFIER_COLUMNS) | set(self.cb['variable_code'].values))
+        return self.cache.key('load', self.archives, required, self.nation_spec, code_version('reader'))
+
+    @stage
+    def _load_base(self) -> list:
+        r"""country-filtered student, school and teacher data of codebook variables
+        - base store keeps every variable loaded so far, variable removed from codebook is just not read
+        - variable added to codebook is read from spss file and appended to base store
+        - when archive or nations change, or base store doesn't exist, every spss file is read again
+        """
+        required = set(IDENTIFIER_COLUMNS) | set(self.cb['variable_code'].values)
+        meta = self.store.read_meta('base')
+        reusable = self.incremental and (meta is not None) and self.store.exists('base') \
+            and (meta['nations'] == self.nation_spec) \
+            and ((meta['archives'] == self.archives) or all(v is None for v in self.archives.values())) \
+            and ('labels' in meta) # archive may be removed after first load, labels order categories by spss code
+        self.base_refreshed = not reusable
+        if not reusable:
+            Load._build_base(self, required)
+            meta = self.store.read_meta('base')
+        self.nation_code = meta.get('nation_code', meta['nations']) # base store of fixed nations has no nation_code
+        self.labels = meta['labels']
+
+        first_nation = list(self.nation_code.keys())[0]
+        wanted = {level: [col for col in meta['columns'][level] if col in required] for level in LEVELS}
+        added = dict()
+        for level in LEVELS:
+            available = set(self.store.columns('base', level, first_nation))
+            missing = [col for col in wanted[level] if col not in available]
+            if len(missing) > 0:
+                added[level] = missing
+        if len(added) > 0:
+            Load._extend_base(self, added)
+
+        rs = []
+        for level in LEVELS:
+            # column order of spss file is kept, same as reading spss file at once
+            rs.append(pd.concat([self.store.read('base', level, nation, columns=wanted[level])[wanted[level]]
+                                 for nation in self.nation_code.keys()], axis=0, ignore_index=True))
         return rs
 
-    def _clean_nation(self, data: pd.DataFrame, category: str) -> pd.DataFrame:
-        r"""in this analysis, i need only Korea and US
-        - because student file is too big, save sliced dataframe temporaily in pickle file
-        
+    @stage
+    def _build_base(self, required: set):
+        r"""read every spss file and write base store from scratch"""
+        logger.debug('build base store from spss files')
+        try:
+            loaded = Load._load_zipfile(self, {level: required for level in LEVELS}, return_columns=True) # loading student takes pretty long time
+        except:
+            raise ValueError('put PISA 2018 data SPSS file in data folder')
+        self.store.remove('base')
+        if self.nation_spec == 'all':
+            self.nation_code = resolve_nations(sorted(str(label) for label in loaded[0][0][NATION_KEY].dropna().unique()))
+        schema, labels = dict(), dict()
+        for level, (data, columns, level_labels) in zip(LEVELS, loaded):
+            for nation_name, national in split_by_nation(data, self.nation_code).items():
+                self.store.write(national, 'base', level, nation_name)
+            schema[level], labels[level] = columns, level_labels
+        self.store.write_meta('base', {'archives': self.archives, 'nations': self.nation_spec,
+                                       'nation_code': self.nation_code, 'columns': schema, 'labels': labels})
+
+    @stage
+    def _extend_base(self, added: dict):
+        r"""read only added variables from spss file and append them to base store
+
         Parameters
         ----------
-        category: str
-            stu, tch, sch
+        added: dict
+            {level: list of variables}, levels without added variable are not read at all
         """
-        if (category == 'stu') or (category == 'sch') or (category == 'tch'): pass
-        else:
-            raise ValueError('invalid argument, only stu, sch, tch allowed')
-        
-        df_kr = data[data['CNTRYID'] == 'Korea']
-        df_us = data[data['CNTRYID'] == 'United States']
-        
-        rs = pd.concat([df_kr, df_us], axis=0)
-        
-        with open(os.path.join(self.Data_dir, f'data_{category}.pkl'), 'wb') as f:
-            pickle.dump(rs, f, pickle.HIGHEST_PROTOCOL)
-        return rs
+        logger.debug(f'append variables to base store: {added}')
+        try:
+            loaded = Load._load_zipfile(self, {level: set(IDENTIFIER_COLUMNS) | set(columns)
+                                               for level, columns in added.items()})
+        except:
+            raise ValueError('put PISA 2018 data SPSS file in data folder to read added variables')
+        for (level, columns), data in zip(added.items(), loaded):
+            for nation_name, fetched in split_by_nation(data, self.nation_code).items():
+                base = self.store.read('base', level, nation_name)
+                identifier = [col for col in IDENTIFIER_COLUMNS if col in base.columns]
+                if not base[identifier].astype(str).equals(fetched[identifier].astype(str)):
+                    raise ValueError('rows of base store and spss file differ, run with incremental=False')
+                self.store.write(pd.concat([base, fetched[columns]], axis=1), 'base', level, nation_name)
 
+    def _affected_column(self) -> dict:
+        r"""columns which are not validated yet, {level index: set of columns}
+        - None(every column) when base store is rebuilt or there is no previous cleaned data
+        - otherwise only columns newly added after previous cleaning, since rows are not changed
+        """
+        if self.base_refreshed or (self.store.nations('cleaned') != sorted(self.nation_code.keys())) \
+                or (not self.store.exists('cleaned')):
+            return None
+        first_nation = list(self.nation_code.keys())[0]
+        required = set(self.cb['variable_code'].values)
+        return {IDX: required - set(self.store.columns('cleaned', level, first_nation))
+                for IDX, level in enumerate(LEVELS)}
+
+    @stage
+    def _load_zipfile(self, required: dict, return_columns: bool = False) -> list:
+        r"""read spss file of each level in parallel, from zip archive
+        - only required columns of required nations are kept, every nation when nations are not decided yet('all')
+        - nothing is extracted into data folder, each member is copied into temporary folder while it is read,
+          so disk of every required member is needed at once, see reader.spool_zip_member
+
+        Parameters
+        ----------
+        required: dict
+            {level: set of columns}, only these levels are read, in given order
+        """
+        nations = None if self.nation_code is None else list(self.nation_code.values())
+        with ProcessPoolExecutor(max_workers=len(required)) as executor:
+            futures = [executor.submit(read_zip_member,
+                                       os.path.join(self.Data_dir, Load.spss_member[level][0]),
+                                       Load.spss_member[level][1],
+                                       columns,
+                                       nations,
+                                       self.chunksize,
+                                       return_columns)
+                       for level, columns in required.items()]
+            return [future.result() for future in futures]
+
+    @stage(source='dataLS')
     def _devide_nation(self) -> dict:
-        r"""split data with two nations, Korea and United States"""
-        nationalData = {'SK': [], 'US': []}
+        r"""split data of each level by nation, one group-by pass per level"""
+        nationalData = {nation_name: [] for nation_name in self.nation_code.keys()}
         for data in self.dataLS:
-            for nation_name, nation_code in zip(nationalData.keys(), ['Korea', 'United States']):
-                logger.debug(f'*nation: {nation_name}, { nation_code}')
-                temp2 = data[data['CNTRYID'] ==  nation_code].copy()
-                nationalData[nation_name].append(temp2)
-                logger.debug(f'sliced shape: {temp2.shape}')
-            
+            for nation_name, national in split_by_nation(data, self.nation_code).items():
+                nationalData[nation_name].append(national)
+                logger.debug(f'*nation: {nation_name}, sliced shape: {national.shape}')
         return nationalData
     
+    @stage
     def _clean_variable(self, data: dict):
         r"""left only necessary variable
         in progress of research, interested variables and injected variables are easily changed.
@@ -149,31 +340,65 @@ class Load:
                 rs[nation].append(data[col_ls])
         return rs
     
-    def _validate_column(self, data: dict) -> dict:
+    @stage
+    def _optimize_dtype(self, data: dict) -> dict:
+        r"""downcast dtype of each column to shrink working set
+        - when codebook has 'dtype' column, its value is used for that variable
+        - labelled spss value(string) becomes category, ordered by spss code
+        - integer valued column, like identifier and likert type item, becomes smallest nullable integer so NA is kept
+        - other numeric column, like index variable, becomes float32
+        - plausible value, weight and ESCS stay float64, since thresholds are calculated on them
+        - dtype is decided once over every nation(decide_dtype), so that every nation has same schema
+          and concatenated nations keep compact dtype
+        """
+        overrides = codebook_dtype(self.cb)
+        dtypes = [decide_dtype([data_ls[IDX] for data_ls in data.values()], overrides, labels=self.labels[level])
+                  for IDX, level in enumerate(LEVELS)]
+        rs = dict()
+        before, after = 0, 0
+        for nation, data_ls in data.items():
+            rs[nation] = []
+            for df, dtype in zip(data_ls, dtypes):
+                before += df.memory_usage(deep=True).sum()
+                compact = df.astype(dtype)
+                after += compact.memory_usage(deep=True).sum()
+                rs[nation].append(compact)
+        logger.debug(f'memory usage: {before / 1024**2:.1f} MB -> {after / 1024**2:.1f} MB')
+        self.memory_report = {'before': int(before), 'after': int(after)}
+        return rs
+
+    @stage
+    def _validate_column(self, data: dict, columns: dict = None, strict: bool = False) -> dict:
         r"""check validity of each column,
-        cross check column na ratio
+        cross check column na ratio, report is written as data/store/cleaned/_na_report.csv
+        - when only added columns are checked, their rows are merged into previous report
+
+        Parameters
+        ----------
+        columns: dict
+            {level index: columns to check}, every column is checked when None
+        strict: bool
+            see validate.check_na_report
         """
-        warning_cnt = 0
-        
-        for idx in range(len('student school teacher'.split())):
-            invalid_col = {'SK': [], 'US': []}
-            for nation in 'SK US'.split():
-                threshold = data[nation][idx].shape[0] * 0.8
-                for col in data[nation][idx].columns:
-                    na_count = data[nation][idx][col].isna().sum()
-                    if na_count > threshold:
-                        invalid_col[nation].append(col)
-            diff_SK_US = set(invalid_col['SK']) - set(invalid_col['US'])
-            diff_US_SK = set(invalid_col['US']) - set(invalid_col['SK'])
-            logger.debug(f"difference set: SK - US, {diff_SK_US}")
-            logger.debug(f"difference set: US - SK, {diff_US_SK}")
-            if (len(diff_US_SK) == 0) and (len(diff_SK_US) == 0):
-                pass
-            else:
-                warning_cnt += 1
-                logger.warn(f'check your codebook, some column has too many NA value, {diff_SK_US}, {diff_US_SK}')
-        
-        if warning_cnt == 0:
-            return data
-        else:
-            raise ValueError('your codebook have invalid features, data count is invalid btw two country')
\ No newline at end of file
+        checked = na_diff_report(na_ratio_matrix(data, columns=columns), threshold=0.8)
+        self.na_report = checked if columns is None else Load._merge_report(self, data, checked)
+        self.store.write_report(self.na_report, stage='cleaned', name='na_report')
+
+        check_na_report(checked, strict=strict)
+        return data
+
+    def _merge_report(self, data: dict, checked: pd.DataFrame) -> pd.DataFrame:
+        r"""report of every column from report of added columns and previous report
+        - rows are not changed by incremental clean, so previous rows of other columns are still valid
+        - column removed from codebook is dropped, rows follow column order of data
+        """
+        previous = self.store.read_report('cleaned', 'na_report')
+        if previous is None:
+            return checked
+        first_nation = list(data.keys())[0]
+        order = pd.MultiIndex.from_tuples([(level, col) for level, df in zip(LEVELS, data[first_nation]) for col in df.columns],
+                                          names=['level', 'column'])
+        previous = previous.set_index(['level', 'column'])
+        previous = previous[previous.index.isin(order) & ~previous.index.isin(checked.set_index(['level', 'column']).index)]
+        merged = pd.concat([previous, checked.set_index(['level', 'column'])], axis=0)
+        return merged.reindex(order[order.isin(merged.index)]).reset_index()
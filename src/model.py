@@ -0,0 +1,435 @@
+import os
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.tree import DecisionTreeClassifier
+
+# logging
+from src.utils import generate_logger
+from src.instrument import stage
+from src.impute import RoughFix, NON_PREDICTORS
+from src.nation import group_rows, nation_name
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# directory
+App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+Result_dir = os.path.join(App_dir, 'result')
+
+DROP_COLUMNS = [col for col in NON_PREDICTORS if col != 'resilient']
+
+
+def roughfix(data: pd.DataFrame) -> pd.DataFrame:
+    r"""randomForest::na.roughfix, NA of numeric column is filled with median,
+    NA of categorical column is filled with most frequent level(first level on tie)
+    """
+    return RoughFix().fit_transform(data)
+
+
+def sample_split(label: pd.Series,
+                 split_ratio: float = 0.7,
+                 rng: np.random.Generator = None) -> np.ndarray:
+    r"""caTools::sample.split, True for train row
+    ratio of each class in train set is kept, round(split_ratio * n) rows are picked per class
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    label = np.asarray(label)
+    is_train = np.zeros(label.shape[0], dtype=bool)
+    for value in pd.unique(label):
+        position = np.flatnonzero(label == value)
+        n_train = int(np.floor(split_ratio * position.shape[0] + 0.5))
+        is_train[rng.choice(position, size=n_train, replace=False)] = True
+    return is_train
+
+
+def to_matrix(data: pd.DataFrame) -> np.ndarray:
+    r"""float32 feature matrix for sklearn tree, categorical column is encoded by its level code
+    - R tree can split factor by level subset, here level code is split by order
+    - levels are in order of spss code(reader.label_order), so split of likert item keeps its order
+    """
+    return np.column_stack([data[col].cat.codes.to_numpy() if isinstance(data[col].dtype, pd.CategoricalDtype)
+                            else data[col].to_numpy(dtype='float64')
+                            for col in data.columns]).astype('float32')
+
+
+def _grow_tree(X: np.ndarray,
+               y: np.ndarray,
+               mtry: int,
+               seed: np.random.SeedSequence,
+               importance_samples: int = None) -> tuple:
+    r"""fit one tree on bootstrap sample and measure permutation importance on its out-of-bag rows
+
+    Returns
+    -------
+    tuple
+        (tree, out-of-bag row index, out-of-bag prediction, decrease of accuracy per variable)
+    """
+    rng = np.random.default_rng(seed)
+    n = X.shape[0]
+    bootstrap = rng.integers(0, n, n)
+    oob = np.setdiff1d(np.arange(n), bootstrap, assume_unique=False).astype('int32')
+
+    tree = DecisionTreeClassifier(max_features=mtry, random_state=int(rng.integers(2**31 - 1)))
+    tree.fit(X[bootstrap], y[bootstrap])
+
+    if oob.shape[0] == 0:
+        return tree, oob, np.empty(0, dtype=y.dtype), np.zeros(X.shape[1])
+    pred = tree.predict(X[oob])
+    decrease = permuted_decrease(tree, X, y, oob, pred, [[j] for j in range(X.shape[1])], rng,
+                                 max_samples=importance_samples)
+    return tree, oob, pred, decrease
+
+
+def permuted_decrease(tree: DecisionTreeClassifier,
+                      X: np.ndarray,
+                      y: np.ndarray,
+                      oob: np.ndarray,
+                      pred: np.ndarray,
+                      groups: list,
+                      rng: np.random.Generator,
+                      max_samples: int = None,
+                      batch_rows: int = 1_000_000) -> np.ndarray:
+    r"""decrease of out-of-bag accuracy of one tree when columns of each group are permuted together
+
+    - baseline prediction of out-of-bag rows is given, not predicted again
+    - only rows whose decision path uses a column of the group can change prediction,
+      so only those rows are predicted again, group that tree never uses costs nothing
+    - permuted rows of several groups are stacked and predicted in one call
+
+    Parameters
+    ----------
+    groups: list
+        list of column positions, [[j] for j] gives importance of each variable
+    max_samples: int
+        permutation is evaluated on random subsample of out-of-bag rows of this size, every row is used when None
+    """
+    if (max_samples is not None) and (oob.shape[0] > max_samples):
+        keep = np.sort(rng.choice(oob.shape[0], size=max_samples, replace=False))
+        oob, pred = oob[keep], pred[keep]
+    X_oob, y_oob = X[oob], y[oob]
+    right = pred == y_oob
+    n_oob = oob.shape[0]
+
+    # (row x column) whether column is tested on decision path of row
+    feature = tree.tree_.feature
+    internal = np.flatnonzero(feature >= 0)
+    node_column = sparse.csr_matrix((np.ones(internal.shape[0]), (internal, feature[internal])),
+                                    shape=(feature.shape[0], X.shape[1]))
+    used = (tree.decision_path(X_oob) @ node_column).toarray() > 0
+
+    decrease = np.zeros(len(groups))
+    pending, stacked, n_stacked = [], [], 0
+
+    def flush():
+        new_pred = tree.predict(np.concatenate(stacked, axis=0))
+        offset = 0
+        for IDX, affected in pending:
+            changed = np.sum(new_pred[offset:offset + affected.shape[0]] == y_oob[affected]) - np.sum(right[affected])
+            decrease[IDX] = -changed / n_oob
+            offset += affected.shape[0]
+        pending.clear()
+        stacked.clear()
+
+    for IDX, columns in enumerate(groups):
+        affected = np.flatnonzero(used[:, columns].any(axis=1))
+        if affected.shape[0] == 0:
+            continue
+        permutation = rng.permutation(n_oob)
+        block = X_oob[affected]
+        block[:, columns] = X_oob[permutation[affected]][:, columns]
+        pending.append((IDX, affected))
+        stacked.append(block)
+        n_stacked += affected.shape[0]
+        if n_stacked >= batch_rows:
+            flush()
+            n_stacked = 0
+    if len(pending) > 0:
+        flush()
+    return decrease
+
+
+class RandomForest:
+    r"""
+    random forest classifier which follows randomForest package of R
+    - each tree is grown to purity on bootstrap sample, mtry variables are tried at each split
+    - importance is MeanDecreaseAccuracy, out-of-bag accuracy decrease by permuting variable,
+      averaged over trees and divided by its standard error like importance(rf, type=1, scale=TRUE)
+    - trees are grown in threads batch by batch, sklearn tree releases GIL so data is shared not copied
+    - with tol, growing stops before ntree once out-of-bag error and ranking of top variables stabilize
+    """
+    def __init__(self,
+                 ntree: int = 5000,
+                 mtry: int = None,
+                 n_jobs: int = 1,
+                 seed: int = 41,
+                 batch_size: int = 250,
+                 tol: float = None,
+                 importance_tol: float = 0.05,
+                 top_k: int = 10,
+                 patience: int = 2,
+                 importance_samples: int = None):
+        r"""
+        - ntree: number of trees, upper bound when tol is given
+        - batch_size: number of trees grown in parallel between convergence checks
+        - tol: stop when change of out-of-bag error is within tol and importance ranking is stable,
+          for patience batches in a row. every tree is grown when None
+        - importance_tol: ranking is stable when spearman correlation of importance of top_k variables
+          with previous batch is over 1 - importance_tol. ranks of near-zero variables stay noisy, so they are not compared
+        - importance_samples: permutation importance of each tree is measured on at most this many
+          out-of-bag rows, every out-of-bag row is used when None
+        """
+        self.ntree = ntree
+        self.mtry = mtry
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.batch_size = batch_size
+        self.tol = tol
+        self.importance_tol = importance_tol
+        self.top_k = top_k
+        self.patience = patience
+        self.importance_samples = importance_samples
+
+    @stage
+    def fit(self, data: pd.DataFrame, label: pd.Series):
+        self.variables = list(data.columns)
+        self.classes, y = np.unique(np.asarray(label), return_inverse=True)
+        X = to_matrix(data)
+        # Analysis.r uses floor(sqrt(ncol(df_train))), train data includes label column
+        mtry = int(np.floor(np.sqrt(X.shape[1] + 1))) if self.mtry is None else self.mtry
+
+        # seed of each tree is fixed in advance, so early stopped forest is prefix of full forest
+        seeds = np.random.SeedSequence(self.seed).spawn(self.ntree)
+        self.trees, self.oob_, self.oob_pred_ = [], [], []
+        decrease = []
+        votes = np.zeros((X.shape[0], self.classes.shape[0]))
+        oob_error = []
+        previous, stable = None, 0
+        with Parallel(n_jobs=self.n_jobs, prefer='threads') as parallel:
+            for start in range(0, self.ntree, self.batch_size):
+                grown = parallel(delayed(_grow_tree)(X, y, mtry, seed, self.importance_samples)
+                                 for seed in seeds[start:start + self.batch_size])
+                for tree, oob, pred, d in grown:
+                    # out-of-bag rows and baseline prediction are kept for grouped_importance
+                    self.trees.append(tree)
+                    self.oob_.append(oob)
+                    self.oob_pred_.append(pred)
+                    decrease.append(d)
+                    # out-of-bag error by number of trees, err.rate[, 1] of R
+                    votes[oob, pred] += 1
+                    voted = votes.sum(axis=1) > 0
+                    oob_error.append(np.mean(votes[voted].argmax(axis=1) != y[voted]) if voted.any() else np.nan)
+
+                if self.tol is None:
+                    continue
+                current = (oob_error[-1], RandomForest._scale(np.array(decrease)))
+                if previous is not None:
+                    top = np.argsort(-current[1], kind='stable')[:self.top_k]
+                    rank_corr = pd.Series(current[1][top]).corr(pd.Series(previous[1][top]), method='spearman')
+                    if (abs(current[0] - previous[0]) <= self.tol) and (rank_corr >= 1 - self.importance_tol):
+                        stable += 1
+                    else:
+                        stable = 0
+                previous = current
+                if stable >= self.patience:
+                    break
+
+        self._X, self._y = X, y
+        self.ntree_ = len(self.trees)
+        self.oob_error_ = np.array(oob_error)
+        self.importance_ = pd.DataFrame({'MeanDecreaseAccuracy': RandomForest._scale(np.array(decrease))},
+                                        index=self.variables)
+        logger.debug(f'forest of {self.ntree_}/{self.ntree} trees, mtry {mtry}, oob error {self.oob_error_[-1]:.4f}')
+        return self
+
+    def grouped_importance(self, groups: dict) -> pd.DataFrame:
+        r"""MeanDecreaseAccuracy of each group of variables, variables of group are permuted together
+        - cached out-of-bag rows and predictions of fit are reused, so no tree is grown again
+        - much cheaper than importance of each variable when there are few groups, like codebook category
+
+        Parameters
+        ----------
+        groups: dict
+            {group name: list of variables}, see codebook_groups
+        """
+        position = {variable: IDX for IDX, variable in enumerate(self.variables)}
+        names = [name for name, variables in groups.items() if any(v in position for v in variables)]
+        columns = [[position[v] for v in groups[name] if v in position] for name in names]
+        seeds = np.random.SeedSequence([self.seed, 1]).spawn(self.ntree_)
+        with Parallel(n_jobs=self.n_jobs, prefer='threads') as parallel:
+            decrease = parallel(delayed(permuted_decrease)(tree, self._X, self._y, oob, pred, columns,
+                                                           np.random.default_rng(seed),
+                                                           max_samples=self.importance_samples)
+                                for tree, oob, pred, seed in zip(self.trees, self.oob_, self.oob_pred_, seeds)
+                                if oob.shape[0] > 0)
+        rs = pd.DataFrame({'MeanDecreaseAccuracy': RandomForest._scale(np.array(decrease))}, index=names)
+        rs = rs.sort_values('MeanDecreaseAccuracy', ascending=False)
+        rs['Percentage'] = (rs['MeanDecreaseAccuracy'] / rs['MeanDecreaseAccuracy'].sum() * 100).round(2)
+        return rs
+
+    @staticmethod
+    def _scale(decrease: np.ndarray) -> np.ndarray:
+        r"""mean decrease of accuracy divided by its standard error, (tree x variable) -> variable"""
+        mda = decrease.mean(axis=0)
+        se = np.sqrt(np.maximum((decrease**2).mean(axis=0) - mda**2, 0) / decrease.shape[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(se > 0, mda / se, 0.0)
+
+    def predict(self, data: pd.DataFrame) -> np.ndarray:
+        r"""majority vote of trees"""
+        X = to_matrix(data[self.variables])
+        votes = np.zeros((X.shape[0], self.classes.shape[0]))
+        for tree in self.trees:
+            votes[np.arange(X.shape[0]), tree.predict(X).astype('int64')] += 1
+        return self.classes[votes.argmax(axis=1)]
+
+    def importance(self) -> pd.DataFrame:
+        r"""MeanDecreaseAccuracy in descending order with Percentage, df.mda of Analysis.r"""
+        rs = self.importance_.sort_values('MeanDecreaseAccuracy', ascending=False)
+        rs['Percentage'] = (rs['MeanDecreaseAccuracy'] / rs['MeanDecreaseAccuracy'].sum() * 100).round(2)
+        return rs
+
+
+def confusion_matrix(pred: np.ndarray, reference: np.ndarray, positive=1) -> tuple:
+    r"""caret::confusionMatrix(positive=), positive class is resilient student(1) by default
+
+    Returns
+    -------
+    tuple
+        (table of Prediction x Reference, statistics)
+    """
+    levels = np.unique(np.concatenate([np.asarray(reference), np.asarray(pred)]))
+    table = pd.crosstab(pd.Categorical(pred, categories=levels), pd.Categorical(reference, categories=levels),
+                        rownames=['Prediction'], colnames=['Reference'], dropna=False)
+    counts = table.to_numpy().astype('float64')
+    is_positive = levels == positive
+    tp, fn = counts[is_positive][:, is_positive].sum(), counts[~is_positive][:, is_positive].sum()
+    tn, fp = counts[~is_positive][:, ~is_positive].sum(), counts[is_positive][:, ~is_positive].sum()
+    total = counts.sum()
+    accuracy = np.trace(counts) / total
+    expected = (counts.sum(axis=0) * counts.sum(axis=1)).sum() / total**2
+    stats = {'Accuracy': float(accuracy),
+             'Kappa': float((accuracy - expected) / (1 - expected)) if expected < 1 else np.nan,
+             'Sensitivity': float(tp / (tp + fn)) if tp + fn > 0 else np.nan,
+             'Specificity': float(tn / (tn + fp)) if tn + fp > 0 else np.nan,
+             'Positive Class': positive}
+    return table, stats
+
+
+def codebook_groups(codebook: pd.DataFrame, variables: list) -> dict:
+    r"""{codebook category: variables} for grouped importance
+    - joined or aggregated column, like SC001_sch or TC001_3, belongs to category of its codebook variable
+    - variable not in codebook is grouped as other
+    """
+    category = codebook.set_index('variable_code')['category'].to_dict()
+    codes = sorted(category.keys(), key=len, reverse=True) # longest code first, TC001 before TC00
+    rs = dict()
+    for variable in variables:
+        code = variable if variable in category else next((c for c in codes if variable.startswith(f'{c}_')), None)
+        rs.setdefault('other' if code is None else category[code], []).append(variable)
+    return rs
+
+
+def split_nation(data: pd.DataFrame) -> dict:
+    r"""Loader of Analysis.r, {CNT label: predictors and resilient} of every nation in data,
+    identifiers and ESCS are dropped
+    """
+    predictors = data.drop([col for col in DROP_COLUMNS if col in data.columns], axis=1)
+    return {label: predictors.take(rows) for label, rows in group_rows(data, key='CNT').items()}
+
+
+def do_random_forest(data: pd.DataFrame,
+                     ntree: int = 5000,
+                     n_jobs: int = 1,
+                     seed: int = 41,
+                     tol: float = None,
+                     importance_samples: int = None,
+                     groups: dict = None,
+                     imputer: RoughFix = None) -> dict:
+    r"""doRandomForest of Analysis.r, roughfix -> stratified 70/30 split -> forest -> test confusion matrix
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        predictors and resilient column of one nation
+    tol: float
+        early stopping tolerance of RandomForest, every tree is grown when None
+    importance_samples: int
+        max out-of-bag rows per tree for permutation importance, see RandomForest
+    groups: dict
+        {group: variables}, when given grouped importance is also measured as mda_group
+    imputer: RoughFix
+        fitted statistics of this nation, like EDA.imputer, roughfix is fitted again when None
+
+    Returns
+    -------
+    dict
+        model, mda(importance table), confusion_matrix, stats, (mda_group)
+    """
+    data = roughfix(data) if imputer is None else imputer.transform(data)
+    return fit_design(data.drop('resilient', axis=1), data['resilient'],
+                      ntree=ntree, n_jobs=n_jobs, seed=seed, tol=tol,
+                      importance_samples=importance_samples, groups=groups)
+
+
+def fit_design(predictors: pd.DataFrame,
+               label: pd.Series,
+               ntree: int = 5000,
+               n_jobs: int = 1,
+               seed: int = 41,
+               tol: float = None,
+               importance_samples: int = None,
+               groups: dict = None) -> dict:
+    r"""stratified 70/30 split -> forest -> test confusion matrix on imputed predictors,
+    predictors can be shared by several fits since it is not modified
+    """
+    rng = np.random.default_rng(seed)
+    label = pd.Series(np.asarray(label), index=predictors.index).astype('int64')
+    is_train = sample_split(label, split_ratio=0.7, rng=rng)
+    rf = RandomForest(ntree=ntree, n_jobs=n_jobs, seed=seed, tol=tol, importance_samples=importance_samples)
+    rf.fit(predictors[is_train], label[is_train])
+
+    table, stats = confusion_matrix(rf.predict(predictors[~is_train]), label[~is_train].to_numpy(), positive=1)
+    logger.debug(f'confusion matrix\n{table}\n{stats}')
+    stats['Trees'] = rf.ntree_
+    rs = {'model': rf, 'mda': rf.importance(), 'confusion_matrix': table, 'stats': stats}
+    if groups is not None:
+        rs['mda_group'] = rf.grouped_importance(groups)
+    return rs
+
+
+def main(data_final: dict,
+         PV: int,
+         option: str = 'sliced',
+         ntree: int = 5000,
+         n_jobs: int = 1,
+         seed: int = 41,
+         tol: float = None,
+         importance_samples: int = None,
+         codebook: pd.DataFrame = None,
+         imputers: dict = None) -> dict:
+    r"""run random forest of each nation on EDA.data_final in memory,
+    write result/mda{PV}_{option}_{nation}.csv and result/confusion{PV}_{option}_{nation}.csv
+    - with codebook, importance of each codebook category is written as result/mda_group{PV}_{option}_{nation}.csv
+    - imputers is {CNT label: RoughFix} of EDA.imputer[option], statistics are reused instead of fitted again
+    - nation of file name is short name of nation.NATIONS, or CNT label made safe for file name
+    """
+    os.makedirs(Result_dir, exist_ok=True)
+    rs = dict()
+    for label, national in split_nation(data_final[option]).items():
+        nation = nation_name(label)
+        logger.debug(f'random forest of {nation}, PV{PV} {option}: {national.shape}')
+        groups = None
+        if codebook is not None:
+            groups = codebook_groups(codebook, [col for col in national.columns if col != 'resilient'])
+        rs[nation] = do_random_forest(national, ntree=ntree, n_jobs=n_jobs, seed=seed, tol=tol,
+                                      importance_samples=importance_samples, groups=groups,
+                                      imputer=None if imputers is None else imputers.get(label))
+        rs[nation]['mda'].to_csv(os.path.join(Result_dir, f'mda{PV}_{option}_{nation}.csv'), index_label='variable')
+        logger.debug(f"{nation}: {rs[nation]['stats']['Trees']} trees are used")
+        rs[nation]['confusion_matrix'].to_csv(os.path.join(Result_dir, f'confusion{PV}_{option}_{nation}.csv'))
+        if groups is not None:
+            rs[nation]['mda_group'].to_csv(os.path.join(Result_dir, f'mda_group{PV}_{option}_{nation}.csv'), index_label='category')
+    return rs
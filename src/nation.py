@@ -0,0 +1,79 @@
+import re
+import numpy as np
+import pandas as pd
+from src.weights import group_codes, weight_matrix, weighted_quantile
+
+# column every per-nation step is grouped by, value is label of CNTRYID like 'Korea'
+NATION_KEY = 'CNTRYID'
+
+# {nation: CNTRYID label}, nation is name of store partition and result file
+NATIONS = {'SK': 'Korea', 'US': 'United States'}
+
+# title of figures
+REAL_NAME = {'SK': '대한민국', 'US': '미국'}
+
+
+def nation_name(label: str) -> str:
+    r"""nation of CNTRYID label, short name of NATIONS or label made safe for file name"""
+    known = {value: key for key, value in NATIONS.items()}
+    if label in known:
+        return known[label]
+    return re.sub(r'[^0-9A-Za-z]+', '_', str(label)).strip('_')
+
+
+def resolve_nations(nations=None) -> dict:
+    r"""{nation: CNTRYID label}
+
+    Parameters
+    ----------
+    nations: dict, list
+        {nation: label} is used as it is, list of labels gets nation_name of each label.
+        NATIONS when None
+    """
+    if nations is None:
+        return dict(NATIONS)
+    if isinstance(nations, dict):
+        return dict(nations)
+    return {nation_name(label): label for label in nations}
+
+
+def group_rows(data: pd.DataFrame, key: str = NATION_KEY) -> dict:
+    r"""{label: row positions} of every nation in one group-by pass, in order of appearance"""
+    return {str(label): rows for label, rows in
+            data.groupby(key, observed=True, sort=False).indices.items()}
+
+
+def split_by_nation(data: pd.DataFrame, nations: dict, key: str = NATION_KEY) -> dict:
+    r"""{nation: rows of nation}, taken by positions of one group-by instead of one mask per nation
+    - nation which has no row gets empty frame
+    """
+    rows = group_rows(data, key=key)
+    empty = np.array([], dtype='int64')
+    return {nation: data.take(rows.get(label, empty)).reset_index(drop=True) for nation, label in nations.items()}
+
+
+def stack_nations(data: dict) -> pd.DataFrame:
+    r"""stack {nation: pd.DataFrame} into one frame in order of nations"""
+    return pd.concat(list(data.values()), axis=0, ignore_index=True)
+
+
+def group_quantile(data: pd.DataFrame, column: str, q: float, nations: dict, key: str = NATION_KEY,
+                   weight: str = None) -> dict:
+    r"""{nation: quantile of column}, one group-by over every nation, NaN for nation which has no row
+    - with weight column, quantile is weighted like PISA percentile, see weights.weighted_quantile
+    """
+    if weight is None:
+        values = data[column].astype('float64').groupby(data[key], observed=True, sort=False).quantile(q)
+        values = {str(label): value for label, value in values.items()}
+    else:
+        codes, labels = group_codes(data, key)
+        quantile = weighted_quantile(data[column].to_numpy(dtype='float64', na_value=np.nan),
+                                     weight_matrix(data, [weight]), q, codes, len(labels))
+        values = dict(zip(labels, quantile[:, 0]))
+    return {nation: values.get(label, np.nan) for nation, label in nations.items()}
+
+
+def broadcast(values: dict, data: pd.DataFrame, nations: dict, key: str = NATION_KEY) -> np.ndarray:
+    r"""{nation: value} to value of each row by its nation, NaN for row of other nation"""
+    by_label = {label: values[nation] for nation, label in nations.items()}
+    return data[key].astype(str).map(by_label).to_numpy(dtype='float64', na_value=np.nan)
@@ -0,0 +1,350 @@
+import os
+import logging
+from logging.config import dictConfig
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+
+# logging
+from src.utils import generate_logger, row_wise_na
+from src.instrument import stage
+from src.reader import IDENTIFIER_COLUMNS, open_zip_member
+from src.store import Store, LEVELS
+from src.load import Load, codebook_dtype, decide_dtype
+from src.nation import NATION_KEY, nation_name, resolve_nations, group_rows
+from src.join import aggregate_teacher, join_school_level
+from src.eda import EDA
+from src.streaming import StreamingQuantile, StreamingDescribe
+from src.writer import FrameAppender, WRITERS
+from src.validate import validate_store, check_na_report
+from src.cache import StageCache, archive_fingerprint, frame_fingerprint, code_version
+from src.weights import FINAL_WEIGHT, WEIGHT_COLUMNS, weight_matrix, resilient_estimates
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# directory
+App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+Data_dir = os.path.join(App_dir, 'data')
+Result_dir = os.path.join(App_dir, 'result')
+
+
+class OutOfCore:
+    r"""
+    clean, NA drop, ESCS threshold and labeling of every PV over nation partitions of columnar store,
+    memory is bounded by chunksize and batch_size instead of size of international file
+    - spss file is streamed chunk by chunk into base store, one partition per nation
+    - each stage reads partition batch by batch(memory-mapped) and appends result to next partition or result file
+    - NA count, describe table and ESCS quantile are streaming aggregations, see streaming
+    - school and teacher data are loaded per nation, they are small compared to student data
+    - nations are processed in sorted order of their name, like partitions of cleaned store read by EDA
+    - result files are same as Load + EDA.main_all_PV without impute, rows and nations in same order,
+      except that describe table has no quartiles
+    - estimate_weighted holds ESCS, PVs and weights of one nation at once, see its docstring
+    """
+    def __init__(self,
+                 codeBook: str = 'codebook.xlsx',
+                 nations='all',
+                 chunksize: int = 50000,
+                 batch_size: int = 50000,
+                 teacher_aggregation: dict = None,
+                 weighted: bool = False,
+                 data_dir: str = None,
+                 result_dir: str = None):
+        r"""
+        - nations: {nation: CNTRYID label} or list of labels, 'all' keeps every nation of student file
+        - chunksize: number of rows parsed at once when streaming spss file
+        - batch_size: number of student rows of one batch in later stages, peak memory scales with this value
+        - teacher_aggregation: see EDA
+        - weighted: ESCS threshold is quantile weighted by W_FSTUWT, see EDA
+        """
+        self.Data_dir = Data_dir if data_dir is None else data_dir
+        self.result_dir = Result_dir if result_dir is None else result_dir
+        self.cb = pd.read_excel(os.path.join(self.Data_dir, codeBook))
+        self.chunksize = chunksize
+        self.batch_size = batch_size
+        self.teacher_aggregation = teacher_aggregation
+        self.weight = FINAL_WEIGHT if weighted else None
+        self.store = Store(self.Data_dir)
+        self.nation_spec = 'all' if nations == 'all' else resolve_nations(nations)
+        self.nation_code = None if nations == 'all' else self.nation_spec # resolved when base store is built
+        self.archives = {zip_name: archive_fingerprint(os.path.join(self.Data_dir, zip_name))
+                         if os.path.isfile(os.path.join(self.Data_dir, zip_name)) else None
+                         for zip_name, _ in Load.spss_member.values()}
+
+    @stage
+    def ingest(self) -> dict:
+        r"""stream spss file of each level into base store, {nation: CNTRYID label}
+        - reused when archives and nations are same as before and every codebook variable is in it,
+          otherwise every spss file is streamed again
+        - value labels of each level are kept in meta, categories are ordered by spss code in clean
+        - nation which has no row in a level gets empty partition, like school or teacher file of some nations
+        - nation_code is sorted by name, so every later stage follows order of EDA
+        """
+        required = set(IDENTIFIER_COLUMNS) | set(self.cb['variable_code'].values)
+        if OutOfCore._is_reusable(self, required):
+            self.nation_code = dict(sorted(self.store.read_meta('base')['nation_code'].items()))
+            logger.debug(f'reuse base store of {len(self.nation_code)} nations')
+            return self.nation_code
+
+        if any(self.archives[zip_name] is None for zip_name, _ in Load.spss_member.values()):
+            raise ValueError('put PISA 2018 data SPSS file in data folder')
+        self.store.remove('base')
+        schema, labels = dict(), dict()
+        for level in LEVELS:
+            zip_name, member = Load.spss_member[level]
+            nations = None if self.nation_code is None else list(self.nation_code.values())
+            with open_zip_member(os.path.join(self.Data_dir, zip_name), member, required, nations,
+                                 self.chunksize) as (columns, level_labels, chunks):
+                written, template = OutOfCore._write_chunks(self, chunks, level)
+            schema[level], labels[level] = columns, level_labels
+            if self.nation_code is None: # nations of 'all' are decided by student file
+                self.nation_code = resolve_nations(sorted(written))
+            for nation, label in self.nation_code.items():
+                if label not in written:
+                    self.store.write(template, 'base', level, nation)
+        self.nation_code = dict(sorted(self.nation_code.items()))
+        self.store.write_meta('base', {'archives': self.archives, 'nations': self.nation_spec,
+                                       'nation_code': self.nation_code, 'columns': schema, 'labels': labels})
+        return self.nation_code
+
+    @stage
+    def clean(self, strict: bool = False):
+        r"""only codebook variables in compact dtype, written as cleaned store
+        - dtype is decided over every nation in first pass, so that every partition has one schema:
+          value range of numeric column and categories of labelled column are aggregated batch by batch
+        - cast and written batch by batch in second pass
+        - NA ratio is checked from arrow metadata, see validate.validate_store
+        - strict: see validate.check_na_report
+        """
+        variables = set(self.cb['variable_code'].values)
+        first_nation = list(self.nation_code.keys())[0]
+        overrides = codebook_dtype(self.cb)
+        self.store.remove('cleaned') # partitions without key are never cached, even when validation fails
+
+        for level in LEVELS:
+            columns = [col for col in self.store.columns('base', level, first_nation) if col in variables]
+            dtypes = OutOfCore._decide_dtype(self, level, columns, overrides)
+            for nation in self.nation_code.keys():
+                with self.store.writer('cleaned', level, nation) as writer:
+                    for batch in self.store.iter_batches('base', level, nation, self.batch_size, columns=columns):
+                        writer.write(batch[columns].astype(dtypes))
+
+        self.na_report = validate_store(self.store, 'cleaned', threshold=0.8)
+        self.store.write_report(self.na_report, stage='cleaned', name='na_report')
+        check_na_report(self.na_report, strict=strict)
+
+        required = sorted(set(IDENTIFIER_COLUMNS) | variables)
+        self.store.write_key('cleaned', StageCache(self.Data_dir).key('clean', self.archives, required, self.nation_spec,
+                                                                      frame_fingerprint(self.cb),
+                                                                      code_version('reader', 'load', 'validate', 'nation', 'outofcore')))
+        self.store.write_meta('cleaned', {'nation_code': self.nation_code})
+
+    @stage
+    def drop_student(self, na_threshold: int = 30) -> dict:
+        r"""join school level data and drop student who have many NA, batch by batch of each nation
+        - result is written as dropped store, only student level
+        - describe table of each nation is streamed, Full is merge of them
+        - first pass of ESCS quantile is done on kept students in same pass
+
+        Parameters
+        ----------
+        na_threshold: int
+            remove rows that contain more than a threshold numbver of NA values.
+        """
+        self.store.remove('dropped')
+        describe = dict()
+        self.escs_quantile = dict()
+        for nation in self.nation_code.keys():
+            school_level = OutOfCore._school_level(self, nation)
+            describe[nation] = StreamingDescribe()
+            self.escs_quantile[nation] = StreamingQuantile(0.25, weighted=self.weight is not None)
+            before, after = 0, 0
+            with self.store.writer('dropped', 'stu', nation) as writer:
+                for batch in self.store.iter_batches('cleaned', 'stu', nation, self.batch_size):
+                    joined = join_school_level(batch, school_level)
+                    describe[nation].update(joined)
+                    kept = joined.loc[~row_wise_na(joined, na_threshold=na_threshold)['full']['drop']]
+                    OutOfCore._update_quantile(self, self.escs_quantile[nation].update, kept)
+                    writer.write(kept)
+                    before, after = before + joined.shape[0], after + kept.shape[0]
+            logger.debug(f'NA drop of {nation}: {before - after}, kept {after}')
+
+        full = StreamingDescribe()
+        for national in describe.values():
+            full = full.merge(national)
+        self.rs_deescriptive = {'Full': full.table(), **{nation: table.table() for nation, table in describe.items()}}
+        return self.rs_deescriptive
+
+    @stage
+    def escs_threshold(self) -> dict:
+        r"""{nation: escs threshold}, second pass of ESCS quantile reads only ESCS(and weight) of dropped store"""
+        columns = ['ESCS'] if self.weight is None else ['ESCS', self.weight]
+        threshold = dict()
+        for nation, quantile in self.escs_quantile.items():
+            for batch in self.store.iter_batches('dropped', 'stu', nation, self.batch_size, columns=columns):
+                OutOfCore._update_quantile(self, quantile.collect, batch)
+            threshold[nation] = quantile.result()
+        self.escs_score = threshold
+        logger.debug(f'escs threshold: {threshold}')
+        return threshold
+
+    @stage
+    def slice_by_ESCS(self,
+                      acad_threshold: int,
+                      PV_list: list = list(range(1, 11)),
+                      fmt: str = 'parquet') -> list:
+        r"""label resilient student of every PV and write result/preprocessing{PV}_{full, sliced}.{fmt}
+        - label and slice are same as EDA.slice_by_ESCS_all_PV, columns are same as EDA.minor_adjustment_all_PV
+        - every result file is appended batch by batch, none of them is held in memory
+
+        Parameters
+        ----------
+        acad_threshold: int
+            academic score thrshold
+        PV_list: list
+            PV numbers, from 1 to 10
+        """
+        assert type(acad_threshold) == int, 'insert valid threshold type'
+        assert all((PV > 0) and (PV < 11) for PV in PV_list), print('>> Error__PV_list: ', PV_list)
+        self.PV_list = list(PV_list)
+        self.threshold_info = {nation: {'academic_score': acad_threshold, 'escs_score': self.escs_score[nation]}
+                               for nation in self.nation_code.keys()}
+
+        extension = WRITERS[fmt][1]
+        with ExitStack() as stack: # every file is removed when one of batches fails
+            appenders = {(PV, option): stack.enter_context(
+                FrameAppender(os.path.join(self.result_dir, f'preprocessing{PV}_{option}{extension}'), fmt=fmt))
+                for PV in self.PV_list for option in ['full', 'sliced']}
+            for nation in self.nation_code.keys():
+                sliced, resilient = 0, np.zeros(len(self.PV_list), dtype='int64')
+                for batch in self.store.iter_batches('dropped', 'stu', nation, self.batch_size):
+                    is_low_escs = batch['ESCS'].to_numpy(dtype='float64', na_value=np.nan) < self.escs_score[nation]
+                    acad = batch[[f'PV{PV}READ' for PV in self.PV_list]].to_numpy(dtype='float64', na_value=np.nan)
+                    label = ((acad > acad_threshold) & is_low_escs[:, None]).astype('int64')
+                    merged = {'full': (EDA._adjust_columns(batch), label),
+                              'sliced': (EDA._adjust_columns(batch.loc[is_low_escs].reset_index(drop=True)), label[is_low_escs])}
+                    for option, (data, option_label) in merged.items():
+                        for IDX, PV in enumerate(self.PV_list):
+                            appenders[(PV, option)].write(EDA._attach_label(data, option_label[:, IDX]))
+                    sliced, resilient = sliced + int(is_low_escs.sum()), resilient + label.sum(axis=0)
+                logger.debug(f'{nation}: sliced {sliced}, # of academic resilient student {dict(zip(self.PV_list, resilient))}')
+        return [appender.path for appender in appenders.values()]
+
+    @stage
+    def estimate_weighted(self,
+                          acad_threshold: int,
+                          PV_list: list = None) -> pd.DataFrame:
+        r"""EDA.estimate_weighted of each nation, on ESCS, PVs and weights of dropped store only
+        - known limit: these columns of one nation are read at once, since quantile under every replicate weight
+          needs whole column. memory is rows of largest nation x (2 + PVs + 81 weights) float64,
+          about 30MB for 40000 students, not bounded by batch_size
+        """
+        columns = self.store.columns('dropped', 'stu', list(self.nation_code.keys())[0])
+        PV_list = [PV for PV in range(1, 11) if f'PV{PV}READ' in columns] if PV_list is None else PV_list
+        projection = [NATION_KEY, 'ESCS'] + [f'PV{PV}READ' for PV in PV_list] + WEIGHT_COLUMNS
+        rs = []
+        for nation, label in self.nation_code.items():
+            national = resilient_estimates(self.store.read('dropped', 'stu', nation, columns=projection),
+                                           acad_threshold, PV_list, key=NATION_KEY)
+            rs.append(national.rename(index={label: nation}, level=0))
+        rs = pd.concat(rs, axis=0)
+        rs.index = rs.index.set_names('nation', level=0)
+
+        self.rs_weighted = rs
+        os.makedirs(self.result_dir, exist_ok=True)
+        rs.to_csv(os.path.join(self.result_dir, 'weighted_estimates.csv'))
+        return rs
+
+    def _is_reusable(self, required: set) -> bool:
+        meta = self.store.read_meta('base')
+        if (meta is None) or (not self.store.exists('base')) or (meta['nations'] != self.nation_spec) \
+                or ('nation_code' not in meta) or ('labels' not in meta):
+            return False
+        if (meta['archives'] != self.archives) and not all(v is None for v in self.archives.values()):
+            return False
+        first_nation = list(meta['nation_code'].keys())[0]
+        for level in LEVELS:
+            available = set(self.store.columns('base', level, first_nation))
+            if any(col not in available for col in meta['columns'][level] if col in required):
+                return False
+        return True
+
+    def _write_chunks(self, chunks, level: str) -> tuple:
+        r"""append rows of each nation in chunks to its base partition, (written labels, empty template)
+        - categories of labelled column differ chunk by chunk, so they are kept as nullable string until clean
+        """
+        known = None if self.nation_code is None else {label: nation for nation, label in self.nation_code.items()}
+        template = None
+        with ExitStack() as stack:
+            writers = dict()
+            for chunk in chunks:
+                chunk = OutOfCore._unlabel(chunk)
+                template = chunk.iloc[:0] if template is None else template
+                for label, rows in group_rows(chunk, NATION_KEY).items():
+                    if label not in writers:
+                        nation = nation_name(label) if known is None else known[label]
+                        writers[label] = stack.enter_context(self.store.writer('base', level, nation))
+                    writers[label].write(chunk.take(rows))
+        logger.debug(f'{level}: {len(writers)} nations written')
+        return set(writers.keys()), template
+
+    @staticmethod
+    def _unlabel(chunk: pd.DataFrame) -> pd.DataFrame:
+        r"""labelled(categorical) column to nullable string, so that every chunk has same arrow type
+        - missing label stays NA, astype(str) writes it as 'nan' in some pandas versions
+        """
+        categorical = chunk.select_dtypes('category').columns
+        rs = chunk.astype({col: 'string' for col in categorical})
+        before, after = chunk[categorical].isna().sum(), rs[categorical].isna().sum()
+        if not before.equals(after):
+            raise ValueError(f'NA of labelled columns is lost in conversion: {list(before.index[before != after])}')
+        return rs
+
+    def _decide_dtype(self, level: str, columns: list, overrides: dict) -> dict:
+        r"""{column: dtype} over every nation, decide_dtype of batches of every base partition"""
+        labels = self.store.read_meta('base')['labels'][level]
+        batches = (batch for nation in self.nation_code.keys()
+                   for batch in self.store.iter_batches('base', level, nation, self.batch_size, columns=columns))
+        return decide_dtype(batches, overrides, labels=labels)
+
+    def _school_level(self, nation: str) -> list:
+        r"""school and aggregated teacher data of nation, like EDA.join_splited_data"""
+        demographic = self.cb[self.cb['category'] == 'identifier'].shape[0]
+        df_school = self.store.read('cleaned', 'sch', nation)
+        df_teacher = self.store.read('cleaned', 'tch', nation)
+        school_level = []
+        if df_school.shape[1] <= demographic:
+            logger.critical('school data is empty')
+        else:
+            school_level.append(('sch', df_school))
+        if df_teacher.shape[1] <= demographic:
+            logger.critical('teacher data is empty')
+        else:
+            school_level.append(('tch', aggregate_teacher(df_teacher, aggregation=self.teacher_aggregation)))
+        return school_level
+
+    def _update_quantile(self, update, data: pd.DataFrame):
+        r"""feed ESCS(and weight) of data to update or collect of StreamingQuantile"""
+        weights = None if self.weight is None else weight_matrix(data, [self.weight])[:, 0]
+        update(data['ESCS'].to_numpy(dtype='float64', na_value=np.nan), weights)
+
+
+def main(nations='all',
+         PV_list: list = list(range(1, 11)),
+         fmt: str = 'parquet',
+         batch_size: int = 50000,
+         weighted: bool = False,
+         strict: bool = False,
+         data_dir: str = None,
+         result_dir: str = None) -> OutOfCore:
+    r"""load and eda of every PV out of core, result files are same as main.py --load and --eda --loop"""
+    outofcore = OutOfCore(codeBook='codebook.xlsx', nations=nations, batch_size=batch_size, weighted=weighted,
+                          data_dir=data_dir, result_dir=result_dir)
+    outofcore.ingest()
+    outofcore.clean(strict=strict)
+    outofcore.drop_student(na_threshold=30)
+    outofcore.escs_threshold()
+    outofcore.slice_by_ESCS(acad_threshold=480, PV_list=PV_list, fmt=fmt)
+    if weighted:
+        outofcore.estimate_weighted(acad_threshold=480, PV_list=PV_list)
+    return outofcore
@@ -0,0 +1,177 @@
+import os
+import logging
+from logging.config import dictConfig
+from contextlib import contextmanager
+import shutil
+import tempfile
+import zipfile
+import pandas as pd
+import pyreadstat
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# columns that identify nation, school, teacher and student in every PISA file
+IDENTIFIER_COLUMNS = ['CNTRYID', 'CNT', 'CNTSCHID', 'CNTTCHID', 'CNTSTUID']
+
+
+def spss_columns(spss_path: str) -> list:
+    r"""read column names of spss file without loading any rows"""
+    _, meta = pyreadstat.read_sav(spss_path, metadataonly=True)
+    return list(meta.column_names)
+
+
+def value_labels(spss_path: str) -> dict:
+    r"""{column: value labels in order of spss code} of labelled columns, without loading any rows"""
+    _, meta = pyreadstat.read_sav(spss_path, metadataonly=True)
+    return {col: list(dict.fromkeys(labels[code] for code in sorted(labels)))
+            for col, labels in meta.variable_value_labels.items()}
+
+
+def label_order(categories, labels: list) -> list:
+    r"""categories of labelled column in order of spss code, like 'Strongly disagree' < 'Disagree' < 'Agree'
+    - pyreadstat and astype('category') sort labels alphabetically, which scrambles order of likert item
+    - value which has no label comes after labelled values
+    """
+    present = set(categories)
+    return [label for label in labels if label in present] + sorted(present - set(labels), key=str)
+
+
+def iter_spss_chunks(spss_path: str,
+                     usecols: list = None,
+                     nations: list = None,
+                     chunksize: int = 50000):
+    r"""yield chunks of spss file one by one, only required columns and nations are kept
+    - categories of labelled column differ chunk by chunk, consumer decides how to unify them
+
+    Parameters
+    ----------
+    usecols: list
+        columns to read, all columns are read when None
+    nations: list
+        value of CNTRYID to keep, every nation is kept when None
+    chunksize: int
+        number of rows parsed at once, peak memory scales with this value
+    """
+    if (nations is not None) and (usecols is not None) and ('CNTRYID' not in usecols):
+        usecols = ['CNTRYID'] + list(usecols)
+
+    total = 0
+    for chunk, _ in pyreadstat.read_file_in_chunks(pyreadstat.read_sav, spss_path,
+                                                   chunksize=chunksize,
+                                                   usecols=usecols,
+                                                   apply_value_formats=True,
+                                                   formats_as_category=True):
+        total += chunk.shape[0]
+        if nations is not None:
+            chunk = chunk[chunk['CNTRYID'].isin(nations)]
+        yield chunk
+    logger.debug(f'read {total} rows from {spss_path}')
+
+
+def read_spss_chunked(spss_path: str,
+                      usecols: list = None,
+                      nations: list = None,
+                      chunksize: int = 50000) -> pd.DataFrame:
+    r"""read spss file chunk by chunk, keep only required columns and nations
+
+    Parameters
+    ----------
+    usecols: list
+        columns to read, all columns are read when None
+    nations: list
+        value of CNTRYID to keep, every nation is kept when None
+    chunksize: int
+        number of rows parsed at once, peak memory scales with this value
+
+    categories of labelled column are ordered by spss code, see label_order
+    """
+    chunks = []
+    categorical = set()
+    for chunk in iter_spss_chunks(spss_path, usecols=usecols, nations=nations, chunksize=chunksize):
+        categorical.update(chunk.select_dtypes('category').columns)
+        chunks.append(chunk)
+
+    rs = pd.concat(chunks, axis=0, ignore_index=True)
+    # categories differ chunk by chunk, so concatenated column falls back to object
+    labels = value_labels(spss_path)
+    for col in categorical:
+        # astype ignores order of categories when column is already categorical
+        rs[col] = pd.Categorical(rs[col], categories=label_order(rs[col].dropna().unique(), labels.get(col, [])))
+    logger.debug(f'kept rows: {rs.shape}')
+    return rs
+
+
+@contextmanager
+def spool_zip_member(zipfile_dir: str, member: str, buffer_size: int = 16 * 1024 * 1024, spool_dir: str = None):
+    r"""copy zip member into temporary file outside data folder, remove it on exit
+
+    spss parser reads from file path and parses chunks by row offset, so member is not streamed from archive.
+    whole uncompressed member is copied buffer by buffer instead of extracting whole archive into data folder
+    - disk usage is uncompressed size of member(several GB for student file), file is read twice(copy and parse)
+    - free space of spool_dir is checked before copy, temporary folder of system(TMPDIR) when None
+    """
+    with zipfile.ZipFile(zipfile_dir, 'r') as zip_folder:
+        size = zip_folder.getinfo(member).file_size
+        with tempfile.TemporaryDirectory(prefix='pisa_', dir=spool_dir) as tmp_dir:
+            free = shutil.disk_usage(tmp_dir).free
+            if size > free:
+                raise OSError(f'{member} needs {size / 1024**2:.0f} MB in {tmp_dir}, but {free / 1024**2:.0f} MB is free, '
+                              f'set TMPDIR to folder of larger disk')
+            spool_path = os.path.join(tmp_dir, os.path.basename(member))
+            with zip_folder.open(member) as src, open(spool_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, buffer_size)
+            logger.debug(f'{member} is spooled: {size / 1024**2:.1f} MB')
+            yield spool_path
+
+
+def read_zip_member(zipfile_dir: str,
+                    spss_filename: str,
+                    required: set = None,
+                    nations: list = None,
+                    chunksize: int = 50000,
+                    return_columns: bool = False) -> pd.DataFrame:
+    r"""read spss member of zip archive, keep only required columns and nations
+
+    Parameters
+    ----------
+    required: set
+        identifiers and variables to keep, columns which don't exist in file are ignored
+    return_columns: bool
+        also return every column name and value_labels of spss file, as (dataframe, columns, labels)
+    """
+    assert zipfile_dir[-4:] == '.zip'
+    assert spss_filename[-4:] == '.sav'
+    with spool_zip_member(zipfile_dir, spss_filename) as spss_path:
+        columns = spss_columns(spss_path)
+        usecols = None
+        if required is not None:
+            usecols = [col for col in columns if col in required]
+        rs = read_spss_chunked(spss_path, usecols=usecols, nations=nations, chunksize=chunksize)
+        labels = value_labels(spss_path)
+    if return_columns:
+        return rs, columns, labels
+    return rs
+
+
+@contextmanager
+def open_zip_member(zipfile_dir: str,
+                    spss_filename: str,
+                    required: set = None,
+                    nations: list = None,
+                    chunksize: int = 50000):
+    r"""streaming version of read_zip_member, yield (every column name of spss file, value_labels, iterator of chunks)
+    - nothing is concatenated, so memory is bounded by chunksize whatever the size of file
+    - disk is not bounded, whole member is spooled into temporary file, see spool_zip_member
+    - chunks should be consumed inside with block, spooled spss file is removed on exit
+    """
+    assert zipfile_dir[-4:] == '.zip'
+    assert spss_filename[-4:] == '.sav'
+    with spool_zip_member(zipfile_dir, spss_filename) as spss_path:
+        columns = spss_columns(spss_path)
+        usecols = None
+        if required is not None:
+            usecols = [col for col in columns if col in required]
+        yield columns, value_labels(spss_path), iter_spss_chunks(spss_path, usecols=usecols, nations=nations, chunksize=chunksize)
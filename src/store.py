@@ -0,0 +1,171 @@
+import os
+import glob
+import shutil
+import json
+import logging
+from logging.config import dictConfig
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# logging
+from src.utils import generate_logger
+from src.writer import FrameAppender
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+LEVELS = ['stu', 'sch', 'tch']
+
+
+def write_arrow(data: pd.DataFrame, path: str):
+    r"""write dataframe as uncompressed arrow ipc file, which can be memory-mapped"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path) # file may be memory-mapped by reader, so it is replaced not overwritten
+
+
+def read_arrow(path: str, columns: list = None) -> pd.DataFrame:
+    r"""memory-map arrow ipc file and convert only requested columns"""
+    return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+class Store:
+    r"""
+    columnar store of PISA data, partitioned by stage, level and nation.
+    each partition is uncompressed arrow ipc(feather v2) file, so it can be memory-mapped
+    and only requested columns are materialized.
+
+    layout: {root}/{stage}/level={level}/nation={nation}.arrow
+    """
+    def __init__(self, root: str):
+        self.root = os.path.join(root, 'store')
+
+    def path(self, stage: str, level: str, nation: str) -> str:
+        if level not in LEVELS:
+            raise ValueError('invalid argument, only stu, sch, tch allowed')
+        return os.path.join(self.root, stage, f'level={level}', f'nation={nation}.arrow')
+
+    def exists(self, stage: str, level: str = None) -> bool:
+        r"""check every level(or given level) of stage has at least one partition"""
+        levels = LEVELS if level is None else [level]
+        return all(len(Store.nations(self, stage, lv)) > 0 for lv in levels)
+
+    def nations(self, stage: str, level: str = 'stu') -> list:
+        r"""sorted nation partitions of stage"""
+        pattern = os.path.join(self.root, stage, f'level={level}', 'nation=*.arrow')
+        return sorted(os.path.basename(p)[len('nation='):-len('.arrow')] for p in glob.glob(pattern))
+
+    def write(self, data: pd.DataFrame, stage: str, level: str, nation: str):
+        write_arrow(data, Store.path(self, stage, level, nation))
+        logger.debug(f'write {stage}/{level}/{nation}: {data.shape}')
+
+    def writer(self, stage: str, level: str, nation: str) -> FrameAppender:
+        r"""appender of partition, dataframes are written batch by batch and partition appears on close
+
+        Examples
+        --------
+        with store.writer('dropped', 'stu', nation) as writer:
+            for batch in store.iter_batches('cleaned', 'stu', nation):
+                writer.write(batch)
+        """
+        return FrameAppender(Store.path(self, stage, level, nation), fmt='feather')
+
+    def iter_batches(self, stage: str, level: str, nation: str, batch_size: int = 50000, columns: list = None):
+        r"""yield partition as dataframes of at most batch_size rows
+        - partition is memory-mapped, only rows and columns of current batch are materialized
+        - categories of categorical column are same in every batch
+        - partition without row yields one empty dataframe, so that its schema is kept
+        """
+        if columns is not None:
+            available = Store.columns(self, stage, level, nation)
+            columns = [col for col in available if col in set(columns)]
+        with pa.memory_map(Store.path(self, stage, level, nation)) as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            for offset in range(0, max(table.num_rows, 1), batch_size):
+                yield table.slice(offset, batch_size).to_pandas()
+
+    def num_rows(self, stage: str, level: str, nation: str) -> int:
+        r"""number of rows from arrow metadata"""
+        with pa.memory_map(Store.path(self, stage, level, nation)) as source:
+            return pa.ipc.open_file(source).read_all().num_rows # zero copy, no column data is touched
+
+    def read(self, stage: str, level: str, nation: str, columns: list = None) -> pd.DataFrame:
+        r"""memory-map partition and convert only requested columns
+
+        Parameters
+        ----------
+        columns: list
+            columns to load, columns which don't exist in partition are ignored
+        """
+        path = Store.path(self, stage, level, nation)
+        if columns is not None:
+            available = Store.columns(self, stage, level, nation)
+            columns = [col for col in available if col in set(columns)]
+        return read_arrow(path, columns=columns)
+
+    def columns(self, stage: str, level: str, nation: str) -> list:
+        r"""read column names from schema only"""
+        with pa.memory_map(Store.path(self, stage, level, nation)) as source:
+            return pa.ipc.open_file(source).schema.names
+
+    def null_count(self, stage: str, level: str, nation: str) -> tuple:
+        r"""(number of rows, null count of each column), read from arrow metadata without touching column data"""
+        table = feather.read_table(Store.path(self, stage, level, nation), memory_map=True)
+        return table.num_rows, pd.Series([column.null_count for column in table.columns],
+                                         index=table.column_names, dtype='float64')
+
+    def write_report(self, data: pd.DataFrame, stage: str, name: str):
+        r"""write report of stage as csv next to its partitions, {root}/{stage}/_{name}.csv"""
+        os.makedirs(os.path.join(self.root, stage), exist_ok=True)
+        data.to_csv(os.path.join(self.root, stage, f'_{name}.csv'), index=False)
+
+    def read_report(self, stage: str, name: str) -> pd.DataFrame:
+        r"""report written by write_report, None when it doesn't exist"""
+        path = os.path.join(self.root, stage, f'_{name}.csv')
+        if not os.path.isfile(path):
+            return None
+        return pd.read_csv(path)
+
+    def remove(self, stage: str):
+        r"""remove every partition of stage"""
+        shutil.rmtree(os.path.join(self.root, stage), ignore_errors=True)
+
+    def write_national(self, data: dict, stage: str):
+        r"""write {nation: [stu, sch, tch]} structure"""
+        for nation, data_ls in data.items():
+            for level, df in zip(LEVELS, data_ls):
+                Store.write(self, df, stage, level, nation)
+
+    def read_national(self, stage: str, columns: list = None) -> dict:
+        r"""read {nation: [stu, sch, tch]} structure"""
+        return {nation: [Store.read(self, stage, level, nation, columns=columns) for level in LEVELS]
+                for nation in Store.nations(self, stage)}
+
+    def write_key(self, stage: str, key: str):
+        r"""record stage cache key of data in store, so consumer can chain its own stage key"""
+        with open(os.path.join(self.root, stage, '_key'), 'w') as f:
+            f.write(key)
+
+    def read_key(self, stage: str) -> str:
+        path = os.path.join(self.root, stage, '_key')
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read().strip()
+
+    def write_meta(self, stage: str, meta: dict):
+        r"""record json serializable description of stage, like source of data"""
+        os.makedirs(os.path.join(self.root, stage), exist_ok=True)
+        with open(os.path.join(self.root, stage, '_meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def read_meta(self, stage: str) -> dict:
+        path = os.path.join(self.root, stage, '_meta.json')
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
@@ -0,0 +1,171 @@
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+
+class StreamingQuantile:
+    r"""
+    exact quantile of column streamed batch by batch, in two passes with memory of fixed bins
+    - pass 1(update): number and weight of values in each bin
+    - pass 2(collect): only values in bins of target order statistics are kept
+    - unweighted quantile is linear interpolation like groupby quantile of pandas,
+      weighted quantile is inverted cdf like weights.weighted_quantile
+    - value outside edges falls into first or last bin, result is still exact but that bin is kept whole
+    - NA value and, for weighted quantile, NA weight(as 0) are excluded like in memory
+
+    Examples
+    --------
+    quantile = StreamingQuantile(0.25)
+    for batch in batches(): quantile.update(batch['ESCS'])
+    for batch in batches(): quantile.collect(batch['ESCS'])
+    quantile.result()
+    """
+    def __init__(self, q: float, weighted: bool = False, edges: np.ndarray = None):
+        self.q = q
+        self.weighted = weighted
+        self.edges = np.linspace(-10, 10, 2**14 + 1) if edges is None else np.asarray(edges, dtype='float64')
+        self.counts = np.zeros(self.edges.shape[0] + 1, dtype='int64')
+        self.totals = np.zeros(self.edges.shape[0] + 1, dtype='float64')
+        self._targets = None
+        self._collected = dict() # {bin: list of (values, weights)}
+
+    def update(self, values, weights=None):
+        r"""pass 1, count values of batch in bins"""
+        values, weights = StreamingQuantile._valid(self, values, weights)
+        bins = np.searchsorted(self.edges, values, side='right')
+        self.counts += np.bincount(bins, minlength=self.counts.shape[0])
+        if self.weighted:
+            self.totals += np.bincount(bins, weights=weights, minlength=self.totals.shape[0])
+
+    def collect(self, values, weights=None):
+        r"""pass 2, keep values of batch in bins of target order statistics, every update should be done before"""
+        if self._targets is None:
+            self._targets = StreamingQuantile._target_bins(self)
+        values, weights = StreamingQuantile._valid(self, values, weights)
+        bins = np.searchsorted(self.edges, values, side='right')
+        for target in set(self._targets):
+            kept = bins == target
+            if kept.any():
+                self._collected.setdefault(target, []).append((values[kept], weights[kept]))
+
+    def result(self) -> float:
+        r"""quantile of every value streamed, NaN when there is no value(or weight)"""
+        if self._targets is None:
+            self._targets = StreamingQuantile._target_bins(self)
+        if len(self._targets) == 0:
+            return np.nan
+        if self.weighted:
+            values, weights = StreamingQuantile._sorted_bin(self, self._targets[0])
+            cumulative = np.cumsum(self.totals)
+            before = cumulative[self._targets[0] - 1] if self._targets[0] > 0 else 0.0
+            position = np.searchsorted(before + np.cumsum(weights), self.q * cumulative[-1], side='left')
+            return float(values[min(position, values.shape[0] - 1)])
+
+        total = int(self.counts.sum())
+        index = self.q * (total - 1)
+        lower = int(np.floor(index))
+        order = [lower, min(lower + 1, total - 1)]
+        value = []
+        for target, rank in zip(self._targets, order):
+            values, _ = StreamingQuantile._sorted_bin(self, target)
+            value.append(values[rank - self.counts[:target].sum()])
+        return float(value[0] + (value[1] - value[0]) * (index - lower))
+
+    def _valid(self, values, weights) -> tuple:
+        values = np.asarray(values, dtype='float64')
+        weights = np.ones(values.shape[0]) if weights is None else np.nan_to_num(np.asarray(weights, dtype='float64'), nan=0.0)
+        valid = ~np.isnan(values)
+        return values[valid], weights[valid]
+
+    def _target_bins(self) -> list:
+        r"""bins which contain target order statistics, [bin] for weighted and [lower bin, upper bin] for unweighted"""
+        if self.weighted:
+            cumulative = np.cumsum(self.totals)
+            if cumulative[-1] <= 0:
+                return []
+            return [int(np.flatnonzero((cumulative >= self.q * cumulative[-1]) & (self.counts > 0))[0])]
+        total = int(self.counts.sum())
+        if total == 0:
+            return []
+        lower = int(np.floor(self.q * (total - 1)))
+        return [int(np.searchsorted(np.cumsum(self.counts), rank, side='right'))
+                for rank in [lower, min(lower + 1, total - 1)]]
+
+    def _sorted_bin(self, target: int) -> tuple:
+        parts = self._collected.get(target, [])
+        values = np.concatenate([part[0] for part in parts]) if len(parts) > 0 else np.array([], dtype='float64')
+        weights = np.concatenate([part[1] for part in parts]) if len(parts) > 0 else np.array([], dtype='float64')
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+
+class StreamingDescribe:
+    r"""
+    column-wise count, NA ratio, mean, std, min and max of numeric columns streamed batch by batch
+    - mean and variance of batches are merged pairwise(Chan et al.), so nothing but one row per column is kept
+    - quartiles of describe_by need every value, they are not included
+    """
+    def __init__(self):
+        self.columns = None
+        self.rows = 0
+
+    def update(self, data: pd.DataFrame):
+        numeric = data.select_dtypes('number')
+        values = numeric.to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0.0).sum(axis=0) / count
+            m2 = np.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+        batch = {'count': count.astype('float64'), 'mean': mean, 'm2': m2,
+                 'min': np.where(valid, values, np.inf).min(axis=0, initial=np.inf),
+                 'max': np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf)}
+        if self.columns is None:
+            self.columns = list(numeric.columns)
+            self.stats = batch
+        else:
+            self.stats = StreamingDescribe._combine(self.stats, batch)
+        self.rows += data.shape[0]
+        return self
+
+    def merge(self, other: 'StreamingDescribe') -> 'StreamingDescribe':
+        r"""statistics of both, like of concatenated data, columns should be same"""
+        rs = StreamingDescribe()
+        described = [part for part in [self, other] if part.columns is not None]
+        if len(described) > 0:
+            rs.columns = described[0].columns
+            rs.stats = described[0].stats if len(described) == 1 else StreamingDescribe._combine(self.stats, other.stats)
+        rs.rows = self.rows + other.rows
+        return rs
+
+    def table(self) -> pd.DataFrame:
+        r"""index is column and columns are count, NA_ratio, mean, std, min, max, like describe_by"""
+        if self.columns is None:
+            return pd.DataFrame(columns=['count', 'NA_ratio', 'mean', 'std', 'min', 'max'])
+        count = self.stats['count']
+        empty = count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rs = pd.DataFrame({'count': count,
+                               'NA_ratio': np.round(100 - count / max(self.rows, 1) * 100, 2),
+                               'mean': np.where(empty, np.nan, self.stats['mean']),
+                               'std': np.where(count > 1, np.sqrt(self.stats['m2'] / (count - 1)), np.nan),
+                               'min': np.where(empty, np.nan, self.stats['min']),
+                               'max': np.where(empty, np.nan, self.stats['max'])}, index=self.columns)
+        return rs
+
+    @staticmethod
+    def _combine(left: dict, right: dict) -> dict:
+        count = left['count'] + right['count']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.nan_to_num(right['mean']) - np.nan_to_num(left['mean'])
+            share = np.where(count > 0, right['count'] / count, 0.0)
+            mean = np.nan_to_num(left['mean']) + delta * share
+            m2 = left['m2'] + right['m2'] + delta ** 2 * left['count'] * share
+        return {'count': count, 'mean': np.where(count > 0, mean, np.nan), 'm2': m2,
+                'min': np.minimum(left['min'], right['min']), 'max': np.maximum(left['max'], right['max'])}
@@ -0,0 +1,141 @@
+import os
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+# logging
+from src.utils import generate_logger
+from src.instrument import stage
+from src.model import DROP_COLUMNS, roughfix, fit_design
+from src.nation import group_rows, nation_name
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# directory
+App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+Result_dir = os.path.join(App_dir, 'result')
+
+
+class MDAAggregator:
+    r"""
+    streaming aggregation of MeanDecreaseAccuracy, replaces full_join glue of rf_loop and rf_loop2 in Analysis.r
+    - each fit is added as soon as it finishes, in any order
+    - table of nation is sumMDA over fits and its Percentage
+    """
+    def __init__(self):
+        self.sum_mda = dict()
+        self.fits = []
+
+    def add(self, nation: str, PV: int, replicate: int, mda: pd.Series):
+        if nation in self.sum_mda:
+            self.sum_mda[nation] = self.sum_mda[nation].add(mda, fill_value=0)
+        else:
+            self.sum_mda[nation] = mda.astype('float64')
+        self.fits.append(pd.DataFrame({'nation': nation, 'PV': PV, 'replicate': replicate,
+                                       'variable': mda.index, 'MeanDecreaseAccuracy': mda.to_numpy()}))
+
+    def table(self, nation: str) -> pd.DataFrame:
+        r"""sumMDA and Percentage of nation, descending"""
+        rs = pd.DataFrame({'sumMDA': self.sum_mda[nation]}).sort_values('sumMDA', ascending=False)
+        rs['Percentage'] = (rs['sumMDA'] / rs['sumMDA'].sum() * 100).round(2)
+        return rs
+
+    def long_table(self) -> pd.DataFrame:
+        r"""MeanDecreaseAccuracy of every fit, one row per fit and variable"""
+        return pd.concat(self.fits, axis=0, ignore_index=True)
+
+
+def design(merged: pd.DataFrame, imputers: dict = None) -> dict:
+    r"""imputed predictors of each nation, built once and shared by every PV and replicate
+    - imputers is {CNT label: RoughFix} of EDA.imputer[option], fitted statistics are reused when given
+
+    Returns
+    -------
+    dict
+        {nation: (row mask of nation in merged, imputed predictors)}
+    """
+    rs = dict()
+    for nation_label, rows in group_rows(merged, key='CNT').items():
+        nation = nation_name(nation_label)
+        mask = np.zeros(merged.shape[0], dtype=bool)
+        mask[rows] = True
+        predictors = merged.loc[mask].drop([col for col in DROP_COLUMNS + ['resilient'] if col in merged.columns], axis=1)
+        imputer = None if imputers is None else imputers.get(nation_label)
+        rs[nation] = (mask, roughfix(predictors) if imputer is None else imputer.transform(predictors))
+    return rs
+
+
+@stage
+def sweep(merged: pd.DataFrame,
+          label: np.ndarray,
+          PV_list: list,
+          replicates: int = 1,
+          ntree: int = 5000,
+          jobs: int = 1,
+          seed: int = 41,
+          tol: float = None,
+          importance_samples: int = None,
+          imputers: dict = None) -> tuple:
+    r"""run random forest on PV x nation x replicate grid in one worker pool
+
+    Parameters
+    ----------
+    merged: pd.DataFrame
+        predictors of every nation, like EDA.data_merged_PV[option][0]
+    label: np.ndarray
+        (student x PV) resilient label, column order follows PV_list
+    replicates: int
+        number of fits with different split and forest seed per PV and nation, like rf_loop
+    jobs: int
+        number of threads, each fit is one task of the pool
+
+    Returns
+    -------
+    tuple
+        (MDAAggregator, stats of every fit)
+    """
+    designs = design(merged, imputers=imputers)
+    grid = [(IDX, PV, nation, replicate) for IDX, PV in enumerate(PV_list)
+            for nation in designs.keys() for replicate in range(replicates)]
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+
+    def run(IDX, PV, nation, replicate, seed_seq):
+        mask, predictors = designs[nation]
+        rs = fit_design(predictors, label[mask, IDX], ntree=ntree, n_jobs=1,
+                        seed=int(seed_seq.generate_state(1)[0]), tol=tol, importance_samples=importance_samples)
+        return PV, nation, replicate, rs
+
+    aggregator = MDAAggregator()
+    stats = []
+    tasks = (delayed(run)(*cell, seed_seq) for cell, seed_seq in zip(grid, seeds))
+    for PV, nation, replicate, rs in Parallel(n_jobs=jobs, prefer='threads', return_as='generator')(tasks):
+        aggregator.add(nation, PV, replicate, rs['mda']['MeanDecreaseAccuracy'])
+        stats.append({'PV': PV, 'nation': nation, 'replicate': replicate, **rs['stats']})
+        logger.debug(f"PV{PV} {nation} #{replicate}: accuracy {rs['stats']['Accuracy']:.4f}, {len(stats)}/{len(grid)} fits done")
+    return aggregator, pd.DataFrame(stats)
+
+
+def main(merged: pd.DataFrame,
+         label: np.ndarray,
+         PV_list: list,
+         option: str = 'sliced',
+         replicates: int = 1,
+         ntree: int = 5000,
+         jobs: int = 1,
+         seed: int = 41,
+         tol: float = None,
+         importance_samples: int = None,
+         imputers: dict = None) -> MDAAggregator:
+    r"""run sweep and write result/sweep_{option}_{nation}.csv(sumMDA, Percentage),
+    result/sweep_{option}_fits.csv(MDA of every fit) and result/sweep_{option}_stats.csv
+    """
+    aggregator, stats = sweep(merged, label, PV_list, replicates=replicates, ntree=ntree, jobs=jobs, seed=seed, tol=tol,
+                            importance_samples=importance_samples, imputers=imputers)
+    os.makedirs(Result_dir, exist_ok=True)
+    for nation in aggregator.sum_mda.keys():
+        aggregator.table(nation).to_csv(os.path.join(Result_dir, f'sweep_{option}_{nation}.csv'), index_label='variable')
+    aggregator.long_table().to_csv(os.path.join(Result_dir, f'sweep_{option}_fits.csv'), index=False)
+    stats.to_csv(os.path.join(Result_dir, f'sweep_{option}_stats.csv'), index=False)
+    return aggregator
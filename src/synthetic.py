@@ -0,0 +1,231 @@
+import os
+import re
+import logging
+from logging.config import dictConfig
+import tempfile
+import zipfile
+import numpy as np
+import pandas as pd
+import pyreadstat
+
+# logging
+from src.utils import generate_logger
+from src.instrument import stage
+from src.load import Load
+from src.store import LEVELS
+from src.weights import FINAL_WEIGHT, REPLICATE_WEIGHTS, WEIGHT_COLUMNS
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# {CNTRYID label: (CNTRYID, CNT)}, nations of Load.nation_code come first, others are filtered out by Load
+NATIONS = {'Korea': (410.0, 'KOR'), 'United States': (840.0, 'USA'), 'Japan': (392.0, 'JPN'),
+           'Germany': (276.0, 'DEU'), 'Finland': (246.0, 'FIN'), 'Canada': (124.0, 'CAN')}
+LIKERT = {1.0: 'Strongly disagree', 2.0: 'Disagree', 3.0: 'Agree', 4.0: 'Strongly agree'}
+DATABASE = {'stu': 'CY07_MSU_STU_QQQ', 'sch': 'CY07_MSU_SCH_QQQ', 'tch': 'CY07_MSU_TCH_QQQ'}
+ITEM_PREFIX = {'stu': 'ST', 'sch': 'SC', 'tch': 'TC'}
+PV_COLUMNS = [f'PV{PV}READ' for PV in range(1, 11)]
+
+
+def synthetic_codebook(items: tuple = (30, 10, 10)) -> pd.DataFrame:
+    r"""codebook of synthetic data, identifiers + ESCS + PVs + weights + items of each level
+
+    Parameters
+    ----------
+    items: tuple
+        number of student, school and teacher items, odd ones are likert items(ST001Q01TA) and
+        even ones are continuous index(STIDX002) like derived variable of PISA
+    """
+    rows = [('identifier', DATABASE['stu'], col, '') for col in ['CNTRYID', 'CNT', 'CNTSCHID', 'CNTSTUID']]
+    rows += [('background', DATABASE['stu'], 'ESCS', 'Index of economic, social and cultural status')]
+    rows += [('achievement', DATABASE['stu'], col, 'Plausible value in reading') for col in PV_COLUMNS]
+    rows += [('weight', DATABASE['stu'], col, 'Final student weight' if col == FINAL_WEIGHT else 'Replicate weight')
+             for col in WEIGHT_COLUMNS]
+    for level, count in zip(LEVELS, items):
+        for IDX in range(1, count + 1):
+            code = f'{ITEM_PREFIX[level]}{IDX:03d}Q01TA' if IDX % 2 == 1 else f'{ITEM_PREFIX[level]}IDX{IDX:03d}'
+            rows.append((f'{level} questionnaire', DATABASE[level], code, f'synthetic {level} item {IDX}'))
+    return pd.DataFrame(rows, columns=['category', 'Database', 'variable_code', 'description'])
+
+
+def codebook_items(codebook: pd.DataFrame) -> dict:
+    r"""{level: item columns} of codebook, level is decided by Database(SCH, TCH, otherwise student)
+    - identifiers, ESCS, PVs and weights are generated separately
+    """
+    rs = {level: [] for level in LEVELS}
+    reserved = set(['CNTRYID', 'CNT', 'CNTSCHID', 'CNTTCHID', 'CNTSTUID', 'ESCS'] + PV_COLUMNS + WEIGHT_COLUMNS)
+    for database, code in zip(codebook['Database'].astype(str), codebook['variable_code'].astype(str)):
+        if code in reserved:
+            continue
+        level = 'sch' if 'SCH' in database.upper() else 'tch' if 'TCH' in database.upper() else 'stu'
+        rs[level].append(code)
+    return rs
+
+
+def _is_likert(code: str) -> bool:
+    r"""questionnaire item like ST097Q01TA is labelled likert item, others are continuous index"""
+    return re.match(r'^(ST|SC|TC)\d{3}Q', code) is not None
+
+
+def _hadamard(size: int) -> np.ndarray:
+    r"""sylvester hadamard matrix, size is power of 2"""
+    rs = np.ones((1, 1), dtype='int8')
+    while rs.shape[0] < size:
+        rs = np.block([[rs, rs], [rs, -rs]])
+    return rs
+
+
+def _items(rng: np.random.Generator,
+           codes: list,
+           trait: np.ndarray,
+           item_na: float,
+           dropout: float) -> pd.DataFrame:
+    r"""items of respondents, loaded on standardized trait so that they carry signal
+
+    NA pattern
+    - each item has its own NA ratio, drawn around item_na
+    - dropout ratio of respondents stop answering at random item, every later item is NA(not reached)
+    """
+    n = trait.shape[0]
+    loading = rng.normal(0, 0.5, len(codes))
+    latent = trait[:, None] * loading[None, :] + rng.normal(0, 1, (n, len(codes)))
+    values = np.empty((n, len(codes)), dtype='float64')
+    likert = np.array([_is_likert(code) for code in codes], dtype=bool)
+    values[:, likert] = np.clip(np.round(2.5 + 0.8 * latent[:, likert]), 1, 4)
+    values[:, ~likert] = np.round(latent[:, ~likert], 4)
+
+    na_ratio = rng.beta(1.2, 1.2 / max(item_na, 1e-6) - 1.2, len(codes)) if item_na > 0 else np.zeros(len(codes))
+    is_na = rng.random((n, len(codes))) < na_ratio[None, :]
+    stop = np.where(rng.random(n) < dropout, rng.integers(0, max(len(codes), 1), n), len(codes))
+    is_na |= np.arange(len(codes))[None, :] >= stop[:, None]
+    values[is_na] = np.nan
+    return pd.DataFrame(values, columns=codes)
+
+
+def _filler(rng: np.random.Generator, n: int, level: str, count: int) -> pd.DataFrame:
+    r"""columns which are not in codebook, real files have hundreds of them and reader has to skip them"""
+    values = np.round(rng.normal(0, 1, (n, count)), 4)
+    values[rng.random((n, count)) < 0.1] = np.nan
+    return pd.DataFrame(values, columns=[f'{ITEM_PREFIX[level]}UNUSED{IDX:04d}' for IDX in range(1, count + 1)])
+
+
+def synthetic_nation(rng: np.random.Generator,
+                     nation: str,
+                     items: dict,
+                     students: int,
+                     students_per_school: int = 35,
+                     teachers_per_school: int = 10,
+                     item_na: float = 0.05,
+                     dropout: float = 0.03,
+                     filler_columns: tuple = (0, 0, 0)) -> list:
+    r"""student, school and teacher data of one nation, with PISA layout
+    - CNTSCHID and CNTSTUID are unique over every nation(CNTRYID * 100000 + sequence)
+    - ESCS has school effect, reading score depends on ESCS and school, PV1READ~PV10READ are draws around it
+    - W_FSTUWT and 80 Fay BRR replicate weights(W_FSTURWT1~80) use pairs of schools as variance zones
+    """
+    cntryid, cnt = NATIONS[nation]
+    n_school = max(2, int(np.ceil(students / students_per_school)))
+    school_id = cntryid * 100000 + np.arange(1, n_school + 1)
+    school = rng.integers(0, n_school, students)
+    school_escs = rng.normal(rng.normal(0, 0.3), 0.5, n_school)
+    school_effect = rng.normal(0, 40, n_school)
+
+    escs = school_escs[school] + rng.normal(0, 0.85, students)
+    score = rng.normal(480, 10) + 35 * escs + school_effect[school] + rng.normal(0, 70, students)
+    stu = pd.DataFrame({'CNTRYID': cntryid, 'CNT': cnt,
+                        'CNTSCHID': school_id[school],
+                        'CNTSTUID': cntryid * 100000 + np.arange(1, students + 1, dtype='float64'),
+                        'ESCS': np.where(rng.random(students) < 0.02, np.nan, np.round(escs, 4))})
+    for col in PV_COLUMNS:
+        stu[col] = np.round(score + rng.normal(0, 25, students), 3)
+    stu[FINAL_WEIGHT] = np.round(rng.gamma(4, 5, n_school)[school], 5)
+    zone, unit = (school // 2) % 80, school % 2
+    sign = _hadamard(128)[zone][:, :80] * np.where(unit == 0, 1, -1)[:, None]
+    weights = stu[FINAL_WEIGHT].to_numpy()[:, None] * (1 + 0.5 * sign)
+    stu = pd.concat([stu, pd.DataFrame(weights, columns=REPLICATE_WEIGHTS),
+                     _items(rng, items['stu'], (score - score.mean()) / score.std(), item_na, dropout),
+                     _filler(rng, students, 'stu', filler_columns[0])], axis=1)
+    stu = stu.sort_values(['CNTSCHID', 'CNTSTUID'], ignore_index=True)
+
+    school_trait = (school_effect - school_effect.mean()) / max(school_effect.std(), 1e-6)
+    sch = pd.DataFrame({'CNTRYID': cntryid, 'CNT': cnt, 'CNTSCHID': school_id})
+    sch_items = _items(rng, items['sch'], school_trait, item_na, 0)
+    sch_items.loc[rng.random(n_school) < 0.05] = np.nan # school non-response
+    sch = pd.concat([sch, sch_items, _filler(rng, n_school, 'sch', filler_columns[1])], axis=1)
+
+    teacher_school = np.repeat(np.arange(n_school), teachers_per_school)
+    tch = pd.DataFrame({'CNTRYID': cntryid, 'CNT': cnt, 'CNTSCHID': school_id[teacher_school],
+                        'CNTTCHID': cntryid * 100000 + np.arange(1, teacher_school.shape[0] + 1, dtype='float64')})
+    tch = pd.concat([tch, _items(rng, items['tch'], school_trait[teacher_school], item_na, dropout),
+                     _filler(rng, teacher_school.shape[0], 'tch', filler_columns[2])], axis=1)
+    return [stu, sch, tch]
+
+
+def write_spss_zip(data: pd.DataFrame, zipfile_dir: str, member: str):
+    r"""write dataframe as labelled spss file, member of zip archive like OECD download"""
+    labels = {'CNTRYID': {code: name for name, (code, _) in NATIONS.items()},
+              'CNT': {cnt: name for name, (_, cnt) in NATIONS.items()}}
+    labels.update({col: LIKERT for col in data.columns if _is_likert(col)})
+    with tempfile.TemporaryDirectory(prefix='pisa_synthetic_') as tmp_dir:
+        spss_path = os.path.join(tmp_dir, os.path.basename(member))
+        pyreadstat.write_sav(data, spss_path, variable_value_labels=labels)
+        with zipfile.ZipFile(zipfile_dir, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zip_folder:
+            zip_folder.write(spss_path, arcname=member)
+
+
+@stage
+def generate(data_dir: str,
+             students: int = 6000,
+             nations: list = None,
+             codebook: pd.DataFrame = None,
+             students_per_school: int = 35,
+             teachers_per_school: int = 10,
+             item_na: float = 0.05,
+             dropout: float = 0.03,
+             filler_columns: tuple = (100, 20, 20),
+             seed: int = 0) -> dict:
+    r"""write synthetic PISA 2018 archives(SPSS_STU_QQQ.zip, SPSS_SCH_QQQ.zip, SPSS_TCH_QQQ.zip)
+    and codebook.xlsx into data_dir, so that every command runs without OECD download
+
+    Parameters
+    ----------
+    students: int
+        number of students per nation, scale of data
+    nations: list
+        CNTRYID labels of NATIONS, Korea, United States and two other nations by default
+    codebook: pd.DataFrame
+        items of codebook are generated, like data/codebook(sample).xlsx. synthetic_codebook() when None.
+        identifiers, ESCS, PVs and weights are added to written codebook when missing
+    item_na: float
+        mean NA ratio of item
+    dropout: float
+        ratio of respondents who stop answering questionnaire in the middle
+    filler_columns: tuple
+        number of student, school and teacher columns which are not in codebook
+
+    Returns
+    -------
+    dict
+        {level: shape of whole file}
+    """
+    nations = list(NATIONS.keys())[:4] if nations is None else nations
+    codebook = synthetic_codebook() if codebook is None else codebook
+    required = synthetic_codebook(items=(0, 0, 0))
+    codebook = pd.concat([required[~required['variable_code'].isin(codebook['variable_code'])], codebook],
+                         ignore_index=True)
+    items = codebook_items(codebook)
+
+    rng = np.random.default_rng(seed)
+    data = [synthetic_nation(rng, nation, items, students, students_per_school=students_per_school,
+                             teachers_per_school=teachers_per_school, item_na=item_na, dropout=dropout,
+                             filler_columns=filler_columns) for nation in nations]
+
+    os.makedirs(data_dir, exist_ok=True)
+    codebook.to_excel(os.path.join(data_dir, 'codebook.xlsx'), index=False)
+    rs = dict()
+    for IDX, level in enumerate(LEVELS):
+        level_data = pd.concat([national[IDX] for national in data], axis=0, ignore_index=True)
+        zip_name, member = Load.spss_member[level]
+        write_spss_zip(level_data, os.path.join(data_dir, zip_name), member)
+        rs[level] = level_data.shape
+        logger.debug(f'{zip_name}: {level_data.shape}')
+    return rs
@@ -1,22 +1,46 @@
 import os
-from functools import wraps
-import time
-import pickle
-
-def timeit(func):
-    @wraps(func)
-    def timeit_wrapper(*args, **kwargs):
-        start_time = time.perf_counter()
-        result = func(*args, **kwargs)
-        end_time = time.perf_counter()
-        total_time = end_time - start_time
-        print(f'Function {func.__name__} Took: {total_time:.4f} seconds')
-        return result
-    return timeit_wrapper
+import sys
+import numpy as np
+import pandas as pd
+import psutil
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+App_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+Log_dir = os.path.join(App_dir, 'logs')
+
+def peak_rss() -> float:
+    r"""peak resident set size of current process in MB
+    - on linux VmHWM is read, since reset_peak_rss resets it while ru_maxrss is never reset
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024 # KB
+    except OSError:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KB on linux
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / 1024**2
+
+
+def reset_peak_rss():
+    r"""reset peak RSS so next measurement covers only next stage, only linux supports it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
 
 
 def generate_logger(file_name:str):
-    r"""generate logger config"""
+    r"""generate logger config, log file is written in logs folder of project wherever process is started"""
+    os.makedirs(Log_dir, exist_ok=True)
     logger_config = {
         "version": 1,
         "disable_existing_loggers": False,
@@ -28,7 +52,7 @@ def generate_logger(file_name:str):
                 "class": "logging.FileHandler",
                 "formatter": "simple",
                 "level": "DEBUG",
-                "filename": f"./logs/{file_name}.log"
+                "filename": os.path.join(Log_dir, f"{file_name}.log")
             },
             "console": {
                 "class": "logging.StreamHandler",
@@ -47,9 +71,62 @@ def generate_logger(file_name:str):
     return logger_config
 
 
-def load_data(pkl_path: str):
-    r"""load data which cleaed after load.py"""
-    assert os.path.isfile(pkl_path)
-    with open(pkl_path, 'rb') as f:
-        loadedData = pickle.load(f)
-    return loadedData
\ No newline at end of file
+def row_wise_na(data: pd.DataFrame, na_threshold: int, groups: dict = None) -> dict:
+    r"""count NA per student in one array pass over stacked nations
+    - result of each group is taken by row positions, not recomputed
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        students of every nation
+    na_threshold: int
+        row which has more NA than threshold is marked to drop
+    groups: dict
+        {label: row positions}, like nation.group_rows
+
+    Returns
+    -------
+    dict
+        {label: {'count': np.ndarray, 'ratio': np.ndarray, 'drop': np.ndarray}}, label is 'full' or label of groups
+    """
+    count = data.isna().to_numpy().sum(axis=1)
+    rs = {'full': {'count': count,
+                   'ratio': np.round(count / data.shape[1] * 100, 0),
+                   'drop': count > na_threshold}}
+    for label, rows in ({} if groups is None else groups).items():
+        rs[label] = {key: value[rows] for key, value in rs['full'].items()}
+    return rs
+
+
+def describe_by(data: pd.DataFrame, key: str, full: str = 'Full') -> dict:
+    r"""column-wise describe table of whole data and of each group, NA ratio next to count
+    - statistics of every group are computed in one group-by, not one describe per group
+
+    Returns
+    -------
+    dict
+        {full: pd.DataFrame, label: pd.DataFrame}, index of table is column
+        and columns are count, NA_ratio, mean, std, min, 25%, 50%, 75%, max like pd.DataFrame.describe
+    """
+    numeric = data.select_dtypes('number')
+    rs = {full: _describe_groups(numeric, np.zeros(data.shape[0], dtype='int8'))[0]}
+    for label, table in _describe_groups(numeric, data[key]).items():
+        rs[str(label)] = table
+    return rs
+
+
+def _describe_groups(numeric: pd.DataFrame, by) -> dict:
+    grouped = numeric.groupby(by, observed=True, sort=False)
+    size = grouped.size()
+    stats = {name: getattr(grouped, name)() for name in ['count', 'mean', 'std', 'min', 'max']}
+    quantile = grouped.quantile([0.25, 0.5, 0.75])
+    rs = dict()
+    for label in size.index:
+        table = pd.DataFrame({'count': stats['count'].loc[label].astype('float64')})
+        table['NA_ratio'] = round(100 - table['count'] / size[label] * 100, 2)
+        table['mean'], table['std'], table['min'] = stats['mean'].loc[label], stats['std'].loc[label], stats['min'].loc[label]
+        for q in [0.25, 0.5, 0.75]:
+            table[f'{q:.0%}'] = quantile.loc[(label, q)]
+        table['max'] = stats['max'].loc[label]
+        rs[label] = table
+    return rs
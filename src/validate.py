@@ -0,0 +1,86 @@
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+
+# logging
+from src.utils import generate_logger
+from src.store import Store, LEVELS
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+
+def na_ratio_matrix(data: dict, columns: dict = None) -> pd.DataFrame:
+    r"""NA ratio of every level x column by nation
+
+    Parameters
+    ----------
+    data: dict
+        {nation: [stu, sch, tch]} structure
+    columns: dict
+        {level index: columns to check}, every column is checked when None
+
+    Returns
+    -------
+    pd.DataFrame
+        index is (level, column), one column per nation, column missing in a nation is NA
+    """
+    ratio = dict()
+    for nation, data_ls in data.items():
+        per_level = dict()
+        for IDX, (level, df) in enumerate(zip(LEVELS, data_ls)):
+            if columns is not None:
+                df = df[[col for col in df.columns if col in columns[IDX]]]
+            # isna is evaluated block by block, not column by column
+            per_level[level] = pd.Series(df.isna().to_numpy().mean(axis=0) if df.shape[0] > 0 else np.zeros(df.shape[1]),
+                                         index=df.columns, dtype='float64')
+        ratio[nation] = pd.concat(per_level, names=['level', 'column'])
+    return pd.DataFrame(ratio)
+
+
+def store_na_ratio_matrix(store: Store, stage: str) -> pd.DataFrame:
+    r"""na_ratio_matrix of stage in columnar store, only null count in arrow metadata is read"""
+    ratio = dict()
+    for nation in store.nations(stage):
+        per_level = dict()
+        for level in LEVELS:
+            num_rows, null_count = store.null_count(stage, level, nation)
+            per_level[level] = null_count / max(num_rows, 1)
+        ratio[nation] = pd.concat(per_level, names=['level', 'column'])
+    return pd.DataFrame(ratio)
+
+
+def na_diff_report(matrix: pd.DataFrame, threshold: float = 0.8) -> pd.DataFrame:
+    r"""cross-country report of na_ratio_matrix
+
+    column is invalid in a nation when its NA ratio is over threshold,
+    mismatch is True when column is invalid in some nations but not in others
+
+    Returns
+    -------
+    pd.DataFrame
+        level, column, {nation}_ratio, {nation}_invalid, mismatch
+    """
+    invalid = matrix > threshold
+    report = pd.concat([matrix.add_suffix('_ratio'), invalid.add_suffix('_invalid')], axis=1)
+    report['mismatch'] = invalid.any(axis=1) & ~invalid.all(axis=1)
+    return report.reset_index()
+
+
+def check_na_report(report: pd.DataFrame, strict: bool = False):
+    r"""warn mismatch columns of na_diff_report by level
+    - with many nations some column is almost always invalid only in some of them, so it is not an error by default
+    - strict: raise ValueError when there is any mismatch column
+    """
+    mismatch = report[report['mismatch']]
+    for level, group in mismatch.groupby('level', sort=False):
+        logger.warning(f'check your codebook, some {level} column has too many NA value in some nations, {list(group["column"])}')
+    if strict and (mismatch.shape[0] > 0):
+        raise ValueError(f'your codebook have invalid features, data count is invalid btw countries: {list(mismatch["column"])}')
+
+
+def validate_store(store: Store, stage: str = 'cleaned', threshold: float = 0.8) -> pd.DataFrame:
+    r"""na_diff_report of stage, without loading dataframe"""
+    report = na_diff_report(store_na_ratio_matrix(store, stage), threshold=threshold)
+    logger.debug(f"{stage}: {report['mismatch'].sum()} columns mismatch between nations")
+    return report
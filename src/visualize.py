@@ -0,0 +1,106 @@
+import os
+import logging
+from logging.config import dictConfig
+from functools import lru_cache
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# this module is imported only when figure is drawn, so matplotlib and font lookup don't slow down other commands
+sns.set_style("darkgrid")
+plt.rcParams['axes.unicode_minus'] = False
+plt.rcParams["figure.autolayout"] = True
+
+# korean font, first installed one is used
+FONT_CANDIDATES = ('Malgun Gothic', 'AppleGothic', 'NanumGothic', 'Noto Sans CJK KR')
+
+
+@lru_cache(maxsize=None)
+def resolve_font(candidates: tuple = FONT_CANDIDATES) -> str:
+    r"""first installed font of candidates, None when nothing is installed
+    - font list is read once per process
+    - missing font is never set, so matplotlib doesn't search fallback font for every text
+    """
+    from matplotlib import font_manager
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    for name in candidates:
+        if name in installed:
+            return name
+    logger.warning(f'none of {candidates} is installed, korean text may be broken')
+    return None
+
+
+def use_font():
+    font = resolve_font()
+    if font is not None:
+        plt.rcParams['font.family'] = font
+
+
+def na_ratio_histogram(for_histogram: dict,
+                       path: str,
+                       titles: dict = None,
+                       xlabel: str = '\nNA ratio(%)\n',
+                       ylabel: str = 'frequency',
+                       ncols: int = 3):
+    r"""histogram of row-wise NA ratio of full data and each nation, ncols subplots per row
+
+    Parameters
+    ----------
+    for_histogram: dict
+        {'full': ratio, nation: ratio, ...}
+    titles: dict
+        title of each subplot, key itself is used when title is not given
+    """
+    use_font()
+    titles = {'full': '\nFull Data\n', **({} if titles is None else titles)}
+    nrows = -(-len(for_histogram) // ncols)
+    fig = plt.figure(figsize=(17, 6 * nrows))
+    for IDX, (label, ratio) in enumerate(for_histogram.items()):
+        plt.subplot(nrows, ncols, IDX+1)
+        plt.hist(ratio)
+        plt.title(titles.get(label, f'\n{label}\n'))
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+    plt.savefig(path)
+    plt.close(fig)
+
+
+def threshold_histogram(data: dict,
+                        option: str,
+                        threshold_info: dict,
+                        nation_real_name: dict,
+                        path: str):
+    r"""histogram of academic score and ESCS of each nation with thresholds
+
+    Parameters
+    ----------
+    data: dict
+        {nation: pd.DataFrame}, dataframe should have AcademicScore and ESCS column, one row of subplots per nation
+    option: str
+        full or sliced, ESCS threshold is drawn only on full
+    """
+    use_font()
+    fig = plt.figure(figsize=(17, 4.5 * len(data)))
+    for IDX, (nationalName, inputNational) in enumerate(data.items()):
+        real_name = nation_real_name.get(nationalName, nationalName)
+
+        plt.subplot(len(data), 2, 2*IDX+1)
+        plt.hist(inputNational['AcademicScore'])
+        plt.title(f'\nAcademic Achievement{real_name}\n')
+        plt.xlabel('\nScore\n')
+        plt.axvline(threshold_info[nationalName]['academic_score'], color='r', linewidth=1, linestyle='--')
+
+        plt.subplot(len(data), 2, 2*IDX+2)
+        plt.hist(inputNational['ESCS'])
+        plt.title(f'\nESCS{real_name}\n')
+        plt.xlabel('\nScore\n')
+        if option=='full':
+            plt.axvline(threshold_info[nationalName]['escs_score'], color='r', linewidth=1, linestyle='--')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    plt.savefig(path)
+    plt.close(fig)
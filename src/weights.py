@@ -0,0 +1,197 @@
+import logging
+from logging.config import dictConfig
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# final student weight and Fay's BRR replicate weights of PISA 2018, read when listed in codebook
+FINAL_WEIGHT = 'W_FSTUWT'
+REPLICATE_WEIGHTS = [f'W_FSTURWT{IDX}' for IDX in range(1, 81)]
+WEIGHT_COLUMNS = [FINAL_WEIGHT] + REPLICATE_WEIGHTS
+FAY_FACTOR = 0.5
+
+
+def weight_matrix(data: pd.DataFrame, columns: list = WEIGHT_COLUMNS) -> np.ndarray:
+    r"""(student x weight) float64 matrix, first column is final weight and others are replicate weights
+    - NA weight is 0, so that student is excluded from that estimate
+    """
+    missing = [col for col in columns if col not in data.columns]
+    if len(missing) > 0:
+        raise ValueError(f'weight columns {missing[:3]}{"..." if len(missing) > 3 else ""} are not in data, '
+                         f'add {FINAL_WEIGHT} and W_FSTURWT1~80 to codebook')
+    return data[columns].to_numpy(dtype='float64', na_value=0.0)
+
+
+def group_codes(data: pd.DataFrame, key: str) -> tuple:
+    r"""(group code of each row, labels of codes), code is position in order of appearance and NA key is -1"""
+    codes, labels = pd.factorize(data[key], sort=False)
+    return codes.astype('int64'), [str(label) for label in labels]
+
+
+def weighted_quantile(values: np.ndarray,
+                      weights: np.ndarray,
+                      q: float,
+                      codes: np.ndarray = None,
+                      n_groups: int = None) -> np.ndarray:
+    r"""weighted quantile of each group under every weight column at once
+    - smallest value whose cumulative weight reaches q of group total(inverted cdf), percentile of PISA
+    - rows are sorted once by group and value, every weight column shares that order,
+      so 81 weights cost one sort and one cumulative sum over (student x weight) matrix
+    - NA value and row of code -1 are excluded
+
+    Parameters
+    ----------
+    values: np.ndarray
+        (student, )
+    weights: np.ndarray
+        (student, weight), or (student, ) for one weight
+    codes: np.ndarray
+        group code of each row, from 0 to n_groups - 1. every row is one group when None
+
+    Returns
+    -------
+    np.ndarray
+        (group, weight), NaN for group which has no weight
+    """
+    values = np.asarray(values, dtype='float64')
+    weights = np.asarray(weights, dtype='float64').reshape(values.shape[0], -1)
+    codes = np.zeros(values.shape[0], dtype='int64') if codes is None else np.asarray(codes, dtype='int64')
+    n_groups = int(codes.max()) + 1 if n_groups is None else n_groups
+    if (n_groups == 0) or (values.shape[0] == 0):
+        return np.full((n_groups, weights.shape[1]), np.nan)
+
+    valid = np.flatnonzero((codes >= 0) & ~np.isnan(values))
+    order = valid[np.lexsort((values[valid], codes[valid]))]
+    sorted_codes = codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(n_groups), side='left')
+    ends = np.searchsorted(sorted_codes, np.arange(n_groups), side='right')
+
+    # cumulative weight inside group, from one cumulative sum over every group
+    cum = np.vstack([np.zeros((1, weights.shape[1])), np.cumsum(weights[order], axis=0)])
+    before, total = cum[starts], cum[ends] - cum[starts]
+    below = (cum[1:] - before[sorted_codes]) < (q * total)[sorted_codes]
+    below = np.vstack([np.zeros((1, weights.shape[1]), dtype='int64'), np.cumsum(below, axis=0)])
+    position = np.minimum(starts[:, None] + (below[ends] - below[starts]), np.maximum(ends - 1, 0)[:, None])
+
+    rs = values[order][position] if order.shape[0] > 0 else np.full(position.shape, np.nan)
+    rs[(total <= 0) | (ends == starts)[:, None]] = np.nan
+    return rs
+
+
+def group_total(indicator: np.ndarray,
+                weights: np.ndarray,
+                codes: np.ndarray,
+                n_groups: int) -> np.ndarray:
+    r"""weighted total of each indicator column in each group under every weight column,
+    one sparse (group x indicator, student) @ (student, weight) product
+
+    Parameters
+    ----------
+    indicator: np.ndarray
+        (student, indicator) of 0 and 1(or any value to sum), like resilient label of each PV
+    weights: np.ndarray
+        (student, weight)
+
+    Returns
+    -------
+    np.ndarray
+        (group, indicator, weight)
+    """
+    indicator = np.asarray(indicator, dtype='float64').reshape(codes.shape[0], -1)
+    n_indicator = indicator.shape[1]
+    row, column = np.nonzero((indicator != 0) & (codes >= 0)[:, None])
+    by_group = sparse.csr_matrix((indicator[row, column], (codes[row] * n_indicator + column, row)),
+                                 shape=(n_groups * n_indicator, codes.shape[0]))
+    return np.asarray(by_group @ weights).reshape(n_groups, n_indicator, -1)
+
+
+def weighted_proportion(indicator: np.ndarray,
+                        weights: np.ndarray,
+                        codes: np.ndarray,
+                        n_groups: int) -> np.ndarray:
+    r"""weighted share of indicator in each group under every weight column, (group, indicator, weight)"""
+    total = group_total(np.ones((codes.shape[0], 1)), weights, codes, n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return group_total(indicator, weights, codes, n_groups) / total
+
+
+def replicate_variance(estimates: np.ndarray, fay: float = FAY_FACTOR) -> np.ndarray:
+    r"""sampling variance of Fay's BRR, last axis is estimate of (final weight, replicate 1 ~ R)"""
+    replicates = estimates.shape[-1] - 1
+    return ((estimates[..., 1:] - estimates[..., :1]) ** 2).sum(axis=-1) / (replicates * (1 - fay) ** 2)
+
+
+def rubin(estimates: np.ndarray, fay: float = FAY_FACTOR) -> dict:
+    r"""combine estimates of plausible values with Rubin's rules
+
+    Parameters
+    ----------
+    estimates: np.ndarray
+        (..., PV, weight), weight axis is (final weight, replicate 1 ~ R)
+
+    Returns
+    -------
+    dict
+        estimate: mean of final weight estimates over PVs
+        sampling_variance: mean of BRR variance over PVs
+        imputation_variance: variance of final weight estimates between PVs, 0 for one PV
+        se: sqrt(sampling_variance + (1 + 1 / PV) * imputation_variance)
+    """
+    n_PV = estimates.shape[-2]
+    point = estimates[..., 0]
+    sampling = replicate_variance(estimates, fay=fay).mean(axis=-1)
+    imputation = point.var(axis=-1, ddof=1) if n_PV > 1 else np.zeros(point.shape[:-1])
+    return {'estimate': point.mean(axis=-1),
+            'sampling_variance': sampling,
+            'imputation_variance': imputation,
+            'se': np.sqrt(sampling + (1 + 1 / n_PV) * imputation)}
+
+
+def resilient_estimates(data: pd.DataFrame,
+                        acad_threshold: int,
+                        PV_list: list,
+                        key: str,
+                        escs_q: float = 0.25,
+                        weights: list = WEIGHT_COLUMNS,
+                        fay: float = FAY_FACTOR) -> pd.DataFrame:
+    r"""weighted ESCS threshold and resilient ratio of each group with standard errors of PISA
+    - ESCS threshold is escs_q weighted quantile, computed again under every replicate weight
+    - resilient student is over acad_threshold in PV and under ESCS threshold of same weight,
+      ratio of full is over every student and ratio of sliced is over students under ESCS threshold
+    - every (group x PV x weight) estimate comes from one sort and two sparse products,
+      PVs are combined with Rubin's rules
+
+    Returns
+    -------
+    pd.DataFrame
+        index is (group label, statistic), columns are estimate, se, sampling_variance, imputation_variance, students.
+        ratio is in percent
+    """
+    codes, labels = group_codes(data, key)
+    w = weight_matrix(data, weights)
+    escs = data['ESCS'].to_numpy(dtype='float64', na_value=np.nan)
+    threshold = weighted_quantile(escs, w, escs_q, codes, len(labels)) # (group, weight)
+
+    row_threshold = np.where((codes >= 0)[:, None], threshold[np.maximum(codes, 0)], np.nan)
+    low_weight = w * (escs[:, None] < row_threshold) # weight of students under threshold of each weight
+    acad = data[[f'PV{PV}READ' for PV in PV_list]].to_numpy(dtype='float64', na_value=np.nan) > acad_threshold
+
+    resilient = group_total(acad, low_weight, codes, len(labels)) # (group, PV, weight)
+    ones = np.ones((codes.shape[0], 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = {'resilient_ratio_full': resilient / group_total(ones, w, codes, len(labels)) * 100,
+                 'resilient_ratio_sliced': resilient / group_total(ones, low_weight, codes, len(labels)) * 100}
+
+    combined = {'escs_threshold': rubin(threshold[:, None, :], fay=fay),
+                **{name: rubin(value, fay=fay) for name, value in ratio.items()}}
+    students = np.bincount(codes[codes >= 0], minlength=len(labels))
+    rs = pd.concat({name: pd.DataFrame({**result, 'students': students}, index=pd.Index(labels, name=key))
+                    for name, result in combined.items()}, names=['statistic']).swaplevel()
+    rs = rs.reindex(pd.MultiIndex.from_product([labels, list(combined.keys())], names=[key, 'statistic']))
+    logger.debug(f'weighted estimates of {len(labels)} groups, {len(PV_list)} PVs and {w.shape[1]} weights')
+    return rs
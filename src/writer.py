@@ -0,0 +1,138 @@
+import os
+import logging
+from logging.config import dictConfig
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# logging
+from src.utils import generate_logger
+dictConfig(generate_logger(__name__))
+logger = logging.getLogger(__name__)
+
+# excel is written one by one in background, interpreter waits for it before exit
+_excel_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='excel_writer')
+
+
+def _write_parquet(data: pd.DataFrame, path: str):
+    data.to_parquet(path, index=False)
+
+
+def _write_feather(data: pd.DataFrame, path: str):
+    data.reset_index(drop=True).to_feather(path)
+
+
+WRITERS = {'parquet': (_write_parquet, '.parquet'),
+           'feather': (_write_feather, '.feather')}
+
+
+def write_frames(frames: dict,
+                 path_stem: str,
+                 fmt: str = 'parquet') -> list:
+    r"""write each dataframe as one binary file, {path_stem}_{name}.{fmt}
+
+    Parameters
+    ----------
+    frames: dict
+        {name: pd.DataFrame}, like {'full': ..., 'sliced': ...}
+    fmt: str
+        parquet or feather
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f'invalid format, only {list(WRITERS.keys())} allowed')
+    os.makedirs(os.path.dirname(path_stem), exist_ok=True)
+    write, extension = WRITERS[fmt]
+
+    paths = []
+    for name, data in frames.items():
+        paths.append(f'{path_stem}_{name}{extension}')
+        write(data, paths[-1])
+        logger.debug(f'write {paths[-1]}: {data.shape}')
+    return paths
+
+
+class FrameAppender:
+    r"""
+    append dataframes to one parquet(row group per write) or feather(record batch per write) file,
+    so that result larger than memory is written batch by batch
+    - schema is fixed by first dataframe, later ones are cast to it
+    - file is written to temporary path and appears at path on close, reader never sees half written file
+    """
+    def __init__(self, path: str, fmt: str = 'parquet'):
+        if fmt not in WRITERS:
+            raise ValueError(f'invalid format, only {list(WRITERS.keys())} allowed')
+        self.path = path
+        self.fmt = fmt
+        self.schema = None
+        self.rows = 0
+        self._tmp_path = f'{path}.tmp{os.getpid()}'
+        self._writer = None
+
+    def write(self, data: pd.DataFrame):
+        # record batch is written even without row, so that categories of empty partition are kept
+        batch = pa.RecordBatch.from_pandas(data, preserve_index=False)
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.schema = batch.schema
+            if self.fmt == 'parquet':
+                self._writer = pq.ParquetWriter(self._tmp_path, self.schema)
+            else:
+                self._writer = pa.ipc.new_file(self._tmp_path, self.schema) # uncompressed, can be memory-mapped
+        elif not batch.schema.equals(self.schema, check_metadata=False):
+            batch = batch.cast(self.schema)
+        self._writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_path, self.path)
+        logger.debug(f'write {self.path}: {self.rows} rows')
+
+    def abort(self):
+        r"""close and remove temporary file, nothing is written at path"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.isfile(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            FrameAppender.close(self)
+        else:
+            FrameAppender.abort(self)
+
+
+def write_excel(frames: dict,
+                path: str,
+                background: bool = True):
+    r"""write each dataframe as sheet of one excel file
+
+    Parameters
+    ----------
+    frames: dict
+        {sheet_name: pd.DataFrame}
+    background: bool
+        write in background thread and return future, else write and return None
+    """
+    def write():
+        with pd.ExcelWriter(path) as writer:
+            for sheet_name, data in frames.items():
+                data.to_excel(writer, sheet_name=sheet_name, index=False)
+        logger.debug(f'write {path}')
+
+    if background:
+        return _excel_executor.submit(write)
+    write()
+
+
+def wait_excel():
+    r"""block until every background excel file is written"""
+    _excel_executor.submit(lambda: None).result()
@@ -0,0 +1,42 @@
+import os
+import pandas as pd
+from src.cache import StageCache, flatten, unflatten
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = StageCache(str(tmp_path))
+    key = cache.key('clean', 'archive', {'na_threshold': 30})
+    assert key == cache.key('clean', 'archive', {'na_threshold': 30})
+    assert key != cache.key('clean', 'archive', {'na_threshold': 40})
+    assert cache.get(key) is None
+
+    data = pd.DataFrame({'a': [1.0, 2.0, None], 'b': pd.Categorical(['x', 'y', 'x'])})
+    cache.put(key, {'SK': data}, meta={'rows': 3})
+    frames, meta = cache.get(key)
+    pd.testing.assert_frame_equal(frames['SK'], data)
+    assert meta == {'rows': 3}
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    data = pd.DataFrame({'a': range(1000)})
+    cache = StageCache(str(tmp_path))
+    keys = [cache.key('stage', IDX) for IDX in range(3)]
+    for IDX, key in enumerate(keys):
+        cache.put(key, {'data': data})
+        os.utime(os.path.join(cache.root, key, 'meta.json'), (IDX, IDX))
+    cache.get(keys[0]) # first entry becomes most recently used
+
+    # room for two entries, so only least recently used one is removed
+    cache.max_bytes = sum(os.path.getsize(os.path.join(cache.root, key, name))
+                          for key in [keys[0], keys[2]] for name in os.listdir(os.path.join(cache.root, key)))
+    cache.evict()
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+def test_flatten_round_trip():
+    data = {'SK': [pd.DataFrame({'a': [1]}), pd.DataFrame({'b': [2]})], 'US': {'x': pd.DataFrame({'c': [3]})}}
+    rs = unflatten(flatten(data))
+    assert list(rs['SK'][1].columns) == ['b']
+    assert list(rs['US']['x'].columns) == ['c']
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from src.model import RandomForest, confusion_matrix
+
+
+def classification_data(rows=400, seed=6):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.normal(size=(rows, 6)), columns=[f'x{IDX}' for IDX in range(6)])
+    label = pd.Series((data['x0'] + 0.5 * data['x1'] + rng.normal(scale=0.5, size=rows) > 0).astype('int64'))
+    return data, label
+
+
+def test_early_stopped_forest_is_prefix_of_full_forest():
+    data, label = classification_data()
+    full = RandomForest(ntree=400, batch_size=25, seed=1).fit(data, label)
+    stopped = RandomForest(ntree=400, batch_size=25, seed=1, tol=0.01, top_k=3).fit(data, label)
+
+    assert full.ntree_ == 400
+    assert stopped.ntree_ < 400
+    assert stopped.ntree_ % 25 == 0
+    np.testing.assert_array_equal(stopped.oob_error_, full.oob_error_[:stopped.ntree_])
+    for tree, reference in zip(stopped.trees, full.trees):
+        np.testing.assert_array_equal(tree.tree_.threshold, reference.tree_.threshold)
+    assert list(stopped.importance().index[:2]) == ['x0', 'x1']
+
+
+def test_confusion_matrix_positive_class():
+    reference = np.array([1, 1, 1, 0, 0, 0, 0])
+    pred = np.array([1, 1, 0, 0, 0, 1, 0])
+    table, stats = confusion_matrix(pred, reference)
+    assert table.loc[1, 1] == 2 and table.loc[0, 1] == 1
+    assert stats['Positive Class'] == 1
+    assert stats['Sensitivity'] == 2 / 3
+    assert stats['Specificity'] == 3 / 4
+
+    _, only_negative = confusion_matrix(np.zeros(3, dtype='int64'), np.zeros(3, dtype='int64'))
+    assert np.isnan(only_negative['Sensitivity'])
+    assert only_negative['Specificity'] == 1.0
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from src.nation import group_quantile, resolve_nations, split_by_nation
+from src.weights import weighted_quantile
+
+
+def nation_data(rng, rows=600):
+    return pd.DataFrame({'CNTRYID': pd.Categorical(rng.choice(['Korea', 'United States', 'Finland'], size=rows)),
+                         'ESCS': rng.normal(size=rows),
+                         'W_FSTUWT': rng.uniform(1, 10, size=rows)})
+
+
+def test_group_quantile_matches_each_nation():
+    rng = np.random.default_rng(4)
+    data = nation_data(rng)
+    data.loc[::11, 'ESCS'] = np.nan
+    nations = resolve_nations(['Korea', 'Finland', 'Japan'])
+    rs = group_quantile(data, 'ESCS', 0.25, nations)
+    weighted = group_quantile(data, 'ESCS', 0.25, nations, weight='W_FSTUWT')
+
+    assert list(rs.keys()) == ['SK', 'Finland', 'Japan']
+    for nation, label in [('SK', 'Korea'), ('Finland', 'Finland')]:
+        rows = data[data['CNTRYID'] == label]
+        assert rs[nation] == rows['ESCS'].quantile(0.25)
+        assert weighted[nation] == weighted_quantile(rows['ESCS'].to_numpy(), rows['W_FSTUWT'].to_numpy(), 0.25)[0, 0]
+    assert np.isnan(rs['Japan']) and np.isnan(weighted['Japan'])
+
+
+def test_split_by_nation_keeps_rows_in_order():
+    data = nation_data(np.random.default_rng(5), rows=50)
+    rs = split_by_nation(data, resolve_nations(['Finland', 'Japan']))
+    pd.testing.assert_frame_equal(rs['Finland'], data[data['CNTRYID'] == 'Finland'].reset_index(drop=True))
+    assert rs['Japan'].shape == (0, 3)
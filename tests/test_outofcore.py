@@ -0,0 +1,53 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+from src import outofcore, synthetic
+from src.load import Load
+from src.eda import EDA
+
+PV_LIST = [1, 2]
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    data_dir = tmp_path_factory.mktemp('synthetic')
+    synthetic.generate(str(data_dir), students=300, filler_columns=(5, 2, 2))
+    return data_dir
+
+
+def copy_archive(archive, data_dir):
+    os.makedirs(data_dir)
+    for path in glob.glob(os.path.join(archive, '*.zip')) + [os.path.join(archive, 'codebook.xlsx')]:
+        os.symlink(path, os.path.join(data_dir, os.path.basename(path)))
+    return str(data_dir)
+
+
+def test_out_of_core_is_same_as_in_memory(archive, tmp_path):
+    memory_dir = copy_archive(archive, tmp_path / 'memory')
+    Load('codebook.xlsx', data_dir=memory_dir, nations='all').defaultCleaner()
+    eda = EDA('codebook.xlsx', data_dir=memory_dir, result_dir=str(tmp_path / 'memory_result'), weighted=True)
+    eda.join_splited_data()
+    eda.drop_student(na_threshold=30)
+    eda.slice_by_ESCS_all_PV(acad_threshold=480, PV_list=PV_LIST)
+    eda.estimate_weighted(acad_threshold=480, PV_list=PV_LIST)
+    eda.minor_adjustment_all_PV()
+    eda.save_result_all_PV()
+
+    # small batches, so every nation is streamed in several batches
+    outofcore.main(nations='all', PV_list=PV_LIST, weighted=True, batch_size=70,
+                   data_dir=copy_archive(archive, tmp_path / 'outofcore'), result_dir=str(tmp_path / 'outofcore_result'))
+
+    files = sorted(os.path.basename(path) for path in glob.glob(str(tmp_path / 'memory_result' / '*')))
+    assert [f'preprocessing{PV}_{kind}.parquet' for PV in PV_LIST for kind in ['full', 'sliced']] \
+        == [name for name in files if name.endswith('.parquet')]
+    assert 'weighted_estimates.csv' in files
+    for name in files:
+        expected, rs = tmp_path / 'memory_result' / name, tmp_path / 'outofcore_result' / name
+        if name.endswith('.parquet'):
+            pd.testing.assert_frame_equal(pd.read_parquet(rs), pd.read_parquet(expected))
+        elif name == 'weighted_estimates.csv':
+            expected, rs = pd.read_csv(expected), pd.read_csv(rs)
+            assert rs.shape[0] > 0
+            pd.testing.assert_frame_equal(rs, expected, check_exact=False, rtol=1e-10)
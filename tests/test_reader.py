@@ -0,0 +1,18 @@
+import pandas as pd
+import pytest
+from src.reader import label_order
+from src.validate import check_na_report
+
+
+def test_label_order_follows_spss_code():
+    labels = ['Strongly disagree', 'Disagree', 'Agree', 'Strongly agree']
+    categories = ['Agree', 'Disagree', 'Other', 'Strongly agree']
+    assert label_order(categories, labels) == ['Disagree', 'Agree', 'Strongly agree', 'Other']
+
+
+def test_check_na_report_raises_only_when_strict():
+    report = pd.DataFrame({'level': ['student', 'school'], 'column': ['ST001', 'SC001'], 'mismatch': [True, False]})
+    check_na_report(report)
+    with pytest.raises(ValueError, match='ST001'):
+        check_na_report(report, strict=True)
+    check_na_report(report[~report['mismatch']], strict=True)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.streaming import StreamingQuantile, StreamingDescribe
+from src.weights import weighted_quantile
+
+
+def batches(data, size=137):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def stream(quantile, values, weights=None):
+    weights = [None] * len(batches(values)) if weights is None else batches(weights)
+    for value, weight in zip(batches(values), weights):
+        quantile.update(value, weight)
+    for value, weight in zip(batches(values), weights):
+        quantile.collect(value, weight)
+    return quantile.result()
+
+
+@pytest.mark.parametrize('q', [0.0, 0.25, 0.5, 0.97, 1.0])
+def test_streaming_quantile_matches_pandas(q):
+    rng = np.random.default_rng(1)
+    values = rng.normal(scale=2, size=1000)
+    values[::17] = np.nan
+    # narrow edges put most values into first and last bin, result is still exact
+    for edges in [None, np.linspace(-1, 1, 9)]:
+        assert stream(StreamingQuantile(q, edges=edges), values) == pytest.approx(pd.Series(values).quantile(q))
+
+
+@pytest.mark.parametrize('q', [0.1, 0.25, 0.5])
+def test_streaming_weighted_quantile_matches_in_memory(q):
+    rng = np.random.default_rng(2)
+    values = np.round(rng.normal(size=1000), 2) # ties
+    weights = rng.uniform(0, 5, size=1000)
+    weights[::23] = np.nan
+    expected = weighted_quantile(values, np.nan_to_num(weights), q)[0, 0]
+    assert stream(StreamingQuantile(q, weighted=True), values, weights) == expected
+
+
+def test_streaming_quantile_without_value_is_nan():
+    assert np.isnan(stream(StreamingQuantile(0.5), np.full(10, np.nan)))
+
+
+def test_streaming_describe_matches_pandas_describe():
+    rng = np.random.default_rng(3)
+    data = pd.DataFrame({'a': rng.normal(size=500),
+                         'b': pd.array(rng.integers(0, 5, size=500), dtype='Int8'),
+                         'c': np.full(500, np.nan),
+                         'label': pd.Categorical(rng.choice(['x', 'y'], size=500))})
+    data.loc[rng.choice(500, 60, replace=False), 'a'] = np.nan
+    data.loc[rng.choice(500, 10, replace=False), 'b'] = pd.NA
+
+    left, right = StreamingDescribe(), StreamingDescribe()
+    for IDX, part in enumerate(batches(data, size=64)):
+        (left if IDX % 2 == 0 else right).update(part)
+    rs = left.merge(right).table()
+
+    expected = data.select_dtypes('number').astype('float64').describe().T
+    assert list(rs.index) == ['a', 'b', 'c']
+    for column in ['count', 'mean', 'std', 'min', 'max']:
+        np.testing.assert_allclose(rs[column], expected[column], rtol=1e-10)
+    np.testing.assert_allclose(rs['NA_ratio'], np.round(data[['a', 'b', 'c']].isna().mean().to_numpy() * 100, 2))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from src.weights import weighted_quantile, replicate_variance, rubin
+
+
+def reference_quantile(values, weights, q):
+    r"""smallest value whose cumulative weight reaches q of total, NA value excluded"""
+    valid = ~np.isnan(values)
+    values, weights = values[valid], weights[valid]
+    order = np.argsort(values, kind='stable')
+    cumulative = np.cumsum(weights[order])
+    if cumulative.shape[0] == 0 or cumulative[-1] <= 0:
+        return np.nan
+    return values[order][np.searchsorted(cumulative, q * cumulative[-1], side='left')]
+
+
+@pytest.mark.parametrize('q', [0.1, 0.25, 0.5, 0.9])
+def test_weighted_quantile_matches_reference(q):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=500)
+    values[rng.choice(500, 30, replace=False)] = np.nan
+    weights = rng.uniform(0, 3, size=(500, 4))
+    codes = rng.integers(-1, 3, size=500)
+    rs = weighted_quantile(values, weights, q, codes, 3)
+    assert rs.shape == (3, 4)
+    for group in range(3):
+        for column in range(4):
+            rows = codes == group
+            assert rs[group, column] == reference_quantile(values[rows], weights[rows, column], q)
+
+
+def test_weighted_quantile_unit_weight_is_inverted_cdf():
+    values = np.array([3.0, 1.0, 4.0, 2.0])
+    assert weighted_quantile(values, np.ones(4), 0.5)[0, 0] == 2.0
+    assert weighted_quantile(values, np.ones(4), 0.51)[0, 0] == 3.0
+    assert np.isnan(weighted_quantile(values, np.zeros(4), 0.5)[0, 0])
+
+
+def test_replicate_variance_of_fay_brr():
+    estimates = np.array([10.0, 11.0, 9.0, 10.0, 12.0])
+    # (1 + 1 + 0 + 4) / (4 * 0.5 ** 2)
+    assert replicate_variance(estimates) == pytest.approx(6.0)
+    assert replicate_variance(estimates, fay=0.0) == pytest.approx(1.5)
+
+
+def test_rubin_combines_plausible_values():
+    estimates = np.array([[10.0, 11.0, 9.0],
+                          [12.0, 12.0, 14.0]]) # (PV, weight)
+    rs = rubin(estimates)
+    sampling = np.mean([(1 + 1) / (2 * 0.25), (0 + 4) / (2 * 0.25)])
+    assert rs['estimate'] == pytest.approx(11.0)
+    assert rs['sampling_variance'] == pytest.approx(sampling)
+    assert rs['imputation_variance'] == pytest.approx(2.0)
+    assert rs['se'] == pytest.approx(np.sqrt(sampling + 1.5 * 2.0))
+
+    single = rubin(estimates[:1])
+    assert single['imputation_variance'] == 0
+    assert single['se'] == pytest.approx(np.sqrt(4.0))